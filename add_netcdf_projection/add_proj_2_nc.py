@@ -1,67 +1,128 @@
 from netCDF4 import Dataset
+from pyproj import CRS
+from pyproj.exceptions import CRSError
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
 import argparse
-import os.path
-from urllib.request import urlopen
-import re
+import json
+import os
+import sys
+import time
 
+from nc_chunks import PROFILES, profile_options, source_options, iter_slabs
 
-def strip_chars(edit_str, bad_chars='[(){}<>,"_]=\nns'):
-    result = ''.join([s for s in edit_str if s not in bad_chars])
 
-    return result
+# On disk cache of the grid mapping attributes by EPSG code
+CACHE_FILE = os.path.expanduser(os.path.join("~", ".cache", "add_proj_2_nc",
+                                                            "epsg.json"))
 
+# In memory copy of the cache so each code is resolved once per process
+_epsg_cache = {}
 
-def gather_utm_meta(epsg_str,epsg):
+
+def load_cache(cache_file=CACHE_FILE):
+    """
+    Loads the on disk cache of grid mapping attributes into memory.
+    """
+    if cache_file != None and os.path.isfile(cache_file):
+        with open(cache_file) as fp:
+            _epsg_cache.update(json.load(fp))
+
+
+def save_cache(cache_file=CACHE_FILE):
+    """
+    Writes the in memory cache of grid mapping attributes to disk.
+    """
+    if cache_file == None:
+        return
+
+    if not os.path.isdir(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file))
+
+    # Write then rename so concurrent stamping never reads half a file
+    tmp = "{}.{}".format(cache_file, os.getpid())
+    with open(tmp, 'w') as fp:
+        json.dump(_epsg_cache, fp, indent=2, sort_keys=True)
+    os.replace(tmp, cache_file)
+
+
+def gather_map_meta(epsg, cache_file=CACHE_FILE):
     """
-    Use if the EPSG data is associated to UTM
-    Gathers the data and returns a dictionary of data and attributes that need
-    to be added to the netcdf based on
+    Resolves an EPSG code using the local PROJ database and returns a
+    dictionary of CF grid mapping attributes to add to the projection
+    variable, based on
     https://www.unidata.ucar.edu/software/thredds/current/netcdf-java/reference/StandardCoordinateTransforms.html
 
+    Results are memoized in memory and on disk so no network is needed.
+
+    Args:
+        epsg: EPSG code as an int or string
+        cache_file: JSON file for caching results, None disables it
+
+    Returns:
+        dict: attributes for the projection variable
     """
-    meta = epsg_str.lower()
+    key = str(epsg)
 
-    map_meta = {
-                    "grid_mapping_name": "universal_transverse_mercator",
-                    "utm_zone_number": None,
-                    "semi_major_axis": None,
-                    "inverse_flattening": None,
-                    'spatial_ref':epsg_str,
-                    "_CoordinateTransformType": "projection",
-                    "_CoordinateAxisTypes": "GeoX GeoY"}
+    if key not in _epsg_cache:
+        load_cache(cache_file)
 
-    # Assign the zone number
-    zone_str = meta.split('zone')[1]
-    map_meta['utm_zone_number'] = float((strip_chars(zone_str.split(',')[0])).strip()[-2:])
+    if key not in _epsg_cache:
+        try:
+            crs = CRS.from_epsg(int(epsg))
+        except (CRSError, ValueError):
+            raise ValueError("EPSG code {} is not in the local PROJ database"
+                             "".format(epsg))
 
-    # Assign the semi_major_axis
-    axis_string = meta.split('spheroid')[1]
-    map_meta['semi_major_axis'] = float(axis_string.split(',')[1])
+        map_meta = crs.to_cf()
+        map_meta["spatial_ref"] = crs.to_wkt("WKT1_GDAL")
+        map_meta["_CoordinateTransformType"] = "projection"
+        map_meta["_CoordinateAxisTypes"] = "GeoX GeoY"
 
-    # Assing the flattening
-    map_meta["inverse_flattening"] = float(strip_chars(axis_string.split(',')[2]))
+        if crs.utm_zone != None:
+            map_meta["utm_zone_number"] = float(crs.utm_zone[:-1])
 
-    return map_meta
+        _epsg_cache[key] = map_meta
+        save_cache(cache_file)
 
+    return dict(_epsg_cache[key])
 
-def copy_nc(infile, outfile, exclude=None):
+
+def copy_nc(infile, outfile, exclude=None, profile=None, max_size=2**24,
+                                          callback=None, verbose=False):
     """
-    Copies a netcdf from one to another exactly.
+    Copies a netcdf from one to another exactly. Variables are copied in slabs
+    along their first dimension so a whole variable is never in memory and
+    the compression and chunking of the source is kept unless a profile is
+    given.
 
     Args:
-        infile: filename you want to copy
+        infile: filename you want to copy or can also be instantiated dataset object
         outfile: output filename
         toexclude: variables to exclude
+        profile: Name of an output profile in PROFILES
+        max_size: Maximum number of values to read at once
+        callback: Function called as callback(name, index, data) for every
+                  slab, if it returns an array that is written instead
+        verbose: Print the copy throughput
 
     Returns the output netcdf dataset object for modifying
     """
     if type(exclude) != list:
         exclude = [exclude]
 
+    start = time.time()
+    nbytes = 0
+
     dst = Dataset(outfile, "w")
 
-    with Dataset(infile) as src:
+    if type(infile) == str:
+        src = Dataset(infile, 'r')
+    else:
+        src = infile
 
+    # Don't leave a half written output open if the copy fails
+    try:
         # copy global attributes all at once via dictionary
         dst.setncatts(src.__dict__)
 
@@ -70,40 +131,79 @@ def copy_nc(infile, outfile, exclude=None):
             dst.createDimension(
                 name, (len(dimension) if not dimension.isunlimited() else None))
 
+        sizes = {d: len(v) for d, v in src.dimensions.items()}
+
         # copy all file data except for the excluded
         for name, variable in src.variables.items():
             if name not in exclude:
-                dst.createVariable(name, variable.datatype, variable.dimensions)
-                dst[name][:] = src[name][:]
+                if profile == None:
+                    options = source_options(variable)
+                else:
+                    options = profile_options(profile, variable.datatype,
+                                              variable.dimensions, sizes)
+
+                # Fill values can only be set on creation
+                attrs = variable.__dict__
+                fill_value = attrs.pop('_FillValue', None)
+
+                dst.createVariable(name, variable.datatype, variable.dimensions,
+                                                            fill_value=fill_value,
+                                                            **options)
+
+                # copy variable attributes all at once via dictionary, before the
+                # data so packed variables are scaled correctly
+                dst[name].setncatts(attrs)
+
+                for index in iter_slabs(variable, max_size=max_size):
+                    data = variable[index]
+
+                    if callback != None:
+                        result = callback(name, index, data)
+                        if result is not None:
+                            data = result
+
+                    dst[name][index] = data
+                    nbytes += getattr(data, 'nbytes', 0)
+
+    except Exception:
+        dst.close()
+        raise
+
+    finally:
+        if type(infile) == str:
+            src.close()
+
+    if verbose:
+        elapsed = max(time.time() - start, 1e-9)
+        print("Copied {:0.1f} MB in {:0.1f}s ({:0.1f} MB/s)".format(
+               nbytes / 1024.0**2, elapsed, nbytes / 1024.0**2 / elapsed))
 
-                # copy variable attributes all at once via dictionary
-                dst[name].setncatts(src[name].__dict__)
     return dst
 
 
-def add_proj(nc_obj,epsg):
+def add_proj(nc_obj,epsg,verbose=True):
     """
         Adds the appropriate attributes to the netcdf for managing projection info
 
         Args:
         nc_obj: netCDF4 dataset object needing the projection information
         epsg:   projection information to be added
+        verbose: print the attributes being added
         Returns:
         nc_obj: the netcdf object modified
     """
-    # function to generate .prj file information using spatialreference.org
-    # access projection information
-    try:
-        wkt = urlopen("http://spatialreference.org/ref/epsg/{0}/prettywkt/".format(epsg))
-    except:
-        wkt = urlopen("http://spatialreference.org/ref/sr-org/{0}/prettywkt/".format(epsg))
-
-    # remove spaces between charachters
-    remove_spaces = ((wkt.read()).decode('utf-8')).replace(" ","")
-    # Add in the variable for holding coordinate system info
-    map_meta = parse_wkt(remove_spaces,epsg)
-
-    nc_obj.createVariable("projection","S1")
+    # Resolve the projection locally
+    map_meta = gather_map_meta(epsg)
+
+    if verbose:
+        print(" Meta information to be added...\n")
+        for k,v in map_meta.items():
+            print(k,repr(v))
+
+    # Add in the variable for holding coordinate system info, files stamped
+    # in place may already have one
+    if "projection" not in nc_obj.variables:
+        nc_obj.createVariable("projection","S1")
     nc_obj["projection"].setncatts(map_meta)
 
     for name,var in nc_obj.variables.items():
@@ -125,18 +225,74 @@ def add_proj(nc_obj,epsg):
     return nc_obj
 
 
-def parse_wkt(epsg_string,epsg):
+def stamp_in_place(fname, epsg, verbose=False):
+    """
+    Adds the projection variable and grid_mapping attributes to an existing
+    netcdf without copying or reading any of its data.
+
+    Args:
+        fname: netcdf to modify
+        epsg: projection information to be added
+        verbose: print the attributes being added
+
+    Returns:
+        str: the filename stamped
+    """
+    with Dataset(fname, 'a') as ds:
+        add_proj(ds, epsg, verbose=verbose)
+
+    return fname
+
+
+def _stamp(fname, epsg):
     """
+    Worker for stamping a tree, catches errors so one bad file doesn't stop
+    the rest.
     """
-    map_meta = {}
-    wkt_data = (epsg_string.lower()).split(',')
+    try:
+        stamp_in_place(fname, epsg)
+        return fname, None
+
+    except Exception as e:
+        return fname, str(e)
 
-    if 'utm' in epsg_string.lower():
-        map_meta = gather_utm_meta(epsg_string,epsg)
-    print(" Meta information to be added...\n")
-    for k,v in map_meta.items():
-        print(k,repr(v))
-    return map_meta
+
+def stamp_tree(directory, epsg, workers=4, pattern="*.nc"):
+    """
+    Stamps every netcdf in a directory tree in place using a process pool.
+
+    Args:
+        directory: top of the directory tree to search
+        epsg: projection information to be added
+        workers: number of files to stamp at once
+        pattern: glob pattern files must match
+
+    Returns:
+        dict: filename to error message for files that failed
+    """
+    fnames = []
+    for root, dirs, files in os.walk(directory):
+        for f in sorted(files):
+            if fnmatch(f, pattern):
+                fnames.append(os.path.join(root, f))
+
+    # Resolve once up front so the workers inherit the cache
+    gather_map_meta(epsg)
+
+    print("Stamping {} files with EPSG {}...".format(len(fnames), epsg))
+
+    failed = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for fname, error in pool.map(_stamp, fnames,
+                                             [epsg] * len(fnames)):
+            if error != None:
+                print("Failed to stamp {}: {}".format(fname, error))
+                failed[fname] = error
+
+    print("Stamped {} files, {} failed".format(len(fnames) - len(failed),
+                                                len(failed)))
+
+    return failed
 
 
 def main():
@@ -148,7 +304,8 @@ def main():
     p.add_argument('-f','--netcdf', dest='netcdf',
                         required=True,
                         help="Path to a netcdf you want to add projection "
-                        "information to")
+                        "information to or a directory of netcdfs to stamp in"
+                        " place")
 
     p.add_argument('-o','--output', dest='output',
                         required=False,
@@ -162,15 +319,49 @@ def main():
                         help="EPSG value representing the projection information to"
                         "add to the netcdf")
 
+    p.add_argument('-p','--profile', dest='profile',
+                        required=False,
+                        default=None,
+                        choices=list(PROFILES.keys()),
+                        help="Output profile setting compression and chunking"
+                        " of the copy")
+
+    p.add_argument('-i','--in-place', dest='in_place',
+                        action='store_true',
+                        help="Add the projection to the netcdf itself instead"
+                        " of writing a copy")
+
+    p.add_argument('-w','--workers', dest='workers',
+                        type=int,
+                        default=4,
+                        help="Number of files to stamp at once when given a"
+                        " directory")
+
+    p.add_argument('--pattern', dest='pattern',
+                        default='*.nc',
+                        help="Glob pattern of files to stamp when given a"
+                        " directory")
+
     args = p.parse_args()
 
 
     infile = os.path.abspath(args.netcdf)
-    outfile = os.path.abspath(args.output)
-    outds = copy_nc(infile, outfile)
-    outds = add_proj(outds,args.epsg)
-    outds.sync()
-    outds.close()
+
+    if os.path.isdir(infile):
+        failed = stamp_tree(infile, args.epsg, workers=args.workers,
+                                               pattern=args.pattern)
+        if failed:
+            sys.exit(1)
+
+    elif args.in_place:
+        stamp_in_place(infile, args.epsg, verbose=True)
+
+    else:
+        outfile = os.path.abspath(args.output)
+        outds = copy_nc(infile, outfile, profile=args.profile, verbose=True)
+        outds = add_proj(outds,args.epsg)
+        outds.sync()
+        outds.close()
 
 if __name__ =='__main__':
     main()
@@ -0,0 +1,114 @@
+"""
+Output profiles and slab reads shared by the tools that copy netcdfs, so a
+copy made by any of them is compressed, chunked and read the same way.
+"""
+
+
+# Output profiles for createVariable. Images (2D+) are tiled in y and x and
+# compressed, quantization only applies to floating point images.
+PROFILES = {'fast': {'complevel': 1,
+                     'shuffle': False,
+                     'least_significant_digit': None,
+                     'tile': 512},
+            'archive': {'complevel': 9,
+                        'shuffle': True,
+                        'least_significant_digit': None,
+                        'tile': 256},
+            'web': {'complevel': 4,
+                    'shuffle': True,
+                    'least_significant_digit': 3,
+                    'tile': 256},
+            }
+
+
+def profile_options(profile, datatype, dimensions, sizes):
+    """
+    Builds the createVariable keyword arguments for a variable using a named
+    output profile. Coordinates and scalars are always left alone.
+
+    Args:
+        profile: Name of a profile in PROFILES or None for no compression
+        datatype: numpy dtype of the variable
+        dimensions: list of dimension names of the variable
+        sizes: dictionary of dimension name to length
+
+    Returns:
+        dict: keyword arguments for createVariable
+    """
+    if profile == None or len(dimensions) < 2:
+        return {}
+
+    settings = PROFILES[profile]
+    options = {'zlib': True,
+               'complevel': settings['complevel'],
+               'shuffle': settings['shuffle']}
+
+    # One step of any leading dimension and a tile of y, x
+    chunks = [1] * (len(dimensions) - 2)
+    chunks += [max(min(sizes[d], settings['tile']), 1) for d in dimensions[-2:]]
+    options['chunksizes'] = chunks
+
+    lsd = settings['least_significant_digit']
+    if lsd != None and getattr(datatype, 'kind', '') == 'f':
+        options['least_significant_digit'] = lsd
+
+    return options
+
+
+def source_options(variable):
+    """
+    Reads the compression and chunking settings of a variable so a copy can be
+    written the same way.
+
+    Args:
+        variable: netCDF4 variable
+
+    Returns:
+        dict: keyword arguments for createVariable
+    """
+    options = {}
+
+    filters = variable.filters()
+    if filters != None:
+        for k in ['zlib', 'complevel', 'shuffle', 'fletcher32']:
+            if k in filters:
+                options[k] = filters[k]
+
+    chunking = variable.chunking()
+    if chunking == 'contiguous':
+        options['contiguous'] = True
+    elif chunking != None:
+        options['chunksizes'] = chunking
+
+    return options
+
+
+def iter_slabs(variable, max_size=2**24):
+    """
+    Yields slices along the first dimension of a variable so each read is
+    about max_size values, aligned to the on disk chunking when there is one.
+
+    Args:
+        variable: netCDF4 variable
+        max_size: Maximum number of values to read at once
+
+    Returns:
+        generator of index expressions
+    """
+    shape = variable.shape
+
+    if len(shape) == 0:
+        yield Ellipsis
+        return
+
+    row = 1
+    for n in shape[1:]:
+        row *= n
+    step = max(max_size // max(row, 1), 1)
+
+    chunking = variable.chunking()
+    if chunking != 'contiguous' and chunking != None:
+        step = max((step // chunking[0]) * chunking[0], chunking[0])
+
+    for start in range(0, shape[0], step):
+        yield slice(start, min(start + step, shape[0]))
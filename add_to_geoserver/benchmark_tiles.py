@@ -0,0 +1,142 @@
+"""
+Publishes the same synthetic basin as a netcdf and as a cloud optimized
+GeoTIFF to a local stand in geoserver, then reports the latency of 256x256
+GetMap tiles at several zoom levels for each. Zoom 0 is the whole basin in
+one tile, each level after halves the tile width.
+"""
+from upload import AWSM_Geoserver
+from stand_in_server import serve_in_background
+from netCDF4 import Dataset
+from tempfile import mkdtemp
+from shutil import rmtree
+import numpy as np
+import argparse
+import requests
+import json
+import os
+import time
+
+
+def make_basin(fname, size):
+    """
+    Writes a modeled netcdf of a smooth snow depth field of size x size.
+    """
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('y', size)
+        ds.createDimension('x', size)
+
+        t = ds.createVariable('time', 'f8', ('time',))
+        t.units = 'hours since 2020-04-01'
+        t.calendar = 'standard'
+        t[:] = [0]
+
+        ds.createVariable('x', 'f8', ('x',))[:] = 500000 + 50.0 * np.arange(size)
+        ds.createVariable('y', 'f8', ('y',))[:] = 4200000 - 50.0 * np.arange(size)
+
+        v = ds.createVariable('thickness', 'f4', ('time', 'y', 'x'),
+                                                 zlib=True,
+                                                 chunksizes=(1, 256, 256))
+        i = np.linspace(0, 4 * np.pi, size)
+        for start in range(0, size, 256):
+            rows = i[start:start + 256, np.newaxis]
+            v[0, start:start + 256, :] = 1 + np.sin(rows) * np.cos(i)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports GetMap tile latency of"
+                                            " netcdf and cloud optimized"
+                                            " GeoTIFF layers at several zoom"
+                                            " levels against a stand in"
+                                            " geoserver")
+
+    p.add_argument('-n','--size', dest='size',
+                        type=int,
+                        default=4096,
+                        help="Width and height of the synthetic basin")
+
+    p.add_argument('-z','--zooms', dest='zooms',
+                        nargs='+',
+                        type=int,
+                        default=[0, 1, 2, 3, 4],
+                        help="Zoom levels to benchmark")
+
+    p.add_argument('-r','--requests', dest='requests',
+                        type=int,
+                        default=20,
+                        help="Number of tiles to request per zoom level")
+
+    args = p.parse_args()
+
+    tmp = mkdtemp()
+    server, url = serve_in_background(data_dir=tmp)
+
+    cred = os.path.join(tmp, 'geoserver.json')
+    with open(cred, 'w') as fp:
+        json.dump({'url':url, 'remote_user':'', 'geoserver_username':'',
+                   'geoserver_password':'', 'data':os.path.join(tmp, 'basins'),
+                   'transfer':'local'}, fp)
+
+    try:
+        source = os.path.join(tmp, 'snow.nc')
+        make_basin(source, args.size)
+
+        # Publish the same data once as each kind of store
+        for basin, geotiff in [('netcdf', False), ('geotiff', True)]:
+            gs = AWSM_Geoserver(cred, level='WARNING', assume_yes=True,
+                                                       geotiff=geotiff)
+            work = os.path.join(tmp, basin)
+            os.makedirs(work)
+
+            item = gs.prepare(basin, source, espg=32611, output_dir=work)
+            gs.publish(item, gs.send(item))
+
+        extent = [500000 - 25.0, 4200000 - 50.0 * args.size + 25.0,
+                  500000 + 50.0 * args.size - 25.0, 4200000 + 25.0]
+        session = requests.Session()
+        rng = np.random.RandomState(0)
+
+        hdr = "{0:<8}{1:<10}{2:<12}{3:<12}{4:<12}".format("Zoom", "Store",
+                                                          "Mean (ms)",
+                                                          "P95 (ms)",
+                                                          "Tiles/sec")
+        print(hdr)
+        print("=" * len(hdr))
+        msg = "{0:<8}{1:<10}{2:<12.1f}{3:<12.1f}{4:<12.1f}"
+
+        for zoom in args.zooms:
+            width = (extent[2] - extent[0]) / 2**zoom
+            height = (extent[3] - extent[1]) / 2**zoom
+
+            # Same tiles for both stores
+            tiles = [(rng.randint(2**zoom), rng.randint(2**zoom))
+                                                  for i in range(args.requests)]
+
+            for basin in ['netcdf', 'geotiff']:
+                latency = []
+
+                for col, row in tiles:
+                    bbox = [extent[0] + col * width, extent[1] + row * height,
+                            extent[0] + (col + 1) * width,
+                            extent[1] + (row + 1) * height]
+
+                    start = time.time()
+                    r = session.get(url + 'wms', params={
+                                        'service':'WMS', 'request':'GetMap',
+                                        'layers':'{}:depth20200401'.format(basin),
+                                        'bbox':','.join([str(b) for b in bbox]),
+                                        'width':256, 'height':256})
+                    r.raise_for_status()
+                    latency.append(time.time() - start)
+
+                latency = np.array(latency) * 1000
+                print(msg.format(zoom, basin, latency.mean(),
+                                 np.percentile(latency, 95),
+                                 1000 / latency.mean()))
+    finally:
+        server.shutdown()
+        rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,486 @@
+"""
+A small in memory stand in for the geoserver REST API for exercising
+AWSM_Geoserver locally. Only the parts of the catalog the upload script uses
+are implemented, plus a WMS GetMap that returns raw grey images for timing
+tile reads. Point the url in a credentials json at it, e.g.
+
+    python stand_in_server.py --port 8600
+    {"url":"http://localhost:8600/geoserver/", ...}
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+def read_window(fname, bbox, width, height, variable=None):
+    """
+    Reads a bounding box of an image at a requested size the way a map server
+    would. GeoTIFFs are read through rasterio, which uses the overviews when
+    zoomed out. NetCDFs have none so the full resolution window is read and
+    then decimated.
+
+    Args:
+        fname: Path to a GeoTIFF or netcdf
+        bbox: List of minx, miny, maxx, maxy
+        width: Number of columns to return
+        height: Number of rows to return
+        variable: Netcdf variable to read, defaults to the first image
+
+    Returns:
+        numpy.array: image of shape (height, width)
+    """
+    if fname.endswith('.tif'):
+        import rasterio
+        from rasterio.windows import from_bounds
+
+        with rasterio.open(fname) as src:
+            window = from_bounds(*bbox, transform=src.transform)
+            return src.read(1, window=window, out_shape=(height, width),
+                               boundless=True, masked=True)
+
+    with Dataset(fname) as ds:
+        if variable not in ds.variables:
+            variable = [v for v, var in ds.variables.items()
+                        if var.dimensions[-2:] == ('y', 'x')][0]
+
+        x = ds.variables['x'][:]
+        y = ds.variables['y'][:]
+        cols = np.where((x >= bbox[0]) & (x <= bbox[2]))[0]
+        rows = np.where((y >= bbox[1]) & (y <= bbox[3]))[0]
+
+        if len(cols) == 0 or len(rows) == 0:
+            return np.ma.masked_all((height, width))
+
+        var = ds.variables[variable]
+        index = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        data = var[(0,) + index] if var.ndim == 3 else var[index]
+
+    # Nearest neighbor down to the requested size
+    r = np.linspace(0, data.shape[0] - 1, height).astype(int)
+    c = np.linspace(0, data.shape[1] - 1, width).astype(int)
+    return data[r][:, c]
+
+
+class Catalog(object):
+    """
+    In memory catalog of workspaces > coverage stores > coverages and layers.
+    """
+
+    def __init__(self, fail=0, latency=0.0):
+        self.workspaces = {}
+        self.layers = {}
+        self.lock = threading.Lock()
+
+        # Failure injection and latency for testing retries and concurrency
+        self.fail = fail
+        self.latency = latency
+        self.requests = 0
+
+    def granule(self, location):
+        """
+        Index entry of a mosaic granule with the time parsed from its name the
+        way a timeregex of [0-9]{8} would.
+        """
+        date = re.search(r'[0-9]{8}', os.path.basename(location))
+        time = None
+        if date:
+            d = date.group(0)
+            time = '{}-{}-{}T00:00:00Z'.format(d[:4], d[4:6], d[6:])
+
+        return {'location': location, 'time': time}
+
+    def mosaic(self, basin, store, directory):
+        """
+        Creates an image mosaic store from a directory, indexing the granules
+        already in it when the directory is on this machine.
+        """
+        name = store
+        granules = []
+
+        if os.path.isdir(directory):
+            indexer = os.path.join(directory, 'indexer.properties')
+            if os.path.isfile(indexer):
+                with open(indexer) as fp:
+                    for line in fp:
+                        if line.startswith('Name='):
+                            name = line.strip().split('=', 1)[1]
+
+            granules = [self.granule(os.path.join(directory, f))
+                        for f in sorted(os.listdir(directory))
+                        if not f.endswith('.properties')]
+
+        self.workspaces[basin][store] = {'info': {'name': store,
+                                                  'type': 'ImageMosaic',
+                                                  'url': 'file://' + directory},
+                                         'coverages': {name: {'name': name}},
+                                         'granules': granules}
+        self.layers['{}:{}'.format(basin, name)] = {'name': name,
+                                          'defaultStyle': {'name': 'raster'}}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Handles the geoserver REST requests against the catalog.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def href(self, path):
+        return "http://{}:{}/geoserver/rest/{}.json".format(
+                                                  self.server.server_address[0],
+                                                  self.server.server_address[1],
+                                                  path)
+
+    def parts(self):
+        """
+        Splits the request path after rest/ and drops format extensions.
+        """
+        path = urlparse(self.path).path
+        path = path.split('/rest/', 1)[-1].strip('/')
+        path = re.sub(r'\.(json|xml)$', '', path)
+        return [p for p in path.split('/') if p]
+
+    def body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def respond(self, status, payload=None):
+        data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start(self):
+        """
+        Counts the request, applies latency and returns True if this request
+        should fail.
+        """
+        with self.catalog.lock:
+            self.catalog.requests += 1
+            fail = self.catalog.fail > 0
+            if fail:
+                self.catalog.fail -= 1
+
+        if self.catalog.latency:
+            time.sleep(self.catalog.latency)
+
+        if fail:
+            self.body()
+            self.respond(503, {'error': 'injected failure'})
+
+        return fail
+
+    def get_map(self):
+        """
+        Answers a WMS GetMap with the raw bytes of an 8 bit grey image, enough
+        to measure what reading a tile costs for each kind of store.
+        """
+        query = {k.lower(): v[0] for k, v in
+                                      parse_qs(urlparse(self.path).query).items()}
+        basin, name = query['layers'].split(':')
+        bbox = [float(b) for b in query['bbox'].split(',')]
+        width, height = int(query['width']), int(query['height'])
+
+        with self.catalog.lock:
+            found = [(store, store['coverages'][name]) for store in
+                     self.catalog.workspaces.get(basin, {}).values()
+                     if name in store['coverages']]
+
+            if not found:
+                return self.respond(404)
+            store, coverage = found[0]
+
+            # Mosaics answer with the granule at TIME, defaulting to the latest
+            if 'granules' in store:
+                granules = sorted(store['granules'], key=lambda g: g['time'])
+                if 'time' in query:
+                    granules = [g for g in granules
+                                if g['time'][:10] == query['time'][:10]]
+                if not granules:
+                    return self.respond(404)
+                fname = granules[-1]['location']
+            else:
+                fname = store['info']['url']
+
+        # Relative urls are relative to the geoserver data directory
+        if fname.startswith('file://'):
+            fname = urlparse(fname).path
+        elif fname.startswith('file:'):
+            fname = os.path.join(self.server.data_dir or '', fname[5:])
+
+        data = read_window(fname, bbox, width, height,
+                           variable=coverage.get('nativeCoverageName'))
+
+        values = np.ma.masked_invalid(np.ma.asarray(data, dtype=np.float64))
+        low, high = values.min(), values.max()
+        scale = 255.0 / (high - low) if values.count() and high > low else 0.0
+        image = np.ma.filled((values - low) * scale, 0).astype(np.uint8)
+
+        body = image.tobytes()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/x-raw-gray')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.start():
+            return
+
+        if urlparse(self.path).path.rstrip('/').endswith('/wms'):
+            return self.get_map()
+
+        p = self.parts()
+        ws = self.catalog.workspaces
+
+        with self.catalog.lock:
+            if p == ['workspaces']:
+                items = [{'name': n, 'href': self.href('workspaces/' + n)}
+                                                           for n in sorted(ws)]
+                return self.respond(200, {'workspaces':
+                                              {'workspace': items} if items else ''})
+
+            if len(p) >= 2 and p[0] == 'workspaces' and p[1] not in ws:
+                return self.respond(404)
+
+            if len(p) == 2 and p[0] == 'workspaces':
+                return self.respond(200, {'workspace': {'name': p[1],
+                    'coverageStores': self.href('workspaces/{}/coveragestores'
+                                                               ''.format(p[1]))}})
+
+            if len(p) == 3 and p[2] == 'coveragestores':
+                items = [{'name': n, 'href': self.href(
+                            'workspaces/{}/coveragestores/{}'.format(p[1], n))}
+                                                    for n in sorted(ws[p[1]])]
+                return self.respond(200, {'coverageStores':
+                                     {'coverageStore': items} if items else ''})
+
+            if len(p) >= 4 and p[2] == 'coveragestores':
+                if p[3] not in ws[p[1]]:
+                    return self.respond(404)
+                store = ws[p[1]][p[3]]
+
+                if len(p) == 4:
+                    info = dict(store['info'])
+                    info['coverages'] = self.href(
+                        'workspaces/{}/coveragestores/{}/coverages'.format(p[1], p[3]))
+                    return self.respond(200, {'coverageStore': info})
+
+                if len(p) == 5 and p[4] == 'coverages':
+                    items = [{'name': n} for n in sorted(store['coverages'])]
+                    return self.respond(200, {'coverages':
+                                          {'coverage': items} if items else ''})
+
+                if len(p) >= 6 and p[5] not in store['coverages']:
+                    return self.respond(404)
+
+                if len(p) == 6:
+                    return self.respond(200,
+                                        {'coverage': store['coverages'][p[5]]})
+
+                if len(p) == 8 and p[6:] == ['index', 'granules']:
+                    granules = store.get('granules', [])
+
+                    # Only location = and LIKE filters are understood
+                    query = parse_qs(urlparse(self.path).query)
+                    if 'filter' in query:
+                        value = re.search(r"'(.*)'", query['filter'][0])
+                        value = value.group(1) if value else ''
+                        granules = [g for g in granules
+                                    if g['location'].endswith(value.lstrip('%'))]
+
+                    features = [{'type': 'Feature', 'id': '{}.{}'.format(p[5], i),
+                                 'properties': g}
+                                for i, g in enumerate(granules)]
+                    return self.respond(200, {'type': 'FeatureCollection',
+                                              'features': features})
+
+            if len(p) == 2 and p[0] == 'layers':
+                if p[1] not in self.catalog.layers:
+                    return self.respond(404)
+                return self.respond(200, {'layer': self.catalog.layers[p[1]]})
+
+        self.respond(404)
+
+    def do_POST(self):
+        if self.start():
+            return
+
+        p = self.parts()
+        payload_text = self.body()
+        ws = self.catalog.workspaces
+
+        # Harvesting a granule posts a plain text file url
+        if payload_text.strip().startswith('file:'):
+            payload = {}
+        else:
+            payload = json.loads(payload_text or '{}')
+
+        with self.catalog.lock:
+            if p == ['workspaces']:
+                ws.setdefault(payload['workspace']['name'], {})
+                return self.respond(201)
+
+            if len(p) == 3 and p[2] == 'coveragestores' and p[1] in ws:
+                info = payload['coverageStore']
+                ws[p[1]][info['name']] = {'info': info, 'coverages': {}}
+                return self.respond(201)
+
+            if (len(p) == 5 and p[4] == 'external.imagemosaic' and
+                                        p[1] in ws and p[3] in ws[p[1]] and
+                                        'granules' in ws[p[1]][p[3]]):
+                location = urlparse(payload_text).path
+                ws[p[1]][p[3]]['granules'].append(
+                                              self.catalog.granule(location))
+                return self.respond(202)
+
+            if (len(p) == 5 and p[4] == 'coverages' and p[1] in ws and
+                                                          p[3] in ws[p[1]]):
+                info = payload['coverage']
+                ws[p[1]][p[3]]['coverages'][info['name']] = info
+                name = '{}:{}'.format(p[1], info['name'])
+                self.catalog.layers[name] = {'name': info['name'],
+                                             'defaultStyle': {'name': 'raster'}}
+                return self.respond(201)
+
+        self.respond(404)
+
+    def do_PUT(self):
+        if self.start():
+            return
+
+        p = self.parts()
+        body = self.body()
+
+        ws = self.catalog.workspaces
+
+        with self.catalog.lock:
+            if (len(p) == 5 and p[4] == 'external.imagemosaic' and
+                                                                p[1] in ws):
+                self.catalog.mosaic(p[1], p[3], urlparse(body.strip()).path)
+                return self.respond(201)
+
+            if (len(p) == 6 and p[4] == 'coverages' and p[1] in ws and
+                          p[3] in ws[p[1]] and p[5] in ws[p[1]][p[3]]['coverages']):
+                update = json.loads(body or '{}').get('coverage', {})
+                ws[p[1]][p[3]]['coverages'][p[5]].update(update)
+                return self.respond(200)
+
+            if len(p) == 2 and p[0] == 'layers' and p[1] in self.catalog.layers:
+                layer = self.catalog.layers[p[1]]
+
+                if body.strip().startswith('<'):
+                    style = re.search(r'<defaultStyle>\s*<name>(.*?)</name>',
+                                      body)
+                    if style:
+                        layer['defaultStyle'] = {'name': style.group(1)}
+                else:
+                    update = json.loads(body or '{}').get('layer', {})
+                    layer.update(update)
+
+                return self.respond(200)
+
+        self.respond(404)
+
+    def do_DELETE(self):
+        if self.start():
+            return
+
+        p = self.parts()
+        ws = self.catalog.workspaces
+
+        with self.catalog.lock:
+            if (len(p) == 4 and p[2] == 'coveragestores' and p[1] in ws and
+                                                          p[3] in ws[p[1]]):
+                for name in ws[p[1]].pop(p[3])['coverages']:
+                    self.catalog.layers.pop('{}:{}'.format(p[1], name), None)
+                return self.respond(200)
+
+        self.respond(404)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded server holding the catalog.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, fail=0, latency=0.0, verbose=False,
+                                                    data_dir=None):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.catalog = Catalog(fail=fail, latency=latency)
+        self.verbose = verbose
+
+        # Where relative file: store urls point for GetMap
+        self.data_dir = data_dir
+
+
+def serve_in_background(port=0, **kwargs):
+    """
+    Starts a stand in server on a background thread.
+
+    Args:
+        port: Port to listen on, 0 picks a free one
+        kwargs: Keyword arguments passed to StandInServer
+
+    Returns:
+        tuple: the server and the geoserver url to put in the credentials
+    """
+    server = StandInServer(('localhost', port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    url = "http://localhost:{}/geoserver/".format(server.server_address[1])
+    return server, url
+
+
+def main():
+    p = argparse.ArgumentParser(description="Runs an in memory stand in for"
+                                            " the geoserver REST API")
+
+    p.add_argument('-p','--port', dest='port', type=int, default=8600,
+                    help="Port to listen on")
+    p.add_argument('--fail', dest='fail', type=int, default=0,
+                    help="Number of requests to answer with a 503 first")
+    p.add_argument('--latency', dest='latency', type=float, default=0.0,
+                    help="Seconds to wait before answering each request")
+    p.add_argument('-v','--verbose', dest='verbose', action='store_true',
+                    help="Log every request")
+    p.add_argument('-d','--data_dir', dest='data_dir', default=None,
+                    help="Geoserver data directory store urls are relative to")
+
+    args = p.parse_args()
+
+    server = StandInServer(('localhost', args.port), fail=args.fail,
+                                                     latency=args.latency,
+                                                     verbose=args.verbose,
+                                                     data_dir=args.data_dir)
+    print("Stand in geoserver at http://localhost:{}/geoserver/"
+          "".format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Answered {} requests".format(server.catalog.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+from transfer import LocalTarget, transfer
+import os
+
+
+def test_send_to_bare_filename(tmp_path, monkeypatch):
+    data = os.urandom(2500)
+    src = tmp_path / 'src.bin'
+    src.write_bytes(data)
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    monkeypatch.chdir(out)
+
+    assert transfer(str(src), LocalTarget(), 'dest.bin', chunk_size=1000) \
+                                                                  == len(data)
+    assert (out / 'dest.bin').read_bytes() == data
+    assert not (out / 'dest.bin.part').exists()
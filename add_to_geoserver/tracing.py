@@ -0,0 +1,172 @@
+"""
+Tracing of where an upload spends its time. Each stage and REST call is
+recorded as an event with its duration and bytes, attributed to the upload
+it was working on. The events are summarized per upload and can be written
+as JSON lines for comparing runs. Tracing is off by default and the NullTracer
+used then does no timing or bookkeeping.
+"""
+from contextvars import ContextVar
+import json
+import threading
+import time
+
+
+# Source file of the upload being worked on, copied into worker threads
+current_upload = ContextVar('current_upload', default=None)
+
+
+class Span(object):
+    """
+    Times a block of code and records it when the block exits. Bytes and other
+    fields can be added while it runs.
+    """
+
+    def __init__(self, tracer, stage, fields):
+        self.tracer = tracer
+        self.stage = stage
+        self.fields = fields
+
+    def add(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type != None:
+            self.fields['error'] = repr(exc)
+
+        self.tracer.record(self.stage, time.perf_counter() - self.start,
+                                       **self.fields)
+        return False
+
+
+class NullSpan(object):
+    """
+    Span that does nothing, shared by every disabled trace.
+    """
+
+    def add(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTracer(object):
+    """
+    Tracer used when tracing is off.
+    """
+    enabled = False
+
+    def span(self, stage, **fields):
+        return NULL_SPAN
+
+    def record(self, stage, seconds, **fields):
+        pass
+
+    def report(self, log, uploads=None):
+        pass
+
+
+class Tracer(object):
+    """
+    Collects trace events in memory and optionally appends each one to a JSON
+    lines file as it happens.
+
+    Args:
+        fname: Path of a JSON lines file to append events to
+    """
+    enabled = True
+
+    def __init__(self, fname=None):
+        self.events = []
+        self.lock = threading.Lock()
+        self.fp = open(fname, 'a') if fname != None else None
+
+    def span(self, stage, **fields):
+        """
+        Returns a context manager timing a stage, e.g.
+
+            with tracer.span('transfer', file=bname) as span:
+                span.add(bytes=transfer(...))
+        """
+        return Span(self, stage, fields)
+
+    def record(self, stage, seconds, **fields):
+        """
+        Records an event that has already been timed.
+
+        Args:
+            stage: Name of the stage e.g. copy, transfer or http
+            seconds: Duration of the stage
+            fields: Anything else to keep e.g. bytes, method or status
+        """
+        event = {'time':time.time(), 'upload':current_upload.get(),
+                 'stage':stage, 'seconds':seconds}
+        event.update(fields)
+
+        with self.lock:
+            self.events.append(event)
+
+            if self.fp != None:
+                self.fp.write(json.dumps(event, default=str) + '\n')
+                self.fp.flush()
+
+    def breakdown(self, uploads=None):
+        """
+        Totals the events per upload and stage.
+
+        Args:
+            uploads: List of uploads to include, defaults to all
+
+        Returns:
+            dict: upload to dictionary of stage to count, seconds and bytes in
+                  the order the stages first happened
+        """
+        with self.lock:
+            events = list(self.events)
+
+        totals = {}
+        for event in events:
+            if uploads != None and event['upload'] not in uploads:
+                continue
+
+            stages = totals.setdefault(event['upload'], {})
+            total = stages.setdefault(event['stage'], {'count':0,
+                                                       'seconds':0.0,
+                                                       'bytes':0})
+            total['count'] += 1
+            total['seconds'] += event['seconds']
+            total['bytes'] += event.get('bytes', 0) + \
+                              event.get('bytes_sent', 0) + \
+                              event.get('bytes_received', 0)
+
+        return totals
+
+    def report(self, log, uploads=None):
+        """
+        Logs the time and bytes of each stage of each upload. Stages can
+        contain others, e.g. http and style happen during publish.
+
+        Args:
+            log: logger
+            uploads: List of uploads to report, defaults to all
+        """
+        for upload, stages in self.breakdown(uploads=uploads).items():
+            log.info("Trace of {}:".format(upload or "requests outside an"
+                                                     " upload"))
+            log.info("    {:<12}{:>8}{:>12}{:>12}".format("Stage", "Count",
+                                                          "Seconds", "MB"))
+            for stage, total in stages.items():
+                log.info("    {:<12}{:>8}{:>12.3f}{:>12.2f}".format(stage,
+                                               total['count'],
+                                               total['seconds'],
+                                               total['bytes'] / 1024.0**2))
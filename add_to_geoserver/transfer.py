@@ -0,0 +1,199 @@
+"""
+Resumable, chunked and checksummed file transfer for getting data onto the
+geoserver. Files are written to <dest>.part in chunks that are each verified
+against a sha256 of the local chunk, so an interrupted transfer resumes from
+the last good chunk. The .part file is only renamed once the whole file hash
+matches.
+"""
+from subprocess import check_output
+import hashlib
+import logging
+import os
+import shlex
+import time
+
+
+# Default number of bytes sent per chunk
+CHUNK_SIZE = 8 * 1024**2
+
+
+def hash_file(fname, chunk_size=CHUNK_SIZE):
+    """
+    Hashes a local file and each of its chunks in one read.
+
+    Args:
+        fname: Path to a local file
+        chunk_size: Number of bytes per chunk
+
+    Returns:
+        tuple: sha256 of the whole file and a list of sha256 of each chunk
+    """
+    whole = hashlib.sha256()
+    chunks = []
+
+    with open(fname, 'rb') as fp:
+        for data in iter(lambda: fp.read(chunk_size), b''):
+            whole.update(data)
+            chunks.append(hashlib.sha256(data).hexdigest())
+
+    return whole.hexdigest(), chunks
+
+
+class LocalTarget(object):
+    """
+    Transfer target on the local filesystem, used when the geoserver data
+    directory is mounted locally and for testing.
+    """
+
+    def checksum(self, path):
+        if not os.path.isfile(path):
+            return None
+        return hash_file(path)[0]
+
+    def chunk_hashes(self, path, chunk_size):
+        if not os.path.isfile(path):
+            return []
+
+        complete = os.path.getsize(path) // chunk_size
+        return hash_file(path, chunk_size=chunk_size)[1][:complete]
+
+    def truncate(self, path, size):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(path, 'ab') as fp:
+            fp.truncate(size)
+
+    def append(self, path, data):
+        with open(path, 'ab') as fp:
+            fp.write(data)
+
+        # Read back what landed on disk
+        with open(path, 'rb') as fp:
+            fp.seek(-len(data), os.SEEK_END)
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    def rename(self, path, dest):
+        os.replace(path, dest)
+
+
+class SSHTarget(object):
+    """
+    Transfer target on a remote host reached with ssh. A shared control
+    connection is used so each chunk doesn't pay for a new ssh handshake.
+    """
+
+    def __init__(self, user, host, pem=None):
+        self.cmd = ["ssh", "-o", "ControlMaster=auto",
+                           "-o", "ControlPath=/tmp/awsm-ssh-%r@%h:%p",
+                           "-o", "ControlPersist=60"]
+        if pem != None:
+            self.cmd += ["-i", pem]
+        self.cmd.append("{}@{}".format(user, host))
+
+    def run(self, script, data=None):
+        return check_output(self.cmd + [script], input=data).decode('utf-8')
+
+    def checksum(self, path):
+        s = self.run("sha256sum {} 2>/dev/null | cut -d' ' -f1"
+                     "".format(shlex.quote(path))).strip()
+        return s if s else None
+
+    def chunk_hashes(self, path, chunk_size):
+        p = shlex.quote(path)
+        script = ("if [ -f {0} ]; then n=$(( $(stat -c %s {0}) / {1} )); i=0;"
+                  " while [ $i -lt $n ]; do"
+                  " dd if={0} bs={1} skip=$i count=1 2>/dev/null"
+                  " | sha256sum | cut -d' ' -f1; i=$((i+1)); done; fi"
+                  "".format(p, chunk_size))
+        return self.run(script).split()
+
+    def truncate(self, path, size):
+        p = shlex.quote(path)
+        self.run("mkdir -p {} && touch {} && truncate -s {} {}".format(
+                 shlex.quote(os.path.dirname(path)), p, size, p))
+
+    def append(self, path, data):
+        p = shlex.quote(path)
+        return self.run("cat >> {0} && tail -c {1} {0} | sha256sum"
+                        " | cut -d' ' -f1".format(p, len(data)),
+                        data=data).strip()
+
+    def rename(self, path, dest):
+        self.run("mv {} {}".format(shlex.quote(path), shlex.quote(dest)))
+
+
+def transfer(fname, target, dest, chunk_size=CHUNK_SIZE, retries=3, log=None):
+    """
+    Sends a file to a target in verified chunks, resuming a previous partial
+    transfer and skipping the transfer if the destination already has the
+    same content.
+
+    Args:
+        fname: Path to a local file
+        target: LocalTarget or SSHTarget
+        dest: Path of the file on the target
+        chunk_size: Number of bytes per chunk
+        retries: Number of times to resend a chunk that fails its checksum
+        log: logger, defaults to the module logger
+
+    Returns:
+        int: number of bytes sent
+    """
+    if log == None:
+        log = logging.getLogger(__name__)
+
+    start = time.time()
+    local_hash, local_chunks = hash_file(fname, chunk_size=chunk_size)
+
+    if target.checksum(dest) == local_hash:
+        log.info("{} is already up to date, skipping transfer".format(dest))
+        return 0
+
+    # Keep every complete chunk of a previous attempt that matches
+    part = dest + '.part'
+    good = 0
+    for remote, local in zip(target.chunk_hashes(part, chunk_size),
+                             local_chunks):
+        if remote != local:
+            break
+        good += 1
+
+    if good:
+        log.info("Resuming transfer after {} of {} chunks".format(good,
+                                                           len(local_chunks)))
+
+    target.truncate(part, good * chunk_size)
+    sent = 0
+
+    with open(fname, 'rb') as fp:
+        fp.seek(good * chunk_size)
+
+        for i in range(good, len(local_chunks)):
+            data = fp.read(chunk_size)
+
+            for attempt in range(retries + 1):
+                if target.append(part, data) == local_chunks[i]:
+                    break
+
+                log.warning("Chunk {} failed its checksum, resending"
+                            "".format(i))
+                target.truncate(part, i * chunk_size)
+            else:
+                raise IOError("Chunk {} of {} failed its checksum {} times"
+                              "".format(i, fname, retries + 1))
+
+            sent += len(data)
+            log.debug("Sent chunk {} of {}".format(i + 1, len(local_chunks)))
+
+    if target.checksum(part) != local_hash:
+        raise IOError("Transferred {} does not match the local file".format(
+                                                                         part))
+    target.rename(part, dest)
+
+    elapsed = max(time.time() - start, 1e-9)
+    log.info("Sent {:0.1f} MB in {:0.1f}s ({:0.1f} MB/s)".format(
+              sent / 1024.0**2, elapsed, sent / 1024.0**2 / elapsed))
+
+    return sent
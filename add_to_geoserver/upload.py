@@ -1,24 +1,163 @@
 import json
 import argparse
+import csv
 import sys
 import requests
-from urllib.parse import urljoin, urlparse
-from shutil import copyfile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin, urlparse, urlencode
 import os
+import shutil
+import tempfile
 from netCDF4 import Dataset, num2date
-from subprocess import check_output
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 import logging
 import coloredlogs
 import certifi
 from spatialnc.proj import add_proj
-from spatialnc.utilities import copy_nc, mask_nc
 from datetime import datetime as dt
 import numpy as np
+import queue
+import threading
+import time
+
+# The chunked netcdf copy is shared with the projection tools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                      'add_netcdf_projection'))
+from add_proj_2_nc import copy_nc
+from transfer import transfer, LocalTarget, SSHTarget, CHUNK_SIZE
+from tracing import Tracer, NullTracer, current_upload
 
 __version__ = '0.1.0'
 
+
+class RangeStats(object):
+    """
+    Streaming min/max of a variable with an evenly strided sample of its
+    values for estimating percentiles without holding the variable.
+    """
+
+    def __init__(self, size, sample_size=100000):
+        self.min = np.inf
+        self.max = -np.inf
+        self.stride = max(int(size) // sample_size, 1)
+        self.samples = []
+
+    def update(self, data):
+        """
+        Adds a slab of data, masked values are ignored.
+        """
+        values = np.ma.compressed(data) if np.ma.isMaskedArray(data) \
+                                        else np.asarray(data).ravel()
+        if values.size == 0:
+            return
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.samples.append(values[::self.stride])
+
+    def percentiles(self, q):
+        """
+        Estimates percentiles from the sample.
+
+        Args:
+            q: list of percentiles between 0 and 100
+
+        Returns:
+            list: estimated value at each percentile
+        """
+        if not self.samples:
+            return [np.nan for p in q]
+        return list(np.percentile(np.concatenate(self.samples), q))
+
+def write_geotiff(variable, x, y, fname, crs=None, blocksize=256):
+    """
+    Writes a netcdf variable to a tiled, deflate compressed GeoTIFF with
+    internal overviews laid out cloud optimized, so zoomed out requests only
+    read the overviews. Each time step is a band. Requires rasterio.
+
+    Args:
+        variable: netCDF4 variable with dimensions (y, x) or (time, y, x)
+        x: Array of the cell center x coordinates
+        y: Array of the cell center y coordinates
+        fname: Path of the GeoTIFF to write
+        crs: WKT or EPSG:<code> of the projection
+        blocksize: Width and height of the internal tiles in pixels
+
+    Returns:
+        list: overview decimation factors written
+    """
+    try:
+        from rasterio.enums import Resampling
+        from rasterio.io import MemoryFile
+        from rasterio.shutil import copy as rio_copy
+        from rasterio.transform import Affine
+    except ImportError:
+        raise ImportError("Writing GeoTIFFs requires rasterio, pip install"
+                          " rasterio")
+
+    height, width = variable.shape[-2:]
+    bands = variable.shape[0] if variable.ndim == 3 else 1
+
+    # GeoTIFF rows run north to south
+    dx = float(x[1] - x[0])
+    dy = float(y[1] - y[0])
+    top = float(max(y[0], y[-1])) + abs(dy) / 2.0
+    transform = Affine(dx, 0, float(x[0]) - dx / 2.0, 0, -abs(dy), top)
+
+    # Packed values come out of netCDF4 as floats
+    packed = hasattr(variable, 'scale_factor') or hasattr(variable, 'add_offset')
+    dtype = np.dtype('float32') if packed else np.dtype(variable.dtype)
+    nodata = None if packed else getattr(variable, '_FillValue', None)
+    if nodata == None and dtype.kind == 'f':
+        nodata = np.nan
+
+    # Halve until the smallest overview fits in a tile
+    factors = []
+    while max(height, width) // 2**(len(factors)) > blocksize:
+        factors.append(2**(len(factors) + 1))
+
+    # Categories like veg_type can't be averaged
+    resampling = Resampling.average if dtype.kind == 'f' else Resampling.nearest
+
+    options = {'tiled':True, 'blockxsize':blocksize, 'blockysize':blocksize,
+               'compress':'deflate', 'predictor':3 if dtype.kind == 'f' else 2}
+
+    with MemoryFile() as mem:
+        with mem.open(driver='GTiff', width=width, height=height, count=bands,
+                      dtype=dtype.name, crs=crs, transform=transform,
+                      nodata=nodata, **options) as tmp:
+            for b in range(bands):
+                data = variable[b] if variable.ndim == 3 else variable[:]
+
+                if np.ma.isMaskedArray(data):
+                    data = data.filled(nodata if nodata != None else 0)
+                if dy > 0:
+                    data = data[::-1]
+
+                tmp.write(np.asarray(data, dtype=dtype), b + 1)
+
+            if factors:
+                tmp.build_overviews(factors, resampling)
+
+            # Overviews have to come before the full resolution data
+            rio_copy(tmp, fname, driver='GTiff', copy_src_overviews=True,
+                                                 **options)
+
+    return factors
+
+
 class AWSM_Geoserver(object):
-    def __init__(self, fname, log=None, level="DEBUG"):
+    def __init__(self, fname, log=None, level="DEBUG", retries=3, backoff=0.5,
+                                                       pool_size=10,
+                                                       catalog_ttl=300,
+                                                       workers=4,
+                                                       stretch=None,
+                                                       assume_yes=False,
+                                                       mosaic=False,
+                                                       geotiff=False,
+                                                       trace=None):
 
         # Setup external logging if need be
         if log==None:
@@ -52,6 +191,10 @@ class AWSM_Geoserver(object):
 
         self.data = cred['data']
 
+        # How data gets to the geoserver, ssh or local
+        self.transfer_target = cred.get('transfer', 'ssh')
+        self.chunk_size = cred.get('chunk_size', CHUNK_SIZE)
+
         # Names we want to remap
         self.remap = {'snow_density':'density',
                       'specific_mass':'SWE',
@@ -62,8 +205,168 @@ class AWSM_Geoserver(object):
                                              "veg_tau","veg_k","veg_type",
                                              "veg_height"],
                           "mask":["mask"],}
-        #  Manage the ranges
+        #  Manage the ranges, optionally as percentiles e.g. [2, 98]
         self.ranges = {}
+        self.stretch = stretch
+
+        # One pooled, keep alive session for every REST call
+        self.session = self.make_session(retries=retries, backoff=backoff,
+                                         pool_size=pool_size)
+
+        # Counters for where the upload time goes
+        self.stats = {'requests':0, 'seconds':0.0, 'bytes_sent':0,
+                      'bytes_received':0, 'methods':{}}
+        self.stats_lock = threading.Lock()
+
+        # Snapshot of workspace > store > layer names, refreshed after the ttl
+        self.catalog = None
+        self.catalog_time = 0
+        self.catalog_ttl = catalog_ttl
+        self.catalog_lock = threading.RLock()
+
+        # Number of layers to publish at once
+        self.workers = workers
+
+        # Known default styles of layers by layer resource
+        self.styles = {}
+
+        # Answer yes to every question instead of prompting, for unattended runs
+        self.assume_yes = assume_yes
+
+        # Append modeled dates to one time mosaic per basin and layer, the
+        # mosaics are only made of GeoTIFF granules
+        if mosaic and not geotiff:
+            raise ValueError("Time mosaics are made of GeoTIFF granules, set"
+                             " geotiff=True to use them")
+        self.mosaic = mosaic
+
+        # Publish cloud optimized GeoTIFFs of each layer instead of the netcdf
+        self.geotiff = geotiff
+        self.geotiffs = {}
+
+        # Stage and request timings, True to keep them or a JSON lines path
+        if trace:
+            self.tracer = Tracer(trace if isinstance(trace, str) else None)
+        else:
+            self.tracer = NullTracer()
+
+    def confirm(self, msg):
+        """
+        Asks the user a yes no question unless running unattended.
+
+        Args:
+            msg: question to display
+
+        Returns:
+            bool: whether to proceed
+        """
+        if self.assume_yes:
+            self.log.debug("{} (assuming yes)".format(msg))
+            return True
+
+        return ask_user(msg)
+
+    def submit(self, pool, fn, *args, **kwargs):
+        """
+        Submits work to a thread pool, carrying the upload being traced into
+        the worker thread when tracing.
+        """
+        if self.tracer.enabled:
+            return pool.submit(copy_context().run, fn, *args, **kwargs)
+
+        return pool.submit(fn, *args, **kwargs)
+
+    def make_session(self, retries=3, backoff=0.5, pool_size=10):
+        """
+        Creates a requests session with connection pooling and retries with
+        backoff on transient server errors. POST is not retried since it is
+        not idempotent.
+
+        Args:
+            retries: Number of times to retry a failed request
+            backoff: Backoff factor in seconds between retries
+            pool_size: Number of connections to keep alive
+
+        Returns:
+            requests.Session: session to make all requests with
+        """
+        methods = ['GET', 'PUT', 'DELETE', 'HEAD']
+        status = [500, 502, 503, 504]
+
+        # urllib3 renamed method_whitelist to allowed_methods
+        try:
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          status_forcelist=status, allowed_methods=methods,
+                          raise_on_status=False)
+        except TypeError:
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          status_forcelist=status, method_whitelist=methods,
+                          raise_on_status=False)
+
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.auth = self.credential
+
+        return session
+
+    def request(self, method, resource, **kwargs):
+        """
+        Makes a request with the session and records the count, latency and
+        bytes exchanged.
+
+        Args:
+            method: HTTP method e.g. GET
+            resource: Relative location from the http root
+            kwargs: Keyword arguments passed on to requests
+
+        Returns:
+            requests.Response: the response
+        """
+        request_url = urljoin(self.url, resource)
+        self.log.debug("{} request to {}".format(method, request_url))
+
+        start = time.time()
+        r = self.session.request(method, request_url, **kwargs)
+        elapsed = time.time() - start
+
+        # Count the bytes sent, not the characters of a str body
+        body = r.request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        # Layers are published from several threads
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['seconds'] += elapsed
+            self.stats['bytes_sent'] += len(body)
+            self.stats['bytes_received'] += len(r.content)
+
+            count, seconds = self.stats['methods'].get(method, (0, 0.0))
+            self.stats['methods'][method] = (count + 1, seconds + elapsed)
+
+        self.tracer.record('http', elapsed, method=method, resource=resource,
+                                            status=r.status_code,
+                                            bytes_sent=len(body),
+                                            bytes_received=len(r.content))
+        return r
+
+    def report_stats(self):
+        """
+        Logs the number of requests, their latency and the bytes exchanged.
+        """
+        self.log.info("REST requests: {} in {:0.2f}s, {:0.1f} KB sent, {:0.1f}"
+                      " KB received".format(self.stats['requests'],
+                                            self.stats['seconds'],
+                                            self.stats['bytes_sent'] / 1024.0,
+                                            self.stats['bytes_received'] / 1024.0))
+
+        for method, (count, seconds) in sorted(self.stats['methods'].items()):
+            self.log.info("    {:<7} {:>4} requests, {:0.3f}s mean".format(
+                                             method, count, seconds / count))
 
 
     def make(self, resource, payload):
@@ -79,14 +382,12 @@ class AWSM_Geoserver(object):
         """
 
         headers = {'content-type' : 'application/json'}
-        request_url = urljoin(self.url, resource)
-        self.log.debug("POST request to {}".format(request_url))
-        r = requests.post(
-            request_url,
+        r = self.request(
+            'POST',
+            resource,
             headers=headers,
             data=json.dumps(payload),
-            verify=False,
-            auth=self.credential
+            verify=False
         )
         result = r.raise_for_status()
         self.log.debug("POST request returns {}:".format(result))
@@ -105,13 +406,12 @@ class AWSM_Geoserver(object):
         """
 
         headers = {'content-type':'application/json'}
-        request_url = urljoin(self.url, resource)
-        self.log.debug("PUT request to {}".format(request_url))
-        r = requests.delete(
-            request_url,
+        self.catalog_invalidate()
+        r = self.request(
+            'DELETE',
+            resource,
             headers=headers,
-            verify=False,
-            auth=self.credential
+            verify=False
         )
         self.log.debug("Response from DELETE: {}".format(r))
         return r.raise_for_status()
@@ -130,13 +430,11 @@ class AWSM_Geoserver(object):
 
         headers = {'accept':'application/json',
                    'content-type':'application/json'}
-        request_url = urljoin(self.url, resource)
-        self.log.debug("PUT request to {}".format(request_url))
-        r = requests.put(
-            request_url,
+        r = self.request(
+            'PUT',
+            resource,
             headers=headers,
-            json=payload,
-            auth=self.credential
+            json=payload
         )
         self.log.debug("Response from PUT: {}".format(r))
         return r.raise_for_status()
@@ -155,26 +453,29 @@ class AWSM_Geoserver(object):
         """
 
         headers = {'Accept':'application/json'}
-        request_url = urljoin(self.url, resource)
-        self.log.debug("GET request to {}".format(request_url))
 
-        r = requests.get(
-            request_url,
+        r = self.request(
+            'GET',
+            resource,
             verify=False,
-            headers=headers,
-            auth=self.credential
+            headers=headers
         )
         result = r.json()
         self.log.debug("GET Returns: {}".format(result))
         return result
 
-    def extract_data(self, fname, upload_type='modeled', espg=None, mask=None):
+    def extract_data(self, fname, upload_type='modeled', espg=None, mask=None,
+                                                            output_dir=None):
         """
         Args:
             fname: String path to a local file.
             upload_type: specifies whether to name a file differently
             espg: Projection code to use if projection information not found if
                   none, user will be prompted
+            mask: Netcdf containing a mask variable, cells outside of it are
+                  masked while copying
+            output_dir: Directory to write the extracted file to, defaults to
+                        the current directory
 
         Returns:
             fname: New name of file where data was extracted.
@@ -185,69 +486,167 @@ class AWSM_Geoserver(object):
             # AWSM related items should have a variable called projection
             ds = Dataset(fname, 'r')
 
-            # Base file name
-            bname = os.path.basename(fname)
-
-            if upload_type=='modeled':
-
-                # Add a parsed date to the string to avoid overwriting snow.nc
-                self.log.info("Retrieving date from netcdf...")
-                time = ds.variables['time']
-                dates = num2date(time[:], units=time.units, calendar=time.calendar)
-                self.date = dates[0].isoformat().split('T')[0]
-
-                cleaned_date = "".join([c for c in self.date if c not in ':-'])
-                bname = bname.split(".")[0] + "_{}.nc".format(cleaned_date)
-                fname = bname
-
-                # Only copy some of the variables
-                keep_vars = ['x','y','time','snow_density','specific_mass',
-                                                           'thickness',
-                                                           'projection']
-
-                exclude_vars = [v for v in ds.variables.keys() if v not in keep_vars]
-                mask_exlcude = []
+            new_ds = None
+
+            # Closed even when extracting fails so a rerun can write the file
+            try:
+                # Base file name
+                bname = os.path.basename(fname)
+
+                if upload_type=='modeled':
+
+                    # Add a parsed date to the string to avoid overwriting snow.nc
+                    self.log.info("Retrieving date from netcdf...")
+                    time_var = ds.variables['time']
+                    dates = num2date(time_var[:], units=time_var.units,
+                                                  calendar=time_var.calendar)
+                    self.date = dates[0].isoformat().split('T')[0]
+
+                    cleaned_date = "".join([c for c in self.date if c not in ':-'])
+                    bname = bname.split(".")[0] + "_{}.nc".format(cleaned_date)
+                    fname = os.path.join(output_dir or '', bname)
+
+                    # Only copy some of the variables
+                    keep_vars = ['x','y','time','snow_density','specific_mass',
+                                                               'thickness',
+                                                               'projection']
+
+                    exclude_vars = [v for v in ds.variables.keys() if v not in keep_vars]
+                    mask_exlcude = []
+
+                elif upload_type=='topo':
+                    self.date = dt.today().isoformat().split('T')[0]
+                    cleaned_date = "".join([c for c in self.date if c not in ':-'])
+                    bname = bname.split(".")[0] + "_{}.nc".format(cleaned_date)
+                    fname = os.path.join(output_dir or '', bname)
+                    keep_vars = list(ds.variables.keys())
+                    exclude_vars = []
+                    mask_exlcude = ['mask']
+
+                layers = [l for l in keep_vars if l in ds.variables and
+                                        l not in ['x','y','time','projection']]
+
+                # Optional Masking, read once and applied while copying
+                mask_data = None
+                if mask != None:
+                    self.log.info("Masking netcdf using {}...".format(mask))
+                    with Dataset(mask) as mds:
+                        mask_data = np.ma.filled(mds.variables['mask'][:], 0) == 0
+
+                stats = {lyr:RangeStats(ds.variables[lyr].size) for lyr in layers}
+
+                def single_pass(name, index, data):
+                    """
+                    Masks each slab and gathers its range as it is copied.
+                    """
+                    if name not in stats:
+                        return None
+
+                    if mask_data is not None and name not in mask_exlcude:
+                        start = time.perf_counter()
+
+                        # Slabs of images are rows, slabs of time series are steps
+                        if data.ndim == mask_data.ndim:
+                            outside = mask_data[index]
+                        else:
+                            outside = np.broadcast_to(mask_data, data.shape)
+                        data = np.ma.masked_where(outside, data)
+
+                        self.tracer.record('mask', time.perf_counter() - start,
+                                                   bytes=data.nbytes)
+
+                    stats[name].update(data)
+                    return data
+
+                # Create a copy
+                self.log.info("Copying netcdf...")
+                with self.tracer.span('copy', file=bname) as span:
+                    new_ds = copy_nc(ds, fname, exclude = exclude_vars, verbose=True,
+                                                callback=single_pass)
+
+                    if self.tracer.enabled:
+                        span.add(bytes=sum([v.size * v.dtype.itemsize
+                                            for n, v in ds.variables.items()
+                                            if n not in exclude_vars]))
+
+                # Calculate mins and maxes or a percentile stretch
+                for lyr, st in stats.items():
+                    if self.stretch != None:
+                        self.ranges[lyr] = st.percentiles(self.stretch)
+                    else:
+                        self.ranges[lyr] = [st.min, st.max]
+
+                # Check for missing projection
+                if 'projection' not in new_ds.variables:
+                    self.log.info("Netcdf is missing projection information...")
+
+                    # Missing ESPG from args
+                    if espg == None and self.assume_yes:
+                        raise ValueError("No projection found in {} and no ESPG"
+                                         " code given".format(fname))
+                    elif espg == None:
+                        espg = input("No projection detected. Enter the ESPG code for the data:\n")
+
+                    self.log.info("Adding projection information using ESPG code {}...".format(espg))
+                    with self.tracer.span('projection', espg=espg):
+                        new_ds = add_proj(new_ds, espg)
+
+                # Tiled images with overviews of each layer
+                if self.geotiff:
+                    with self.tracer.span('geotiff') as span:
+                        self.geotiffs = self.export_geotiffs(new_ds, layers,
+                                                             output_dir=output_dir,
+                                                             espg=espg)
+                        span.add(bytes=sum([os.path.getsize(f)
+                                            for f in self.geotiffs.values()]))
+
+            finally:
+                if new_ds != None:
+                    new_ds.close()
+                ds.close()
 
-            elif upload_type=='topo':
-                self.date = dt.today().isoformat().split('T')[0]
-                cleaned_date = "".join([c for c in date.isoformat() if c not in ':-'])[:-2]
-                bname = bname.split(".")[0] + "_{}.nc".format(cleaned_date)
-                fname = bname
-                mask_exlcude = ['mask']
+        return fname
 
-            # Create a copy
-            self.log.info("Copying netcdf...")
-            new_ds = copy_nc(ds, fname, exclude = exclude_vars)
+    def export_geotiffs(self, ds, layers, output_dir=None, espg=None):
+        """
+        Writes each image layer of an extracted netcdf to a cloud optimized
+        GeoTIFF named <layer>_<YYYYMMDD>.tif after its published layer name.
 
-            # Calculate mins and maxes
-            for lyr in [l for l in keep_vars if l not in ['x','y','time','projection']]:
-                self.ranges[lyr] = [np.min(new_ds.variables[lyr][:]),
-                                    np.max(new_ds.variables[lyr][:])]
+        Args:
+            ds: Open netCDF4 dataset of the extracted data
+            layers: Netcdf variable names to export
+            output_dir: Directory to write the GeoTIFFs to
+            espg: Projection code to use if the netcdf has no WKT
 
-            # Optional Masking
-            if mask != None:
-                self.log.info("Masking netcdf using {}...".format(mask))
-                new_ds.close() # close the last one
-                new_ds = mask_nc(fname, mask, exclude=mask_exlcude)
+        Returns:
+            dict: layer to GeoTIFF filename
+        """
+        crs = None
+        if 'projection' in ds.variables:
+            proj = ds.variables['projection']
+            crs = getattr(proj, 'crs_wkt', getattr(proj, 'spatial_ref', None))
 
-            # Check for missing projection
-            if 'projection' not in new_ds.variables:
-                self.log.info("Netcdf is missing projection information...")
+        if crs == None and espg != None:
+            crs = "EPSG:{}".format(espg)
 
-                # Missing ESPG from args
-                if espg == None:
-                    espg = input("No projection detected. Enter the ESPG code for the data:\n")
+        x = ds.variables['x'][:]
+        y = ds.variables['y'][:]
+        geotiffs = {}
 
-                self.log.info("Adding projection information using ESPG code {}...".format(espg))
-                new_ds = add_proj(new_ds, espg)
+        for layer in layers:
+            if ds.variables[layer].dimensions[-2:] != ('y', 'x'):
+                continue
 
-            # Clean up
-            new_ds.close()
-            ds.close()
+            fname = os.path.join(output_dir or '', "{}_{}.tif".format(
+                                                   self.layer_name(layer),
+                                                   self.date.replace('-','')))
+            self.log.info("Writing {}...".format(fname))
+            write_geotiff(ds.variables[layer], x, y, fname, crs=crs)
+            geotiffs[layer] = fname
 
-        return fname
+        return geotiffs
 
-    def copy_data(self, fname, basin, upload_type='modeled'):
+    def copy_data(self, fname, basin, upload_type='modeled', subdir=None):
         """
         Data for the geoserver has to be in the host location for this. We
 
@@ -257,34 +656,132 @@ class AWSM_Geoserver(object):
             fname: String path to a local file.
             basin: String name of the targeted basin/workspace to put the file in
             upload_type: specifies whether to name a file differently
+            subdir: Folder under the basin to put the file in
 
         Returns:
             final_fname: The remote path to the file we copied
         """
         bname =  os.path.basename(fname)
 
-        final_fname = os.path.join(self.data, basin, bname)
+        final_fname = os.path.join(self.data, basin, subdir or '', bname)
         self.log.info("Copying local data to remote, this may take a couple "
                       "minutes...")
-        self.log.debug("SCP info:{} -----> {}".format(bname, final_fname))
+        self.log.debug("Transfer info:{} -----> {}".format(bname, final_fname))
 
-        # Form the SCP command, handle if there is no pem file
-        cmd = ["scp"]
+        # Local targets are for geoservers with the data directory mounted
+        if self.transfer_target == 'local':
+            target = LocalTarget()
+        else:
+            target = SSHTarget(self.username, urlparse(self.url).hostname,
+                               pem=getattr(self, 'pem', None))
+
+        with self.tracer.span('transfer', file=bname) as span:
+            try:
+                sent = transfer(fname, target, final_fname,
+                                               chunk_size=self.chunk_size,
+                                               log=self.log)
+            except Exception as e:
+                if self.transfer_target == 'local':
+                    raise
+
+                self.log.error(e)
+                self.log.warning("Falling back to a local transfer...")
+                sent = transfer(fname, LocalTarget(), final_fname,
+                                                      chunk_size=self.chunk_size,
+                                                      log=self.log)
+            span.add(bytes=sent)
 
-        if hasattr(self,"pem"):
-            cmd.append("-i")
-            cmd.append(self.pem)
+        return final_fname
 
-        cmd.append(fname)
-        cmd.append("{}@{}:{}".format(self.username, self.base_url, final_fname))
+    def catalog_snapshot(self, basin=None, store=None):
+        """
+        Returns the in memory index of the geoserver catalog as a dictionary of
+        workspace > store > set of layer names. Workspace names are fetched
+        once per ttl, the stores of a workspace and the layers of a store are
+        fetched the first time they are asked for.
 
-        try:
-            s = check_output(cmd, shell=False, universal_newlines=True)
-        except Exception as e:
-            self.log.error(e)
-            copyfile(fname,final_fname)
+        Args:
+            basin: String name of a workspace whose stores are needed
+            store: String name of a store whose layers are needed
 
-        return final_fname
+        Returns:
+            dict: workspace name to dictionary of store name to set of layers
+        """
+        with self.catalog_lock:
+            expired = time.time() - self.catalog_time > self.catalog_ttl
+
+            if self.catalog == None or expired:
+                self.log.debug("Fetching catalog snapshot...")
+                self.catalog = {}
+                self.catalog_hrefs = {}
+                self.catalog_time = time.time()
+
+                rjson = self.get('workspaces')
+                if rjson['workspaces']:
+                    for w in rjson['workspaces']['workspace']:
+                        self.catalog[w['name']] = None
+                        self.catalog_hrefs[w['name']] = w['href']
+
+            ws = basin.lower() if basin != None else None
+
+            # Fetch the stores in a workspace on first use
+            if ws in self.catalog and self.catalog[ws] == None:
+                self.catalog[ws] = {}
+                ws_dict = self.get(self.catalog_hrefs[ws])
+                cs_dict = self.get(ws_dict['workspace']['coverageStores'])
+
+                if cs_dict['coverageStores']:
+                    for cs in cs_dict['coverageStores']['coverageStore']:
+                        self.catalog[ws][cs['name']] = None
+                        self.catalog_hrefs[(ws, cs['name'])] = cs['href']
+
+            # Fetch the layers in a store on first use
+            if (ws in self.catalog and store in self.catalog[ws] and
+                                        self.catalog[ws][store] == None):
+                self.catalog[ws][store] = set()
+                store_info = self.get(self.catalog_hrefs[(ws, store)])
+                coverages = self.get(store_info['coverageStore']['coverages'])
+
+                if coverages['coverages']:
+                    for cv in coverages['coverages']['coverage']:
+                        self.catalog[ws][store].add(cv['name'])
+
+            return self.catalog
+
+    def catalog_add(self, basin, store=None, layer=None):
+        """
+        Records an object we created in the catalog snapshot so it doesn't have
+        to be fetched again.
+
+        Args:
+            basin: String name of the workspace
+            store: String name of the store
+            layer: String name of the layer
+        """
+        with self.catalog_lock:
+            if self.catalog == None:
+                return
+
+            # Fetch what hasn't been yet so it isn't recorded as empty
+            catalog = self.catalog_snapshot(basin, store)
+
+            ws = basin.lower()
+            if ws not in catalog:
+                catalog[ws] = {}
+
+            if store != None:
+                if store not in catalog[ws]:
+                    catalog[ws][store] = set()
+
+                if layer != None:
+                    catalog[ws][store].add(layer)
+
+    def catalog_invalidate(self):
+        """
+        Drops the catalog snapshot so the next check fetches it again.
+        """
+        with self.catalog_lock:
+            self.catalog = None
 
     def exists(self, basin, store=None, layer=None):
         """
@@ -317,47 +814,18 @@ class AWSM_Geoserver(object):
         if layer != None:
             layer_exists = False
 
-        rjson = self.get('workspaces')
-
-        # Are there any workspaces?
-        if rjson['workspaces']:
-            ws_info = rjson['workspaces']
-
-            # Check if the basin exists as a workspace
-            for w in ws_info['workspace']:
-                if basin.lower() == w['name']:
-                    ws_exists = True
-                    break
-
-            # Store existance requested
-            if store != None:
-                # Grab info about this existing workspace
-                ws_dict = self.get(w['href'])
+        # Existence checks are lookups in the catalog snapshot
+        catalog = self.catalog_snapshot(basin, store)
+        ws = basin.lower()
 
-                # Grab info on rasters
-                cs_dict = self.get(ws_dict['workspace']['coverageStores'])
+        if ws in catalog:
+            ws_exists = True
 
-                # Check if there are any coverage stores
-                if cs_dict['coverageStores']:
-                    cs_info = cs_dict['coverageStores']
-
-                    # Check for matching name in the coverages
-                    for cs in cs_info['coverageStore']:
-                        if store == cs['name']:
-                            store_exists = True
-                            break
-
-            # layer existance requested
-            if layer != None:
-                # Grab info about this existing store
-                store_info = self.get(cs['href'])
-                coverages = self.get(store_info['coverageStore']['coverages'])
+            if store != None and store in catalog[ws]:
+                store_exists = True
 
-                # Check to see if there any coverages at all
-                if coverages['coverages']:
-                    for cv in coverages['coverages']['coverage']:
-                        if layer == cv['name']:
-                            layer_exists = True
+                if layer != None and layer in catalog[ws][store]:
+                    layer_exists = True
 
         result = [ws_exists, store_exists, layer_exists]
         expected = [r for r in result if r != None]
@@ -381,7 +849,7 @@ class AWSM_Geoserver(object):
             basin: String name of the new basin/workspace
         """
 
-        create_ws = ask_user("You are about to create a new basin on the"
+        create_ws = self.confirm("You are about to create a new basin on the"
                              " geoserver called: {}\nAre you sure you want"
                              " to continue?".format(basin))
         if not create_ws:
@@ -394,8 +862,10 @@ class AWSM_Geoserver(object):
                                      'enabled':True}}
 
             rjson = self.make('workspaces', payload)
+            self.catalog_add(basin)
 
-    def create_coveragestore(self, basin, store, filename, description=None):
+    def create_coveragestore(self, basin, store, filename, description=None,
+                                                          store_type='NetCDF'):
         """
         Creates a coverage data store for raster type data on the geoserver.
 
@@ -403,12 +873,19 @@ class AWSM_Geoserver(object):
             basin: String name of the targeted basin/workspace
             store: String name of the new coverage data store
             filename: Netcdf to associate with store, must exist locally to geoserver
+            store_type: Geoserver store type of the file e.g. NetCDF or GeoTIFF
 
         """
         bname = os.path.basename(filename)
 
         # Check to see if the store already exists...
         if self.exists(basin, store=store):
+            # Unattended runs reuse the store so reruns only add what's missing
+            if self.assume_yes:
+                self.log.warning("Coverage store {} exists, adding to it..."
+                                 "".format(store))
+                return
+
             self.log.error("Coverage store {} exists!".format(store))
             sys.exit()
             #resource = 'workspaces/{}/coveragestores/{}'.format(basin,store)
@@ -418,7 +895,7 @@ class AWSM_Geoserver(object):
             resource = 'workspaces/{}/coveragestores.json'.format(basin)
 
             payload = {"coverageStore":{"name":store,
-                                        "type":"NetCDF",
+                                        "type":store_type,
                                         "enabled":True,
                                         "_default":False,
                                         "workspace":{"name": basin},
@@ -427,7 +904,7 @@ class AWSM_Geoserver(object):
             if description != None:
                 payload['coverageStore']["description"] = description
 
-            create_cs = ask_user("You are about to create a new geoserver"
+            create_cs = self.confirm("You are about to create a new geoserver"
                                  " coverage store called: {} in the {}\n Are "
                                  " you sure you want to continue?"
                                  "".format(store, basin))
@@ -438,8 +915,10 @@ class AWSM_Geoserver(object):
                 self.log.info("Creating a new coverage on geoserver...")
                 self.log.debug(payload)
                 rjson = self.make(resource, payload)
+                self.catalog_add(basin, store)
 
-    def create_layer(self, basin, store, layer):
+    def create_layer(self, basin, store, layer, date=None, ranges=None,
+                                                native_name=None):
         """
         Create a raster layer on the geoserver
 
@@ -447,38 +926,45 @@ class AWSM_Geoserver(object):
             basin: String name of the targeted basin/workspace
             store: String name of the targeted data/coverage store
             layer: String name of the new layer to be made
+            date: Date string of the layer, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
+            native_name: Name of the coverage in the file, defaults to layer
 
         """
+        if date == None:
+            date = getattr(self, 'date', None)
+        if ranges == None:
+            ranges = self.ranges
+
         resource = ("workspaces/{}/coveragestores/{}/coverages.json"
                    "".format(basin, store))
 
         # Rename the isnobal stuff
         lyr_name = layer#.lower().replace(" ","_").replace('-','')
-        native_name = lyr_name#layer.replace('_',' ')
+        if native_name == None:
+            native_name = lyr_name#layer.replace('_',' ')
 
         # Make the names better
-        if native_name in ['snow_density','specific_mass','thickness']:
-            name = self.remap[native_name]
+        if lyr_name in ['snow_density','specific_mass','thickness']:
+            name = self.remap[lyr_name]
         else:
             name = lyr_name
 
         # Human readable title for geoserver UI
         if name.lower() == 'swe':
             title = ("{} {} {}".format(basin.title(),
-                                       self.date,
+                                       date,
                                        name.upper())).replace("_"," ")
         else:
             title = ("{} {} {}".format(basin,
-                                       self.date,
+                                       date,
                                        name)).replace("_"," ").title()
 
-        # Add an associated Date to the layer
-        if hasattr(self,'date'):
-            name = "{}{}".format(name, self.date.replace('-',''))
+        name = self.layer_name(layer, date=date)
 
         colormap = self.assign_cmap(name)
         payload = {"coverage":{"name":name,
-                               "nativeName":lyr_name,
+                               "nativeName":native_name,
                                "nativeCoverageName":native_name,
                                "store":{"name": "{}:{}".format(basin, store)},
                                "enabled":True,
@@ -486,65 +972,181 @@ class AWSM_Geoserver(object):
                                }}
 
         #If we have ranges for the layer, use it.
-        if lyr_name in self.ranges.keys():
+        if lyr_name in ranges.keys():
             self.log.info("Adding range for the image...")
             payload["coverage"]["dimensions"] = {"coverageDimension":[
                                                             {"name":"{}".format(name),
-                                                             "range":{"min":"{}".format(self.ranges[lyr_name][0]),
-                                                                      "max":"{}".format(self.ranges[lyr_name][1])},
+                                                             "range":{"min":"{}".format(ranges[lyr_name][0]),
+                                                                      "max":"{}".format(ranges[lyr_name][1])},
                                                               }]
                                                 }
         # submit the payload for creating a new coverage
         self.log.debug("Payload: {}".format(payload))
         response = self.make(resource, payload)
+        self.catalog_add(basin, store, name)
 
         # Assign Colormaps
         colormap = self.assign_cmap(name)
-        resource = ("layers/{}:{}".format(basin, name))
+        self.assign_style(basin, name, colormap)
 
-        # Get the automated layer
-        rjson = self.get(resource)
+    def assign_style(self, basin, layer, style):
+        """
+        Sets the default style of a layer with a PUT through the session. Known
+        styles are cached so layers already using the style are skipped
+        without a write. The REST API has no bulk layer update so each layer
+        needing a change gets its own PUT.
 
-        self.log.info("Assigning {} colormap.".format(colormap))
-        rjson["layer"]["defaultStyle"] = {"name": colormap}
-        rjson["layer"]["opaque"] = True
+        Args:
+            basin: String name of the targeted basin/workspace
+            layer: String name of the layer
+            style: String name of the style to use
+
+        Returns:
+            bool: True if the style was changed, False if it was already set
+        """
+        resource = "layers/{}:{}".format(basin, layer)
+        start = time.perf_counter()
+
+        with self.catalog_lock:
+            current = self.styles.get(resource)
+
+        # Ask the geoserver what the layer has if we haven't seen it
+        if current == None:
+            rjson = self.get(resource)
+            current = rjson["layer"].get("defaultStyle", {}).get("name")
+
+        if current == style:
+            self.log.debug("{} already uses the {} style".format(layer, style))
+            changed = False
+
+        else:
+            self.log.info("Assigning {} colormap.".format(style))
+            headers = {'accept':'text/xml', 'content-type':'text/xml'}
+            payload = ("<layer><defaultStyle><name>{}</name></defaultStyle>"
+                       "</layer>".format(style))
+
+            r = self.request('PUT', resource + '.xml', headers=headers,
+                                                       data=payload,
+                                                       verify=False)
+            r.raise_for_status()
+            changed = True
+
+        with self.catalog_lock:
+            self.styles[resource] = style
+
+        self.tracer.record('style', time.perf_counter() - start, layer=layer,
+                                                                 changed=changed)
+        return changed
+
+    def layer_name(self, layer, date=None):
+        """
+        Name a netcdf variable is published under, remapped and dated.
+
+        Args:
+            layer: String name of the netcdf variable
+            date: Date string of the layer
+
+        Returns:
+            str: name of the layer on the geoserver
+        """
+        name = self.remap.get(layer, layer)
 
-        payload = {"layer":{"defaultStyle":{"name": "dynamic_default"}}}
+        # Add an associated Date to the layer
+        if date != None:
+            name = "{}{}".format(name, date.replace('-',''))
+
+        return name
+
+    def publish_layer(self, basin, store, name, date=None, ranges=None,
+                                                native_name=None):
+        """
+        Creates a single layer, isolating any error so it can't stop the other
+        layers being published.
+
+        Args:
+            basin: String name of the targeted basin/workspace
+            store: String name of the targeted data/coverage store
+            name: String name of the layer to publish
+            date: Date string of the layer, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
+            native_name: Name of the coverage in the file, defaults to name
+
+        Returns:
+            tuple: layer name, status of created/skipped/failed, error or None
+        """
+        if date == None:
+            date = getattr(self, 'date', None)
 
-        #r = self.modify(resource,payload)
+        try:
+            if self.exists(basin, store, self.layer_name(name, date=date)):
+                self.log.info("Layer {} from store {} in the {} exists..."
+                      "".format(name, store, basin))
+                self.log.warning("Skipping layer {} to geoserver.".format(name))
+                return name, 'skipped', None
 
-        cmd = ["curl","-u","{}:{}".format(self.geoserver_username, self.geoserver_password),
-               "-XPUT", "-H", '"accept:text/xml"', "-H",'"content-type:text/xml"',
-               urljoin(self.url,resource+'.xml'), "-d",'"<layer><defaultStyle><name>{}</name></defaultStyle></layer>"'.format(colormap),
-               "-v"]
-        self.log.debug("Executing hack:\n{}".format(" ".join(cmd)))
-        s = check_output(" ".join(cmd), shell=True, universal_newlines=True)
-        rjson = self.get(resource)
+            self.log.info("Adding {} from {} to the {}".format(name,
+                                                       store,
+                                                       basin))
+            self.create_layer(basin, store, name, date=date, ranges=ranges,
+                                                  native_name=native_name)
+            return name, 'created', None
 
+        except Exception as e:
+            self.log.error("Failed to publish layer {}: {}".format(name, e))
+            return name, 'failed', str(e)
 
-    def create_layers_from_netcdf(self, basin, store, filename, layers=None,):
+    def create_layers_from_netcdf(self, basin, store, filename, layers=None,
+                                                                workers=None,
+                                                                date=None,
+                                                                ranges=None):
         """
         Opens a netcdf locally and adds all layers to the geoserver that are in
         the entire image if layers = None otherwise adds only the layers listed.
+        Layers are published concurrently with at most workers at once.
 
         Args:
             basin: String name of the targeted basin/workspace
             store: String name of a targeted netcdf coverage store
             layers: List of layers to add, if none add all layers except x,y,
                     time, and projection
+            workers: Number of layers to publish at once, defaults to the
+                     number the class was made with
+            date: Date string of the layers, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
+
+        Returns:
+            dict: lists of layers created and skipped and a dictionary of
+                  failed layers to their errors
         """
+        start = time.time()
+        summary = {'created':[], 'skipped':[], 'failed':{}}
 
-        for name in layers:
+        if workers == None:
+            workers = self.workers
 
-            if self.exists(basin, store, name):
-                self.log.info("Layer {} from store {} in the {} exists..."
-                      "".format(name, store, basin))
-                self.log.warning("Skipping layer {} to geoserver.".format(name))
-            else:
-                self.log.info("Adding {} from {} to the {}".format(name,
-                                                           store,
-                                                           basin))
-                self.create_layer(basin, store, name)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [self.submit(pool, self.publish_layer, basin, store, name,
+                                                   date=date, ranges=ranges)
+                                                            for name in layers]
+
+            for future in futures:
+                name, status, error = future.result()
+
+                if status == 'failed':
+                    summary['failed'][name] = error
+                else:
+                    summary[status].append(name)
+
+        self.log.info("Published {} layers to {} in {:0.1f}s: {} created, {}"
+                      " skipped, {} failed".format(len(layers), store,
+                                                   time.time() - start,
+                                                   len(summary['created']),
+                                                   len(summary['skipped']),
+                                                   len(summary['failed'])))
+        for name, error in summary['failed'].items():
+            self.log.error("    {}: {}".format(name, error))
+
+        return summary
 
     def upload(self, basin, filename, upload_type='modeled', espg=None, mask=None):
         """
@@ -563,36 +1165,144 @@ class AWSM_Geoserver(object):
         self.log.info("Source Filename: {}".format(filename))
         self.log.info("Mask Filename: {}".format(mask))
 
-        # Ensure that this workspace exists
-        if not self.exists(basin):
+        # Attribute everything traced from here to this file
+        token = current_upload.set(filename)
+        try:
+            # Ensure that this workspace exists
+            if not self.exists(basin):
 
-            self.create_basin(basin)
+                self.create_basin(basin)
+
+            # Reduce the size of netcdfs if possible and grab the layer names
+            item = self.prepare(basin, filename, upload_type=upload_type,
+                                                 espg=espg,
+                                                 mask=mask)
 
-        # Reduce the size of netcdfs if possible return the new filename
+            if len(item['layers']) == 0:
+                self.log.error("No variables found in netcdf...exiting.")
+                sys.exit()
+
+            # Copy users data up to the remote location
+            remote_fname = self.send(item)
+
+            self.publish(item, remote_fname)
+
+        finally:
+            current_upload.reset(token)
+        self.tracer.report(self.log, uploads=[filename])
+        self.report_stats()
+
+    def prepare(self, basin, filename, upload_type='modeled', espg=None,
+                                                   mask=None, output_dir=None):
+        """
+        Extracts a file for upload and gathers everything publishing it needs,
+        so publishing doesn't depend on whichever file was extracted last.
+
+        Args:
+            basin: string name of the basin/workspace to upload to.
+            filename: path of a local to the script file to upload
+            upload_type: Determines how the data is uploaded
+            espg: Projection code to use if projection information not found
+            mask: Filename of a netcdf containing a mask layer
+            output_dir: Directory to write the extracted file to
+
+        Returns:
+            dict: basin, source and extracted filename, upload type, date,
+                  layers and layer ranges
+        """
+        source = filename
         filename = self.extract_data(filename, upload_type=upload_type,
                                                espg=espg,
-                                               mask=mask)
-
-        # Copy users data up to the remote location
-        remote_fname = self.copy_data(filename, basin, upload_type=upload_type)
+                                               mask=mask,
+                                               output_dir=output_dir)
 
         # Grab the layer names
-        ds = Dataset(filename)
-        layers = []
-        for name, v in ds.variables.items():
-            if name not in ['time','x','y','projection']:
-                layers.append(name)
-
-        if len(layers) == 0:
-            self.log.error("No variables found in netcdf...exiting.")
-            sys.exit()
+        with Dataset(filename) as ds:
+            layers = [name for name in ds.variables.keys()
+                                if name not in ['time','x','y','projection']]
+
+        item = {'basin':basin,
+                'source':source,
+                'filename':filename,
+                'upload_type':upload_type,
+                'date':getattr(self, 'date', None),
+                'layers':layers,
+                'ranges':{l:self.ranges[l] for l in layers if l in self.ranges}}
+
+        if self.geotiff:
+            item['geotiffs'] = dict(self.geotiffs)
+
+        # Mosaics take the GeoTIFF of each layer
+        if self.mosaic and upload_type == 'modeled':
+            item['granules'] = item.pop('geotiffs')
+
+        return item
+
+    def send(self, item):
+        """
+        Copies a prepared file to the geoserver, or each of its granules to
+        their mosaic folder when publishing to time mosaics, or each of its
+        GeoTIFFs when publishing those.
+
+        Args:
+            item: dictionary returned by prepare
+
+        Returns:
+            str: remote filename or a dictionary of layer to remote granule
+                 or GeoTIFF filename
+        """
+        if 'granules' in item:
+            return {layer:self.copy_data(granule, item['basin'],
+                                     subdir=self.mosaic_dir(layer))
+                                    for layer, granule in item['granules'].items()}
+
+        if 'geotiffs' in item:
+            return {layer:self.copy_data(geotiff, item['basin'])
+                                    for layer, geotiff in item['geotiffs'].items()}
+
+        return self.copy_data(item['filename'], item['basin'],
+                                                upload_type=item['upload_type'])
+
+    def publish(self, item, remote_fname):
+        """
+        Publishes a prepared file that is already on the geoserver.
+
+        Args:
+            item: dictionary returned by prepare
+            remote_fname: Remote path of the file
+
+        Returns:
+            dict: summary of the published layers, see create_layers_from_netcdf
+        """
+        with self.tracer.span('publish'):
+            return self._publish(item, remote_fname)
+
+    def _publish(self, item, remote_fname):
+        basin = item['basin']
+        upload_type = item['upload_type']
+
+        # Ensure that this workspace exists
+        if not self.exists(basin):
+            self.create_basin(basin)
 
         # Check for the upload type which determines the filename, and store type
-        if upload_type == 'topo':
-            self.submit_topo(remote_fname, basin, layers=layers)
+        if upload_type == 'topo' and 'geotiffs' not in item:
+            return self.submit_topo(remote_fname, basin, layers=item['layers'],
+                                                         date=item['date'],
+                                                         ranges=item['ranges'])
+
+        elif upload_type == 'modeled' and 'granules' in item:
+            return self.submit_mosaic(basin, remote_fname)
+
+        elif upload_type in ['topo', 'modeled'] and 'geotiffs' in item:
+            return self.submit_geotiffs(basin, remote_fname, date=item['date'],
+                                                         ranges=item['ranges'])
 
         elif upload_type == 'modeled':
-            self.submit_modeled(remote_fname, basin, layers=layers)
+            return self.submit_modeled(remote_fname, basin,
+                                                     layers=item['layers'],
+                                                     date=item['date'],
+                                                     ranges=item['ranges'])
 
         elif upload_type == 'flight':
             self.log.error("Uploading flights is undeveloped")
@@ -603,7 +1313,126 @@ class AWSM_Geoserver(object):
         else:
             raise ValueError("Invalid upload type!")
 
-    def submit_topo(self, filename, basin, layers=None):
+    def upload_batch(self, items, work_dir='.', depth=2):
+        """
+        Uploads many files through one client and catalog. Extraction, transfer
+        and publishing run as overlapping stages, so one file is transferred
+        while the next is extracted and the one before is published. Each stage
+        takes the items in order and at most depth items wait between stages.
+
+        Args:
+            items: List of dictionaries with basin, filename and optionally
+                   upload_type, espg and mask, e.g. from read_manifest
+            work_dir: Directory to extract into, one folder per basin
+            depth: Number of items allowed to wait between stages
+
+        Returns:
+            list: dictionaries of the basin, filename, status (done or failed),
+                  stage and error of any failure and the layer summary of each
+                  item in order
+        """
+        start = time.time()
+        results = [{'basin':item['basin'], 'filename':item['filename'],
+                    'status':'pending', 'stage':None, 'error':None,
+                    'layers':None} for item in items]
+
+        extracted = queue.Queue(maxsize=depth)
+        transferred = queue.Queue(maxsize=depth)
+
+        def failed(i, stage, e):
+            self.log.error("Failed to {} {}: {}".format(stage,
+                                                        items[i]['filename'],
+                                                        e))
+            results[i].update({'status':'failed', 'stage':stage,
+                               'error':str(e)})
+
+        def extract():
+            try:
+                for i, item in enumerate(items):
+                    token = current_upload.set(item['filename'])
+                    try:
+                        output_dir = os.path.join(work_dir, item['basin'])
+                        if not os.path.isdir(output_dir):
+                            os.makedirs(output_dir)
+
+                        prepared = self.prepare(item['basin'], item['filename'],
+                                    upload_type=item.get('upload_type', 'modeled'),
+                                    espg=item.get('espg'),
+                                    mask=item.get('mask'),
+                                    output_dir=output_dir)
+
+                        if len(prepared['layers']) == 0:
+                            raise ValueError("No variables found in netcdf")
+
+                        extracted.put((i, prepared))
+
+                    except Exception as e:
+                        failed(i, 'extract', e)
+
+                    finally:
+                        current_upload.reset(token)
+            finally:
+                extracted.put(None)
+
+        def send():
+            try:
+                for i, prepared in iter(extracted.get, None):
+                    token = current_upload.set(prepared['source'])
+                    try:
+                        remote = self.send(prepared)
+                        transferred.put((i, prepared, remote))
+
+                    except Exception as e:
+                        failed(i, 'transfer', e)
+
+                    finally:
+                        current_upload.reset(token)
+            finally:
+                transferred.put(None)
+
+        stages = [threading.Thread(target=extract, name='extract'),
+                  threading.Thread(target=send, name='transfer')]
+        for t in stages:
+            t.daemon = True
+            t.start()
+
+        # Publishing runs here and fans out over the layers itself
+        for i, prepared, remote in iter(transferred.get, None):
+            token = current_upload.set(prepared['source'])
+            try:
+                summary = self.publish(prepared, remote)
+                results[i]['layers'] = summary
+
+                if summary != None and summary['failed']:
+                    raise ValueError("{} layers failed".format(
+                                                     len(summary['failed'])))
+                results[i]['status'] = 'done'
+
+            except Exception as e:
+                failed(i, 'publish', e)
+
+            finally:
+                current_upload.reset(token)
+
+        for t in stages:
+            t.join()
+
+        done = len([r for r in results if r['status'] == 'done'])
+        self.log.info("Uploaded {} of {} files in {:0.1f}s".format(done,
+                                                          len(results),
+                                                          time.time() - start))
+        for r in results:
+            if r['status'] != 'done':
+                self.log.error("    {} ({}) failed to {}: {}".format(
+                                 r['filename'], r['basin'], r['stage'],
+                                 r['error']))
+
+        self.tracer.report(self.log, uploads=[item['filename'] for item in items])
+        self.report_stats()
+
+        return results
+
+    def submit_topo(self, filename, basin, layers=None, date=None, ranges=None):
         """
         Uploads the basins topo images which are static. These images include:
         * dem
@@ -615,17 +1444,29 @@ class AWSM_Geoserver(object):
             filename: Remote path of a netcdf to upload
             basin: Basin associated to the topo image
             layers: Netcdf variables names to add as layers on GS
+            date: Date string of the upload, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
+
+        Returns:
+            dict: summary of the published layers
         """
+        if date == None:
+            date = self.date
+
         # Always call store names the same thing, <basin>_topo
         store_name = "{}_topo".format(basin)
         description = ("NetCDF file containing topographic images required for "
                        "modeling the {} watershed in AWSM.\n"
-                       "Uploaded: {}").format(basin, self.date)
+                       "Uploaded: {}").format(basin, date)
         self.create_coveragestore(basin, store_name, filename, description=description)
 
-        self.create_layers_from_netcdf(basin, store_name, filename, layers=layers)
+        return self.create_layers_from_netcdf(basin, store_name, filename,
+                                                    layers=layers,
+                                                    date=date,
+                                                    ranges=ranges)
 
-    def submit_modeled(self, filename, basin, layers=None):
+    def submit_modeled(self, filename, basin, layers=None, date=None,
+                                                           ranges=None):
         """
         Uploads the basins modeled data. These images include:
         * density
@@ -636,8 +1477,14 @@ class AWSM_Geoserver(object):
             filename: Remote path of a netcdf to upload
             basin: Basin associated to the topo image
             layers: Netcdf variables names to add as layers on GS
+            date: Model date string, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
 
+        Returns:
+            dict: summary of the published layers
         """
+        if date == None:
+            date = self.date
 
         # Always call store names the same thing, <basin>_snow_<date>
         store_name = "{}_{}".format(basin,
@@ -647,7 +1494,7 @@ class AWSM_Geoserver(object):
                        "the {} watershed produced by AWSM.\n"
                        "Model Date: {}"
                        "Date Uploaded: {}").format(basin,
-                                       self.date,
+                                       date,
                                        dt.today().isoformat().split('T')[0])
 
         self.create_coveragestore(basin, store_name, filename,
@@ -655,7 +1502,258 @@ class AWSM_Geoserver(object):
 
         # Create layers density, specific mass, thickness
 
-        self.create_layers_from_netcdf(basin, store_name, filename, layers=layers)
+        return self.create_layers_from_netcdf(basin, store_name, filename,
+                                                    layers=layers,
+                                                    date=date,
+                                                    ranges=ranges)
+
+    def submit_geotiffs(self, basin, geotiffs, date=None, ranges=None,
+                                               workers=None):
+        """
+        Publishes a GeoTIFF store and layer for each exported layer.
+
+        Args:
+            basin: Basin associated to the data
+            geotiffs: Dictionary of layer to remote GeoTIFF filename
+            date: Date string of the layers, defaults to the last extracted
+            ranges: Dictionary of layer ranges, defaults to the last extracted
+            workers: Number of layers to publish at once
+
+        Returns:
+            dict: summary of the published layers, see create_layers_from_netcdf
+        """
+        start = time.time()
+        summary = {'created':[], 'skipped':[], 'failed':{}}
+
+        if workers == None:
+            workers = self.workers
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [self.submit(pool, self.publish_geotiff, basin, layer, remote,
+                                                         date, ranges)
+                                          for layer, remote in geotiffs.items()]
+
+            for future in futures:
+                name, status, error = future.result()
+
+                if status == 'failed':
+                    summary['failed'][name] = error
+                else:
+                    summary[status].append(name)
+
+        self.log.info("Published {} GeoTIFFs in {:0.1f}s: {} created, {}"
+                      " skipped, {} failed".format(len(geotiffs),
+                                                   time.time() - start,
+                                                   len(summary['created']),
+                                                   len(summary['skipped']),
+                                                   len(summary['failed'])))
+        for name, error in summary['failed'].items():
+            self.log.error("    {}: {}".format(name, error))
+
+        return summary
+
+    def publish_geotiff(self, basin, layer, remote, date=None, ranges=None):
+        """
+        Creates the store of a single GeoTIFF, named after the file, and its
+        layer. Errors are isolated so they can't stop the other layers.
+
+        Args:
+            basin: String name of the targeted basin/workspace
+            layer: String name of the netcdf variable
+            remote: Remote path of the GeoTIFF
+            date: Date string of the layer
+            ranges: Dictionary of layer ranges
+
+        Returns:
+            tuple: layer name, status of created/skipped/failed, error or None
+        """
+        native_name = os.path.basename(remote).split('.')[0]
+        store = "{}_{}".format(basin, native_name)
+
+        try:
+            if not self.exists(basin, store=store):
+                description = ("Cloud optimized GeoTIFF of {} from the {}"
+                               " watershed.\nDate: {}").format(layer, basin,
+                                                               date)
+                self.create_coveragestore(basin, store, remote,
+                                                 description=description,
+                                                 store_type='GeoTIFF')
+
+        except Exception as e:
+            self.log.error("Failed to create store {}: {}".format(store, e))
+            return layer, 'failed', str(e)
+
+        return self.publish_layer(basin, store, layer, date=date,
+                                                       ranges=ranges,
+                                                       native_name=native_name)
+
+    def mosaic_dir(self, layer):
+        """
+        Folder under the basin holding the granules of a layer's time mosaic.
+        """
+        return os.path.join('mosaics', self.layer_name(layer))
+
+    def submit_mosaic(self, basin, granules, workers=None):
+        """
+        Appends the granules of a modeled date to one time enabled image mosaic
+        per basin and layer instead of making a store per date, so the catalog
+        stays the same size over a season and clients pick dates with TIME.
+
+        Args:
+            basin: Basin associated to the modeled data
+            granules: Dictionary of layer to remote granule filename
+            workers: Number of mosaics to update at once
+
+        Returns:
+            dict: summary of the mosaics, see create_layers_from_netcdf
+        """
+        start = time.time()
+        summary = {'created':[], 'skipped':[], 'failed':{}}
+
+        if workers == None:
+            workers = self.workers
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [self.submit(pool, self.publish_granule, basin, layer, remote)
+                                       for layer, remote in granules.items()]
+
+            for future in futures:
+                name, status, error = future.result()
+
+                if status == 'failed':
+                    summary['failed'][name] = error
+                else:
+                    summary[status].append(name)
+
+        self.log.info("Added {} granules in {:0.1f}s: {} added, {} skipped, {}"
+                      " failed".format(len(granules), time.time() - start,
+                                       len(summary['created']),
+                                       len(summary['skipped']),
+                                       len(summary['failed'])))
+        for name, error in summary['failed'].items():
+            self.log.error("    {}: {}".format(name, error))
+
+        return summary
+
+    def publish_granule(self, basin, layer, remote):
+        """
+        Adds a granule to its layer's mosaic, creating the mosaic the first
+        time. Errors are isolated so they can't stop the other layers.
+
+        Args:
+            basin: String name of the targeted basin/workspace
+            layer: String name of the netcdf variable
+            remote: Remote path of the granule
+
+        Returns:
+            tuple: layer name, status of created/skipped/failed, error or None
+        """
+        name = self.layer_name(layer)
+        store = "{}_{}".format(basin, name)
+        granule = os.path.basename(remote)
+        resource = ("workspaces/{}/coveragestores/{}/external.imagemosaic"
+                    "".format(basin, store))
+
+        try:
+            if not self.exists(basin, store):
+                self.create_mosaic(basin, store, layer)
+                return name, 'created', None
+
+            # Harvesting the same file twice would index it twice
+            index = self.get("workspaces/{}/coveragestores/{}/coverages/{}/"
+                             "index/granules.json?{}".format(basin, store, name,
+                             urlencode({'filter':"location LIKE '%{}'"
+                                                 "".format(granule)})))
+            if index.get('features'):
+                self.log.info("Granule {} is already in {}".format(granule,
+                                                                   store))
+                return name, 'skipped', None
+
+            self.log.info("Adding {} to the {} mosaic".format(granule, store))
+            r = self.request('POST', resource, headers={'content-type':
+                                                        'text/plain'},
+                                               data="file://{}".format(remote),
+                                               verify=False)
+            r.raise_for_status()
+            return name, 'created', None
+
+        except Exception as e:
+            self.log.error("Failed to add granule {}: {}".format(granule, e))
+            return name, 'failed', str(e)
+
+    def create_mosaic(self, basin, store, layer):
+        """
+        Creates a time enabled image mosaic from a layer's mosaic folder. The
+        index configuration is sent first so the geoserver parses the time of
+        each granule from its name, then every granule already in the folder
+        is indexed when the store is made.
+
+        Args:
+            basin: String name of the targeted basin/workspace
+            store: String name of the new mosaic store
+            layer: String name of the netcdf variable
+        """
+        name = self.layer_name(layer)
+        subdir = self.mosaic_dir(layer)
+        directory = os.path.join(self.data, basin, subdir)
+
+        config = {'indexer.properties':
+                      "Name={}\n"
+                      "TimeAttribute=time\n"
+                      "Schema=*the_geom:Polygon,location:String,"
+                      "time:java.util.Date\n"
+                      "PropertyCollectors=TimestampFileNameExtractorSPI"
+                      "[timeregex](time)\n".format(name),
+                  'timeregex.properties': "regex=[0-9]{8}\n"}
+
+        tmp = tempfile.mkdtemp()
+        try:
+            for fname, text in config.items():
+                with open(os.path.join(tmp, fname), 'w') as fp:
+                    fp.write(text)
+                self.copy_data(os.path.join(tmp, fname), basin, subdir=subdir)
+        finally:
+            shutil.rmtree(tmp)
+
+        create_cs = self.confirm("You are about to create a new geoserver"
+                                 " time mosaic called: {} in the {}\n Are"
+                                 " you sure you want to continue?"
+                                 "".format(store, basin))
+        if not create_cs:
+            self.log.info("Aborting creating a new mosaic. Exiting...")
+            sys.exit()
+
+        self.log.info("Creating a new time mosaic {} on geoserver...".format(
+                                                                        store))
+        r = self.request('PUT', "workspaces/{}/coveragestores/{}/"
+                                "external.imagemosaic".format(basin, store),
+                                params={'configure':'all'},
+                                headers={'content-type':'text/plain'},
+                                data="file://{}".format(directory),
+                                verify=False)
+        r.raise_for_status()
+        self.catalog_add(basin, store, name)
+
+        # Turn on the time dimension, defaulting to the latest date
+        if name.lower() == 'swe':
+            title = "{} {}".format(basin.title(), name.upper())
+        else:
+            title = "{} {}".format(basin, name).replace("_"," ").title()
+
+        payload = {"coverage":{"title":title,
+                               "enabled":True,
+                               "metadata":{"entry":[
+                                  {"@key":"time",
+                                   "dimensionInfo":{"enabled":True,
+                                                    "presentation":"LIST",
+                                                    "units":"ISO8601",
+                                                    "defaultValue":{
+                                                       "strategy":"MAXIMUM"}}}
+                                                    ]}}}
+        self.modify("workspaces/{}/coveragestores/{}/coverages/{}.json"
+                    "".format(basin, store, name), payload)
+
+        self.assign_style(basin, name, self.assign_cmap(name))
 
     def assign_cmap(self, name):
         """
@@ -700,20 +1798,86 @@ def ask_user(msg):
     return response
 
 
+def read_manifest(fname):
+    """
+    Reads a manifest of files to upload in a batch. CSV manifests need a
+    header, YAML manifests (requires PyYAML) are a list of mappings. Each entry
+    needs a basin and file and can have a type, espg and mask. Relative paths
+    are relative to the manifest. e.g.
+
+        basin,file,type,mask
+        brb,runs/run20200401/snow.nc,modeled,topo/topo.nc
+
+    Args:
+        fname: Path to a .csv, .yml or .yaml manifest
+
+    Returns:
+        list: dictionaries of basin, filename, upload_type, espg and mask
+    """
+    # Column names also accepted to match the command line
+    aliases = {'filename':'file', 'upload_type':'type'}
+    types = ['flight','topo','shapefile','modeled']
+
+    with open(fname) as fp:
+        if os.path.splitext(fname)[-1].lower() in ['.yml', '.yaml']:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading YAML manifests requires PyYAML,"
+                                  " pip install pyyaml or use a CSV manifest")
+            entries = yaml.safe_load(fp) or []
+        else:
+            entries = list(csv.DictReader(fp))
+
+    root = os.path.dirname(os.path.abspath(fname))
+    items = []
+
+    for i, entry in enumerate(entries):
+        entry = {aliases.get(str(k).strip().lower(), str(k).strip().lower()):
+                 v.strip() if isinstance(v, str) else v
+                                                   for k, v in entry.items()}
+        # Treat empty cells as missing
+        entry = {k:v for k, v in entry.items() if v not in [None, '']}
+
+        for key in ['basin', 'file']:
+            if key not in entry:
+                raise ValueError("Entry {} in {} is missing a {}"
+                                 "".format(i + 1, fname, key))
+
+        upload_type = entry.get('type', 'modeled')
+        if upload_type not in types:
+            raise ValueError("Entry {} in {} has an invalid type {}, use one"
+                             " of {}".format(i + 1, fname, upload_type,
+                                             ", ".join(types)))
+
+        mask = entry.get('mask')
+        items.append({'basin':entry['basin'],
+                      'filename':os.path.join(root, entry['file']),
+                      'upload_type':upload_type,
+                      'espg':int(entry['espg']) if 'espg' in entry else None,
+                      'mask':os.path.join(root, mask) if mask else None})
+
+    return items
+
+
 def main():
     # Parge command line arguments
     p = argparse.ArgumentParser(description="Submits either a lidar flight,"
                                             " AWSM/SMRF topo image, or AWSM "
                                             " modeling results to a geoserver")
 
-    p.add_argument('-f','--filename', dest='filename',
-                    required=True,
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f','--filename', dest='filename',
                     help="Path to a file containing either a lidar flight,"
                     "AWSM/SMRF topo image, or AWSM modeling results or shapefiles"
                     )
 
+    source.add_argument('--manifest', dest='manifest',
+                    help="CSV or YAML manifest of basin, file, type, espg and"
+                    " mask to upload in a batch without prompting")
+
     p.add_argument('-b','--basin', dest='basin',
-                    required=True, choices=['brb', 'kaweah', 'kings', 'lakes', 'merced', 'sanjoaquin'],
+                    required=False, choices=['brb', 'kaweah', 'kings', 'lakes', 'merced', 'sanjoaquin'],
                     help="Basin name to submit to which is also the geoserver"
                          " workspace name")
 
@@ -738,15 +1902,72 @@ def main():
                     help="Netcdf containing a mask layer")
 
 
+    p.add_argument('-w','--workers', dest='workers',
+                    type=int, default=4,
+                    help="Number of layers to publish at once")
+
+    p.add_argument('-s','--stretch', dest='stretch',
+                    type=float, nargs=2, default=None,
+                    help="Low and high percentiles to use for the layer"
+                    " ranges instead of the min and max, e.g. 2 98")
+
+    p.add_argument('-y','--yes', dest='yes',
+                    action='store_true',
+                    help="Answer yes to every question, existing stores are"
+                    " added to instead of exiting")
+
+    p.add_argument('--mosaic', dest='mosaic',
+                    action='store_true',
+                    help="Append modeled dates to a time enabled mosaic of"
+                    " GeoTIFF granules per basin and layer instead of making"
+                    " a store per date, requires --geotiff")
+
+    p.add_argument('--geotiff', dest='geotiff',
+                    action='store_true',
+                    help="Publish cloud optimized GeoTIFFs with overviews of"
+                    " each layer instead of the netcdf")
+
+    p.add_argument('--trace', dest='trace',
+                    nargs='?', const=True, default=None,
+                    help="Report the time and bytes of each stage and request,"
+                    " optionally appending them as JSON lines to a file")
+
+    p.add_argument('-d','--work_dir', dest='work_dir',
+                    default='.',
+                    help="Directory to extract batch files into")
+
     args = p.parse_args()
 
+    if args.filename != None and args.basin == None:
+        p.error("--basin is required when uploading a single file")
+
+    if args.mosaic and not args.geotiff:
+        p.error("--mosaic requires --geotiff")
+
+    # Batches never stop to ask
+    items = None
+    if args.manifest != None:
+        items = read_manifest(args.manifest)
+
     # Get an instance to interact with the geoserver.
-    gs = AWSM_Geoserver(args.credentials)
+    gs = AWSM_Geoserver(args.credentials, workers=args.workers,
+                                          stretch=args.stretch,
+                                          assume_yes=args.yes or items != None,
+                                          mosaic=args.mosaic,
+                                          geotiff=args.geotiff,
+                                          trace=args.trace)
+
+    if items != None:
+        results = gs.upload_batch(items, work_dir=args.work_dir)
+
+        if any([r['status'] != 'done' for r in results]):
+            sys.exit(1)
 
     # Upload a file
-    gs.upload(args.basin,args.filename, upload_type=args.upload_type,
-                                        espg=args.espg,
-                                        mask=args.mask)
+    else:
+        gs.upload(args.basin,args.filename, upload_type=args.upload_type,
+                                            espg=args.espg,
+                                            mask=args.mask)
 
 
 if __name__ =='__main__':
@@ -1,13 +1,379 @@
 import os
 import sys
 from subprocess import check_output
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
 import argparse
+import hashlib
+import json
+import re
 import time
 import coloredlogs
 import logging
 
+# Where parsed wgrib2 inventories are kept between runs
+CACHE_DIR = os.path.expanduser(os.path.join("~", ".cache", "grib2nc"))
 
-def grib2nc(f_hrrr, output=None, external_logger=None):
+# criteria dictionary for extracting variables, CASE MATTERS. The pygrib keys
+# select the same messages for the python engine and the netcdf name matches
+# what wgrib2 -netcdf writes so SMRF reads either output the same way. When an
+# accumulated variable matches several messages both engines keep the ones
+# accumulated over its accumulation hours, e.g. the hourly bucket of APCP next
+# to the total since the start of the forecast. The python engine refuses files
+# where a variable still matches more than one message.
+CRITERIA = {'air_temp': {
+				'wgrib2 keys':[":TMP Temperature","2 m"],
+				'pygrib keys':{'shortName':'2t', 'level':2},
+				'netcdf name':'TMP_2maboveground'},
+
+			'dew_point': {
+				'wgrib2 keys':[":DPT","2 m"],
+				'pygrib keys':{'shortName':'2d', 'level':2},
+				'netcdf name':'DPT_2maboveground'},
+
+			'relative_humidity': {
+				'wgrib2 keys':[":RH Relative Humidity","2 m"],
+				'pygrib keys':{'shortName':'2r', 'level':2},
+				'netcdf name':'RH_2maboveground'},
+
+			'wind_u': {
+				'wgrib2 keys':[":UGRD U-Component","10 m"],
+				'pygrib keys':{'shortName':'10u', 'level':10},
+				'netcdf name':'UGRD_10maboveground'},
+
+			'wind_v': {
+				'wgrib2 keys':[":VGRD V-Component","10 m"],
+				'pygrib keys':{'shortName':'10v', 'level':10},
+				'netcdf name':'VGRD_10maboveground'},
+
+			'precip_int': {
+				'wgrib2 keys':[":APCP Total Precipitation"],
+				'pygrib keys':{'shortName':'tp', 'typeOfLevel':'surface'},
+				'accumulation':1,
+				'netcdf name':'APCP_surface'},
+
+			'short_wave': {
+				'wgrib2 keys':['Downward Short-Wave Radiation Flux', ':surface'],
+				'pygrib keys':{'discipline':0, 'parameterCategory':4,
+							   'parameterNumber':7, 'typeOfLevel':'surface'},
+				'netcdf name':'DSWRF_surface'},
+			}
+
+
+def file_hash(fname, blocksize=2**20):
+	"""
+	Hashes the contents of a file for keying the inventory cache.
+
+	args:
+		fname: Path to a file
+		blocksize: Number of bytes to read at a time
+
+	returns:
+		str: sha1 hex digest of the file contents
+	"""
+	h = hashlib.sha1()
+	with open(fname, 'rb') as fp:
+		for block in iter(lambda: fp.read(blocksize), b''):
+			h.update(block)
+
+	return h.hexdigest()
+
+
+def read_inventory(f_hrrr, cache_dir=CACHE_DIR):
+	"""
+	Reads the verbose wgrib2 inventory of a grib file once. The inventory is
+	cached on disk keyed by the file hash so repeated conversions of the same
+	file skip the scan.
+
+	args:
+		f_hrrr: Path to a HRRR grib file
+		cache_dir: Directory for cached inventories, None disables the cache
+
+	returns:
+		list: lines of the inventory
+	"""
+	cache_file = None
+	if cache_dir != None:
+		cache_file = os.path.join(cache_dir, file_hash(f_hrrr) + ".inv")
+
+		if os.path.isfile(cache_file):
+			with open(cache_file) as fp:
+				return fp.read().splitlines()
+
+	s = check_output(["wgrib2", "-v", f_hrrr]).decode('utf-8')
+
+	if cache_file != None:
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+		# Write then rename so concurrent conversions never see half a file
+		tmp = "{}.{}".format(cache_file, os.getpid())
+		with open(tmp, 'w') as fp:
+			fp.write(s)
+		os.replace(tmp, cache_file)
+
+	return s.splitlines()
+
+
+def match_inventory(inventory, keys):
+	"""
+	Finds the inventory lines matching every key, the same as piping the
+	inventory through egrep once per key.
+
+	args:
+		inventory: list of inventory lines
+		keys: list of regular expressions that all must match
+
+	returns:
+		list: matching inventory lines
+	"""
+	patterns = [re.compile(kw) for kw in keys]
+
+	return [line for line in inventory
+								if all([p.search(line) for p in patterns])]
+
+
+def inventory_accumulation(line):
+	"""
+	Returns the hours an inventory line is accumulated over, e.g. 1 for
+	"1-2 hour acc fcst", or None if it isn't an hourly accumulation.
+	"""
+	m = re.search(r":(\d+)-(\d+) hour acc", line)
+	if m == None:
+		return None
+
+	return int(m.group(2)) - int(m.group(1))
+
+
+def select_accumulation(matches, lengths, hours):
+	"""
+	Narrows several matches of a variable down to the ones accumulated over a
+	number of hours. Single matches and variables where none are accumulated
+	over those hours are left alone.
+
+	args:
+		matches: list of inventory lines or message numbers
+		lengths: list of the hours each match is accumulated over or None
+		hours: hours of accumulation to keep
+
+	returns:
+		list: selected matches
+	"""
+	selected = [m for m, n in zip(matches, lengths) if n == hours]
+
+	if len(matches) < 2 or len(selected) == 0:
+		return matches
+
+	return selected
+
+
+def topo_bbox(topo, buffer=0.05):
+	"""
+	Finds the lon/lat bounding box of a SMRF topo.nc using its x, y and
+	projection information.
+
+	args:
+		topo: Path to a topo netcdf with x, y and a projection variable
+		buffer: Degrees to pad the box by so edge cells are kept
+
+	returns:
+		bbox: List of [min lon, min lat, max lon, max lat]
+	"""
+	from netCDF4 import Dataset
+	from pyproj import CRS, Transformer
+	import numpy as np
+
+	with Dataset(topo) as ds:
+		x = ds.variables['x'][:]
+		y = ds.variables['y'][:]
+		meta = ds.variables['projection'].__dict__
+
+	# Projections added by add_proj_2_nc carry the WKT as spatial_ref
+	if 'spatial_ref' in meta or 'crs_wkt' in meta:
+		crs = CRS.from_cf(meta)
+	else:
+		crs = CRS.from_epsg(32600 + int(meta['utm_zone_number']))
+
+	# Transform the whole boundary of the domain, not just the corners
+	bx = np.concatenate([x, x, np.full(len(y), x[0]), np.full(len(y), x[-1])])
+	by = np.concatenate([np.full(len(x), y[0]), np.full(len(x), y[-1]), y, y])
+
+	t = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+	lon, lat = t.transform(bx, by)
+
+	return [np.min(lon) - buffer, np.min(lat) - buffer,
+			np.max(lon) + buffer, np.max(lat) + buffer]
+
+
+def crop_indices(lats, lons, bbox):
+	"""
+	Finds the row and column slices of a 2D lat/lon grid covering a bounding
+	box.
+
+	args:
+		lats: 2D array of latitudes
+		lons: 2D array of longitudes, either -180 to 180 or 0 to 360
+		bbox: List of [min lon, min lat, max lon, max lat]
+
+	returns:
+		tuple: row slice and column slice
+	"""
+	import numpy as np
+
+	lons = np.where(lons > 180, lons - 360, lons)
+	inside = ((lons >= bbox[0]) & (lats >= bbox[1]) &
+			  (lons <= bbox[2]) & (lats <= bbox[3]))
+
+	rows = np.where(inside.any(axis=1))[0]
+	cols = np.where(inside.any(axis=0))[0]
+
+	if len(rows) == 0 or len(cols) == 0:
+		raise ValueError("Bounding box {} does not overlap the grid"
+						 "".format(bbox))
+
+	return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+def write_subset(output, fields, lats, lons, valid_date, x=None, y=None,
+													 complevel=4, tile=256):
+	"""
+	Writes decoded fields to a compressed and chunked netcdf laid out like the
+	output of wgrib2 -netcdf.
+
+	args:
+		output: Path to output the resulting netcdf
+		fields: Dictionary of netcdf variable name to 2D array
+		lats: 2D array of latitudes
+		lons: 2D array of longitudes
+		valid_date: datetime the fields are valid at
+		x: 1D array of projected x coordinates, optional
+		y: 1D array of projected y coordinates, optional
+		complevel: zlib compression level
+		tile: Maximum chunk size in y and x
+	"""
+	from netCDF4 import Dataset, date2num
+
+	ny, nx = lats.shape
+	chunks = (1, min(ny, tile), min(nx, tile))
+
+	with Dataset(output, 'w', format='NETCDF4') as ds:
+		ds.createDimension('time', None)
+		ds.createDimension('y', ny)
+		ds.createDimension('x', nx)
+
+		t = ds.createVariable('time', 'f8', ('time',))
+		t.units = "seconds since 1970-01-01 00:00:00.0 0:00"
+		t.long_name = "verification time generated by wgrib2 function verftime()"
+		t[0] = date2num(valid_date, t.units)
+
+		for name, data, units in [('latitude', lats, 'degrees_north'),
+								  ('longitude', lons, 'degrees_east')]:
+			v = ds.createVariable(name, 'f8', ('y', 'x'), zlib=True,
+														  complevel=complevel)
+			v.units = units
+			v[:] = data
+
+		for name, data in [('x', x), ('y', y)]:
+			if data is not None:
+				v = ds.createVariable(name, 'f8', (name,))
+				v.units = 'm'
+				v[:] = data
+
+		for name, data in fields.items():
+			v = ds.createVariable(name, 'f4', ('time', 'y', 'x'),
+												zlib=True,
+												complevel=complevel,
+												shuffle=True,
+												chunksizes=chunks,
+												fill_value=9.999e20)
+			v[0] = data
+
+
+def python_grib2nc(f_hrrr, output, bbox=None, log=None):
+	"""
+	Converts a HRRR grib file to netcdf without wgrib2. Only the messages
+	matching CRITERIA are decoded and they are cropped to the bounding box
+	before being written compressed. Each variable has to match exactly one
+	message once accumulations are narrowed down like the wgrib2 engine does,
+	files with several levels or forecast times of a variable need the wgrib2
+	engine.
+
+	args:
+		f_hrrr: Path to a HRRR grib file
+		output: Path to output the resulting netcdf
+		bbox: List of [min lon, min lat, max lon, max lat] to crop to, None
+			  keeps the full grid
+		log: logger
+	"""
+	import pygrib
+	from pyproj import Proj
+
+	# Scan the message headers once for the messages of each variable
+	matches = {k:[] for k in CRITERIA.keys()}
+	lengths = {k:[] for k in CRITERIA.keys()}
+	grbs = pygrib.open(f_hrrr)
+	for msg in grbs:
+		for k, v in CRITERIA.items():
+			keys = v['pygrib keys']
+			if all([msg.has_key(kw) and msg[kw] == val
+											for kw, val in keys.items()]):
+				matches[k].append(msg.messagenumber)
+				lengths[k].append(msg['lengthOfTimeRange']
+								  if msg.has_key('lengthOfTimeRange') else None)
+
+	for k, v in CRITERIA.items():
+		if 'accumulation' in v:
+			matches[k] = select_accumulation(matches[k], lengths[k],
+											 v['accumulation'])
+
+	missing = [k for k, numbers in matches.items() if len(numbers) == 0]
+	if missing:
+		grbs.close()
+		raise ValueError("No variable entries found for keys associated with"
+						 " {}".format(", ".join(missing)))
+
+	# The wgrib2 engine converts every match, only one can be written here
+	ambiguous = ["{} (messages {})".format(k, ", ".join(map(str, numbers)))
+						for k, numbers in matches.items() if len(numbers) > 1]
+	if ambiguous:
+		grbs.close()
+		raise ValueError("Found multiple variable entries for keys associated"
+						 " with {}, use the wgrib2 engine to convert them all"
+						 "".format("; ".join(ambiguous)))
+
+	selected = {k:numbers[0] for k, numbers in matches.items()}
+
+	fields = {}
+	rows = cols = slice(None)
+	for i, (k, number) in enumerate(selected.items()):
+		grbs.seek(number - 1)
+		msg = grbs.read(1)[0]
+
+		# Grid information comes from the first message
+		if i == 0:
+			lats, lons = msg.latlons()
+			if bbox != None:
+				rows, cols = crop_indices(lats, lons, bbox)
+			lats = lats[rows, cols]
+			lons = lons[rows, cols]
+			valid_date = msg.validDate
+
+			proj = Proj(msg.projparams)
+			x, _ = proj(lons[0, :], lats[0, :])
+			_, y = proj(lons[:, 0], lats[:, 0])
+
+		log.info("Decoding {} from message {}".format(k, number))
+		fields[CRITERIA[k]['netcdf name']] = msg.values[rows, cols]
+
+	grbs.close()
+
+	log.info("Writing {} variables on a {} x {} grid...".format(len(fields),
+															   *lats.shape))
+	write_subset(output, fields, lats, lons, valid_date, x=x, y=y)
+
+
+def grib2nc(f_hrrr, output=None, external_logger=None, cache_dir=CACHE_DIR,
+													engine='wgrib2', bbox=None, topo=None):
 	"""
 	Converts grib files to netcdf using HRRR forecast data and the
 	variables required by the SMRF.
@@ -18,6 +384,13 @@ def grib2nc(f_hrrr, output=None, external_logger=None):
 		f_hrrr: Path to a HRRR grib file
 		output: Path to output the resulting netcdf
 		external_logger: External logger is desired
+		cache_dir: Directory for cached inventories, None disables the cache
+		engine: Either wgrib2 for converting the full grid with wgrib2 or
+				python for decoding with pygrib and cropping before writing
+		bbox: List of [min lon, min lat, max lon, max lat] to crop to, only
+			  used by the python engine
+		topo: Path to a topo.nc to crop to instead of a bbox, only used by
+			  the python engine
 
 	"""
 	start = time.time()
@@ -25,97 +398,315 @@ def grib2nc(f_hrrr, output=None, external_logger=None):
 		fmt = "%(levelname)s: %(msg)s"
 		log = logging.getLogger(__name__)
 		coloredlogs.install(logger=log, fmt=fmt)
+	else:
+		log = external_logger
 
 
 	msg = "GRIB2NC Converter Utility"
 	log.info(msg)
 	log.info("=" * len(msg))
 
-	# criteria dictionary for extracting variables, CASE MATTERS
-	criteria = {'air_temp': {
-	            	'wgrib2 keys':[":TMP Temperature","2 m"]},
+	# No output file name used, use the original plus a new extension
+	if output == None:
+		output = ".".join(os.path.basename(f_hrrr).split(".")[0:-1]) + ".nc"
 
-				'dew_point': {
-				'wgrib2 keys':[":DPT","2 m"]},
+	# Convert to a partial file that only replaces the output once complete
+	part = output + ".part"
+	src_stat = os.stat(f_hrrr)
 
-				'relative_humidity': {
-				'wgrib2 keys':[":RH Relative Humidity","2 m"]
-	            },
-	        'wind_u': {
-				'wgrib2 keys':[":UGRD U-Component","10 m"]
+	if engine == 'python':
+		if topo != None:
+			bbox = topo_bbox(topo)
 
-	            },
-	        'wind_v': {
-				'wgrib2 keys':[":VGRD V-Component","10 m"]
+		log.info("Outputting to: {}".format(output))
+		try:
+			python_grib2nc(f_hrrr, part, bbox=bbox, log=log)
+		except Exception:
+			remove_part(part)
+			raise
 
-	            },
-	        'precip_int': {
-				'wgrib2 keys':[":APCP Total Precipitation"]
+		replace_output(part, output, src_stat)
 
-	            },
-	        'short_wave': {
-				'wgrib2 keys':['Downward Short-Wave Radiation Flux', ':surface']
-	            },
-	        }
+		log.info("Complete! Elapsed {:0.0f}s".format(time.time()-start))
+		return
 
-	# No output file name used, use the original plus a new extension
-	if output == None:
-		output = ".".join(os.path.basename(f_hrrr).split(".")[0:-1]) + ".nc"
+	# Read the inventory once and match every variable against it
+	inventory = read_inventory(f_hrrr, cache_dir=cache_dir)
 
 	grib_vars = ""
 	var_count = 0
 	# Cycle through all the variables and export the grib var names
-	for k,v in criteria.items():
+	for k,v in CRITERIA.items():
 		log.info("Attempting to extract grib name for {} ".format(k))
 
-		cmd = "wgrib2 -v {} ".format(f_hrrr)
-
-		# Add all the search filters
-		for kw in v["wgrib2 keys"]:
-			cmd += '| egrep "({})" '.format(kw)
-		# Run the command
+		lines = match_inventory(inventory, v["wgrib2 keys"])
 
-		#cmd += " -netcdf {}".format(output)
-		s = check_output(cmd, shell=True).decode('utf-8')
+		if 'accumulation' in v:
+			lines = select_accumulation(lines,
+										[inventory_accumulation(l) for l in lines],
+										v['accumulation'])
 
-		# Check if we only identify one variable based on line returns
-		return_count = len([True for c in s if c == '\n'])
+		if len(lines) == 0:
+			raise ValueError("No variable entries found for keywords "
+							 "associated with {}".format(k))
 
-		if return_count != 1:
+		elif len(lines) != 1:
 			log.warning("Found multiple variable entries for keywords "
 						"associated with {}".format(k))
-			var_count += return_count
-		else:
-			var_count += 1
+
+		var_count += len(lines)
+
 		# Add the grib var name to our running string/list
-		grib_vars += s
+		grib_vars += "\n".join(lines) + "\n"
 
 	log.info("Extracting {} variables and converting to netcdf...".format(var_count))
 	log.info("Outputting to: {}".format(output))
 
 	# Using the var names we just collected run wgrib2 for netcdf conversion
-	cmd = 'echo "{}" | wgrib2 -i {} -netcdf {}'.format(grib_vars, f_hrrr, output)
-	s = check_output(cmd, shell=True)
+	try:
+		s = check_output(["wgrib2", "-i", f_hrrr, "-netcdf", part],
+						 input=grib_vars.encode('utf-8'))
+	except Exception:
+		remove_part(part)
+		raise
+
+	replace_output(part, output, src_stat)
 
 	log.info("Complete! Elapsed {:0.0f}s".format(time.time()-start))
 
 
+def find_grib_files(paths, pattern="hrrr.*.grib2"):
+	"""
+	Expands a list of files, directories and glob patterns into a sorted list
+	of grib files.
+
+	args:
+		paths: List of paths to files, directories or glob patterns
+		pattern: Glob pattern used to find files in directories
+
+	returns:
+		files: Sorted list of unique grib file paths
+	"""
+	files = []
+	for p in paths:
+		if os.path.isdir(p):
+			files += glob(os.path.join(p, pattern))
+		elif os.path.isfile(p):
+			files.append(p)
+		else:
+			files += glob(p)
+
+	return sorted(set(files))
+
+
+def remove_part(part):
+	"""
+	Removes what a failed conversion left of its partial output.
+	"""
+	if os.path.isfile(part):
+		os.remove(part)
+
+
+def stamp_file(output):
+	"""
+	Returns the path of the sidecar recording the grib an output was
+	converted from.
+	"""
+	return output + ".source"
+
+
+def replace_output(part, output, src_stat):
+	"""
+	Moves a converted partial file over the output, then records the size and
+	modification time the grib had when the conversion started in a JSON
+	sidecar. The old record is removed first so an interrupted replace leaves
+	an output that is converted again.
+
+	args:
+		part: Path to the converted partial output
+		output: Path to the netcdf output
+		src_stat: os.stat of the HRRR grib file before converting it
+	"""
+	stamp = stamp_file(output)
+	if os.path.isfile(stamp):
+		os.remove(stamp)
+
+	os.replace(part, output)
+
+	tmp = stamp + ".part"
+	with open(tmp, 'w') as fp:
+		json.dump({'size':src_stat.st_size, 'mtime':src_stat.st_mtime}, fp)
+	os.replace(tmp, stamp)
+
+
+def is_up_to_date(f_hrrr, output):
+	"""
+	Checks if a netcdf output is up to date with its grib file. The output is
+	considered current when its sidecar records the size and modification
+	time of the grib as it is now. Outputs are only renamed into place once
+	converted, so a failed conversion never looks current.
+
+	args:
+		f_hrrr: Path to a HRRR grib file
+		output: Path to the netcdf output
+
+	returns:
+		bool: True if the conversion can be skipped
+	"""
+	if not os.path.isfile(output) or os.path.getsize(output) == 0:
+		return False
+
+	src_stat = os.stat(f_hrrr)
+
+	try:
+		with open(stamp_file(output)) as fp:
+			stamp = json.load(fp)
+
+	# Missing or unreadable, converted before the source was recorded
+	except (OSError, ValueError):
+		return False
+
+	return (stamp.get('size') == src_stat.st_size and
+			stamp.get('mtime') == src_stat.st_mtime)
+
+
+def _convert(f_hrrr, output, kwargs):
+	"""
+	Worker for the batch conversion, catches all errors so a single bad file
+	does not abort the batch.
+
+	returns:
+		tuple: grib path, error message or None, bytes read
+	"""
+	try:
+		grib2nc(f_hrrr, output, **kwargs)
+		return f_hrrr, None, os.path.getsize(f_hrrr)
+
+	except Exception as e:
+		return f_hrrr, str(e), 0
+
+
+def grib2nc_batch(files, output_dir=None, workers=4, force=False, **kwargs):
+	"""
+	Converts many HRRR grib files to netcdf concurrently using a bounded
+	process pool. Outputs that are already up to date are skipped and failures
+	are reported at the end instead of stopping the batch.
+
+	args:
+		files: List of HRRR grib files
+		output_dir: Directory to write netcdfs to, defaults to the current
+					directory like grib2nc
+		workers: Maximum number of conversions running at once
+		force: Convert even if the output is up to date
+		kwargs: Keyword arguments passed on to grib2nc, e.g. engine and bbox
+
+	returns:
+		failed: Dictionary of grib file to error message for failed files
+	"""
+	start = time.time()
+	fmt = "%(levelname)s: %(msg)s"
+	log = logging.getLogger(__name__)
+	coloredlogs.install(logger=log, fmt=fmt)
+
+	if output_dir == None:
+		output_dir = os.getcwd()
+
+	# Decide what needs converting
+	jobs = {}
+	skipped = 0
+	for f in files:
+		output = os.path.join(output_dir,
+				   ".".join(os.path.basename(f).split(".")[0:-1]) + ".nc")
+
+		if not force and is_up_to_date(f, output):
+			log.debug("Skipping {}, output is up to date".format(f))
+			skipped += 1
+		else:
+			jobs[f] = output
+
+	log.info("Converting {} files with {} workers, skipping {} up to date"
+			 "".format(len(jobs), workers, skipped))
+
+	failed = {}
+	converted = 0
+	nbytes = 0
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(_convert, f, out, kwargs) for f, out in jobs.items()]
+
+		for future in as_completed(futures):
+			f, error, size = future.result()
+
+			if error != None:
+				log.error("Failed to convert {}: {}".format(f, error))
+				failed[f] = error
+			else:
+				converted += 1
+				nbytes += size
+
+	elapsed = time.time() - start
+
+	msg = "GRIB2NC Batch Summary"
+	log.info(msg)
+	log.info("=" * len(msg))
+	log.info("Converted: {}".format(converted))
+	log.info("Skipped: {}".format(skipped))
+	log.info("Failed: {}".format(len(failed)))
+	log.info("Elapsed: {:0.1f}s".format(elapsed))
+
+	if converted > 0:
+		log.info("Throughput: {:0.2f} files/s, {:0.1f} MB/s".format(
+				  converted / elapsed, nbytes / 1024.0**2 / elapsed))
+
+	return failed
+
+
 def grib2nc_cli():
 	p = argparse.ArgumentParser(description="Command line tool for converting"
 								" HRRR grib files to netcdf using only the "
 								" variables we want.")
 
-	p.add_argument(dest="hrrr", help="Path to the HRRR file containing the"
-	 								 " variables for SMRF")
+	p.add_argument(dest="hrrr", nargs="+", help="Path to the HRRR file"
+									 " containing the variables for SMRF."
+									 " Multiple files, directories or glob"
+									 " patterns are converted in batch")
 	p.add_argument("-o", "--output", dest="output", required=False,
 												default=None,
 	            								help="Path to output the netcdf"
 												" file if you don't want it"
 												" renamed the same as the hrrr"
 												" file with a different"
-												" extension.")
+												" extension. In batch mode this"
+												" is the output directory.")
+	p.add_argument("-w", "--workers", dest="workers", type=int, default=4,
+				   help="Number of files to convert at once in batch mode")
+	p.add_argument("-p", "--pattern", dest="pattern", default="hrrr.*.grib2",
+				   help="Glob pattern used to find grib files in directories")
+	p.add_argument("--force", dest="force", action="store_true",
+				   help="Convert files even if the output is up to date")
+	p.add_argument("-e", "--engine", dest="engine", default="wgrib2",
+				   choices=["wgrib2", "python"],
+				   help="Convert with wgrib2 or decode with pygrib, cropping"
+						" and compressing before writing")
+	p.add_argument("--bbox", dest="bbox", nargs=4, type=float, default=None,
+				   metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+				   help="Crop to a bounding box, python engine only")
+	p.add_argument("--topo", dest="topo", default=None,
+				   help="Crop to the extent of a topo.nc, python engine only")
 	args = p.parse_args()
-	grib2nc(args.hrrr, args.output)
+
+	options = {"engine":args.engine, "bbox":args.bbox, "topo":args.topo}
+
+	if len(args.hrrr) == 1 and os.path.isfile(args.hrrr[0]):
+		grib2nc(args.hrrr[0], args.output, **options)
+
+	else:
+		files = find_grib_files(args.hrrr, pattern=args.pattern)
+		failed = grib2nc_batch(files, output_dir=args.output,
+									  workers=args.workers,
+									  force=args.force,
+									  **options)
+		if failed:
+			sys.exit(1)
 
 if __name__ == "__main__":
 	grib2nc_cli()
@@ -1,30 +1,182 @@
 from netCDF4 import Dataset
+import argparse
+import numpy as np
+import os
 import sys
-import matplotlib.pyplot as plt
 
+# Slab reads are shared with the netcdf copying tools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                      'add_netcdf_projection'))
+from nc_chunks import iter_slabs
 
 
-ds1 = Dataset(sys.argv[1])
-ds0 = Dataset(sys.argv[2])
+class DiffStats(object):
+    """
+    One pass accumulator of the statistics of a difference. Chunks are merged
+    using Welford/Chan updates so no more than a chunk is ever in memory.
+    """
 
-hdr = "{0:<10}{1:<10}{2:<10}{3:<10}{4:<10}".format("Name","Mean","STD", "Max","Min")
-print(hdr)
-print("=" * len(hdr))
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sum_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.max_abs = 0.0
 
-msg = "{0:<10}{1:<10.5f}{2:<10.5f}{3:<10.5f}{4:<10.5f}"
+    def update(self, diff):
+        """
+        Adds a chunk of differences to the running statistics.
 
-for v in ["x","y",'time','latitude','longitude']:
-    diff = ds1.variables[v][:] - ds0.variables[v][:]
+        Args:
+            diff: numpy array (masked values are ignored) of differences
+        """
+        if np.ma.isMaskedArray(diff):
+            diff = diff.compressed()
 
-    mean = diff.mean()
-    std = diff.std()
-    vmin = diff.min()
-    vmax = diff.max()
-    if v in ["latitude",'longitude']:
-        plt.imshow(diff)
+        diff = np.asarray(diff, dtype=np.float64).ravel()
+        n = diff.size
 
-        plt.title("{} Difference".format(v))
-        plt.colorbar()
-        plt.show()
+        if n == 0:
+            return
 
-    print(msg.format(v,mean,std,vmax,vmin))
+        mean = diff.mean()
+        m2 = ((diff - mean)**2).sum()
+
+        # Merge this chunk into the running mean and sum of squared deviations
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+
+        self.sum_sq += (diff**2).sum()
+        self.min = min(self.min, diff.min())
+        self.max = max(self.max, diff.max())
+        self.max_abs = max(self.max_abs, np.abs(diff).max())
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.n) if self.n > 0 else np.nan
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.sum_sq / self.n) if self.n > 0 else np.nan
+
+
+def compare_variable(var1, var0, max_size=2**22):
+    """
+    Streams the difference var1 - var0 through a DiffStats accumulator.
+
+    Args:
+        var1: netCDF4 variable
+        var0: netCDF4 variable of the same shape
+        max_size: Maximum number of values to read at once
+
+    Returns:
+        DiffStats: statistics of the difference
+    """
+    if var1.shape != var0.shape:
+        raise ValueError("Cannot compare {} with shape {} to {}"
+                         "".format(var1.name, var1.shape, var0.shape))
+
+    stats = DiffStats()
+    for s in iter_slabs(var1, max_size=max_size):
+        # Subtract in float64 so integer variables can't wrap or overflow
+        stats.update(np.ma.asarray(var1[s], dtype=np.float64) -
+                     np.ma.asarray(var0[s], dtype=np.float64))
+
+    return stats
+
+
+def compare_netcdfs(f1, f0, variables=None, max_size=2**22):
+    """
+    Compares variables between two netcdfs in bounded memory.
+
+    Args:
+        f1: Path to a netcdf
+        f0: Path to a netcdf to subtract from f1
+        variables: List of variable names to compare, defaults to the
+                   numeric variables with dimensions the files have in
+                   common, skipping scalars like projection
+        max_size: Maximum number of values to read at once
+
+    Returns:
+        dict: variable name to DiffStats
+    """
+    results = {}
+
+    with Dataset(f1) as ds1, Dataset(f0) as ds0:
+        if variables == None:
+            variables = [v for v, var in ds1.variables.items()
+                         if v in ds0.variables and var.ndim > 0 and
+                         np.dtype(var.dtype).kind in 'iuf']
+
+        for v in variables:
+            results[v] = compare_variable(ds1.variables[v], ds0.variables[v],
+                                          max_size=max_size)
+
+    return results
+
+
+def plot_diff(f1, f0, name):
+    """
+    Shows an image of the difference of a 2D variable.
+    """
+    import matplotlib.pyplot as plt
+
+    with Dataset(f1) as ds1, Dataset(f0) as ds0:
+        diff = np.ma.asarray(ds1.variables[name][:], dtype=np.float64) - \
+               np.ma.asarray(ds0.variables[name][:], dtype=np.float64)
+
+    plt.imshow(diff)
+    plt.title("{} Difference".format(name))
+    plt.colorbar()
+    plt.show()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports the statistics of the"
+                                            " difference between variables in"
+                                            " two netcdfs")
+
+    p.add_argument(dest='netcdf1', help="Path to a netcdf")
+    p.add_argument(dest='netcdf0', help="Path to a netcdf to subtract")
+
+    p.add_argument('-v','--variables', dest='variables',
+                        nargs='+',
+                        default=None,
+                        help="Variables to compare, defaults to all the"
+                        " variables in common")
+
+    p.add_argument('--no-plot', dest='plot',
+                        action='store_false',
+                        help="Skip plotting the differences of 2D variables")
+
+    args = p.parse_args()
+
+    results = compare_netcdfs(args.netcdf1, args.netcdf0,
+                              variables=args.variables)
+
+    hdr = ("{0:<20}{1:<12}{2:<12}{3:<12}{4:<12}{5:<12}{6:<12}"
+           "".format("Name", "Mean", "STD", "Max", "Min", "RMSE", "Max Abs"))
+    print(hdr)
+    print("=" * len(hdr))
+
+    msg = "{0:<20}{1:<12.5f}{2:<12.5f}{3:<12.5f}{4:<12.5f}{5:<12.5f}{6:<12.5f}"
+
+    for v, stats in results.items():
+        print(msg.format(v, stats.mean, stats.std, stats.max, stats.min,
+                            stats.rmse, stats.max_abs))
+
+    if args.plot:
+        with Dataset(args.netcdf1) as ds:
+            images = [v for v in results.keys()
+                                        if len(ds.variables[v].dimensions) == 2]
+        for v in images:
+            plot_diff(args.netcdf1, args.netcdf0, v)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from netCDF4 import Dataset
+from grib2nc import (CRITERIA, inventory_accumulation, match_inventory,
+					 python_grib2nc, select_accumulation)
+import logging
+import numpy as np
+import struct
+
+
+def section(number, body):
+	return struct.pack('>IB', 5 + len(body), number) + body
+
+
+def message(category, parameter, level_type, level, value,
+											accumulation=None, ni=3, nj=2):
+	"""
+	Packs a constant GRIB2 field on a small lat/lon grid, accumulation is the
+	start and length in hours of an accumulated field.
+	"""
+	start, length = accumulation if accumulation else (2, None)
+
+	ident = section(1, struct.pack('>HHBBBHBBBBBBB', 7, 0, 2, 1, 1, 2020, 4,
+												 1, 0, 0, 0, 0, 1))
+	grid = section(3, struct.pack('>BIBBH', 0, ni * nj, 0, 0, 0) +
+					  struct.pack('>BBIBIBIIIIIiiBiiIIB', 6, 0, 0, 0, 0, 0, 0,
+								  ni, nj, 0, 0, 40000000, 240000000, 48,
+								  41000000, 242000000, 1000000, 1000000, 64))
+
+	product = struct.pack('>BBBBBHBBIBBIBBI', category, parameter, 2, 0, 0, 0,
+						  0, 1, start, level_type, 0, level, 255, 0, 0)
+	if accumulation:
+		product += struct.pack('>HBBBBBBIBBBIBI', 2020, 4, 1, start + length,
+							   0, 0, 1, 0, 1, 2, 1, length, 255, 0)
+	product = section(4, struct.pack('>HH', 0, 8 if accumulation else 0) +
+						 product)
+
+	packing = section(5, struct.pack('>IHfhhBB', ni * nj, 0, value, 0, 0, 0,
+									 0))
+	body = ident + grid + product + packing + section(6, b'\xff') + \
+		   section(7, b'') + b'7777'
+
+	return b'GRIB' + struct.pack('>HBBQ', 0, 0, 2, 16 + len(body)) + body
+
+
+def test_python_engine_uses_the_hourly_precip(tmp_path):
+	"""
+	A forecast hour 2 file has the 0-2 hour and the 1-2 hour APCP
+	"""
+	f_hrrr = str(tmp_path / 'hrrr.t00z.wrfsfcf02.grib2')
+	output = str(tmp_path / 'hrrr.nc')
+
+	with open(f_hrrr, 'wb') as fp:
+		fp.write(message(0, 0, 103, 2, 280.0))
+		fp.write(message(0, 6, 103, 2, 270.0))
+		fp.write(message(1, 1, 103, 2, 50.0))
+		fp.write(message(2, 2, 103, 10, 3.0))
+		fp.write(message(2, 3, 103, 10, -1.0))
+		fp.write(message(1, 8, 1, 0, 2.0, accumulation=(0, 2)))
+		fp.write(message(1, 8, 1, 0, 1.0, accumulation=(1, 1)))
+		fp.write(message(4, 7, 1, 0, 400.0))
+
+	python_grib2nc(f_hrrr, output, log=logging.getLogger(__name__))
+
+	with Dataset(output) as ds:
+		assert np.all(ds.variables['APCP_surface'][:] == 1.0)
+		assert np.all(ds.variables['TMP_2maboveground'][:] == 280.0)
+
+
+def test_wgrib2_engine_uses_the_hourly_precip():
+	inventory = [
+		"84:100:d=2020040100:APCP Total Precipitation [kg/m^2]:surface:0-2"
+		" hour acc fcst:",
+		"85:200:d=2020040100:APCP Total Precipitation [kg/m^2]:surface:1-2"
+		" hour acc fcst:"]
+
+	v = CRITERIA['precip_int']
+	lines = match_inventory(inventory, v['wgrib2 keys'])
+	lines = select_accumulation(lines, [inventory_accumulation(l)
+										for l in lines], v['accumulation'])
+
+	assert lines == inventory[1:]
+
+
+def test_single_accumulation_is_kept():
+	assert select_accumulation([3], [2], 1) == [3]
+	assert select_accumulation([3, 4], [None, None], 1) == [3, 4]
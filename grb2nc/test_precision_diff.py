@@ -0,0 +1,35 @@
+from netCDF4 import Dataset
+from precision_diff import compare_netcdfs
+import numpy as np
+
+
+def write_netcdf(fname, values, dtype):
+    """
+    Writes a small netcdf with one (time, y, x) variable of the values.
+    """
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('y', values.shape[1])
+        ds.createDimension('x', values.shape[2])
+        ds.createVariable('projection', 'i4')
+        ds.createVariable('counts', dtype, ('time', 'y', 'x'))[:] = values
+
+
+def test_unsigned_difference_does_not_wrap(tmp_path):
+    f1 = str(tmp_path / 'f1.nc')
+    f0 = str(tmp_path / 'f0.nc')
+
+    values = np.arange(24, dtype=np.uint16).reshape((2, 3, 4)) + 10
+    write_netcdf(f1, values - 1, 'u2')
+    write_netcdf(f0, values, 'u2')
+
+    results = compare_netcdfs(f1, f0, max_size=5)
+
+    assert list(results.keys()) == ['counts']
+    stats = results['counts']
+    assert stats.n == values.size
+    assert stats.min == -1.0
+    assert stats.max == -1.0
+    assert stats.mean == -1.0
+    assert stats.rmse == 1.0
+    assert stats.max_abs == 1.0
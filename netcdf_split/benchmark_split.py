@@ -0,0 +1,52 @@
+from netcdf_split import split_netcdf
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import time
+import argparse
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports files/sec written by"
+                                            " netcdf_split for several worker"
+                                            " counts")
+
+    p.add_argument('-f','--netcdf', dest='netcdf',
+                        required=True,
+                        help="Path to a netcdf to split")
+
+    p.add_argument('-w','--workers', dest='workers',
+                        nargs='+',
+                        type=int,
+                        default=[1, 2, 4, os.cpu_count()],
+                        help="Worker counts to benchmark")
+
+    p.add_argument('-c','--chunk', dest='chunk',
+                        type=int,
+                        default=None,
+                        help="Number of timesteps to read at once")
+
+    args = p.parse_args()
+
+    hdr = "{0:<10}{1:<10}{2:<12}{3:<10}".format("Workers","Files",
+                                                "Seconds", "Files/sec")
+    print(hdr)
+    print("=" * len(hdr))
+    msg = "{0:<10}{1:<10}{2:<12.2f}{3:<10.1f}"
+
+    for workers in sorted(set(args.workers)):
+        tmp = mkdtemp()
+        prefix = os.path.join(tmp, os.path.basename(args.netcdf).split('.')[0])
+
+        start = time.time()
+        fnames = split_netcdf(args.netcdf, prefix, chunk_size=args.chunk,
+                                                   workers=workers,
+                                                   verbose=False)
+        elapsed = time.time() - start
+
+        rmtree(tmp)
+        print(msg.format(workers, len(fnames), elapsed, len(fnames) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,17 @@
 from netCDF4 import Dataset, num2date, date2num
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import os
 import datetime as dt
 import argparse
 import numpy as np
 import pandas as pd
+import sys
+
+# Output profiles are shared with the other netcdf copying tools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                      'add_netcdf_projection'))
+from nc_chunks import PROFILES, profile_options
 
 
 def calculate_date_from_wyhr(wyhr, year):
@@ -18,7 +26,8 @@ def calculate_date_from_wyhr(wyhr, year):
     return start + delta
 
 
-def subset_netcdf(infile, outfile, tstep=None, dim_exclude=None, exclude=None):
+def subset_netcdf(infile, outfile, tstep=None, dim_exclude=None, exclude=None,
+                                                                  profile=None):
     """
     Copies a netcdf from one to another exactly.
 
@@ -28,6 +37,7 @@ def subset_netcdf(infile, outfile, tstep=None, dim_exclude=None, exclude=None):
         tstep: Time step to subset
         exclude: variables to exclude
         dim_exclude: Dimensions to exclude
+        profile: Name of an output profile in PROFILES
 
     Returns the output netcdf dataset object for modifying
     """
@@ -57,7 +67,10 @@ def subset_netcdf(infile, outfile, tstep=None, dim_exclude=None, exclude=None):
 
         if name.lower() not in exclude and name.lower() not in dim_exclude:
             new_dims = [d for d in variable.dimensions if d not in dim_exclude]
-            dst.createVariable(name, variable.datatype, new_dims)
+            options = profile_options(profile, variable.datatype, new_dims,
+                                      {d: len(v) for d, v in
+                                                      src.dimensions.items()})
+            dst.createVariable(name, variable.datatype, new_dims, **options)
             # Copy variable attributes all at once via dictionary
             dst.variables[name].setncatts(src.variables[name].__dict__)
 
@@ -75,6 +88,289 @@ def subset_netcdf(infile, outfile, tstep=None, dim_exclude=None, exclude=None):
     return dst
 
 
+# Most bytes of time series images read at once when splitting
+MAX_SLAB_BYTES = 2**28
+
+
+def time_chunk_size(src, names, default=24, max_bytes=MAX_SLAB_BYTES):
+    """
+    Determines how many timesteps to read at once using the on disk chunking
+    of the 3D variables so each read lands on whole chunks. Slabs are capped
+    at max_bytes across all the variables, when a chunk is larger than that
+    the slab is the largest divisor of the chunk length that fits so reads
+    still split chunks evenly.
+
+    Args:
+        src: netCDF4 dataset object
+        names: list of variable names that are time series images
+        default: chunk length to use when the variables are contiguous
+        max_bytes: Maximum bytes of a slab of all the variables
+
+    Returns:
+        int: number of timesteps to read per pass
+    """
+    sizes = []
+    step_bytes = 0
+    for name in names:
+        variable = src.variables[name]
+        step_bytes += int(np.prod(variable.shape[1:])) * \
+                                                     variable.dtype.itemsize
+
+        chunking = variable.chunking()
+        if chunking != 'contiguous' and chunking is not None:
+            sizes.append(chunking[0])
+
+    budget = max(max_bytes // max(step_bytes, 1), 1)
+
+    if not sizes:
+        return min(default, budget)
+
+    chunk = max(sizes)
+    if chunk <= budget:
+        return chunk
+
+    return max([n for n in range(1, budget + 1) if chunk % n == 0])
+
+
+def gather_static(src, dim_exclude=None, exclude=None, profile=None):
+    """
+    Reads everything that is the same in every split file once, e.g. global
+    attributes, dimensions, x, y and projection.
+
+    Args:
+        src: netCDF4 dataset object
+        dim_exclude: Dimensions to exclude
+        exclude: variables to exclude
+        profile: Name of an output profile in PROFILES
+
+    Returns:
+        dict: static payload for writing each timestep
+    """
+    if type(exclude) != list:
+        exclude = [exclude]
+
+    if dim_exclude == None:
+        dim_exclude = []
+
+    payload = {'attrs': src.__dict__, 'dimensions': {}, 'variables': {}}
+
+    for name, dimension in src.dimensions.items():
+        if name not in dim_exclude:
+            payload['dimensions'][name] = (len(dimension)
+                                     if not dimension.isunlimited() else None)
+
+    sizes = {d: len(v) for d, v in src.dimensions.items()}
+
+    for name, variable in src.variables.items():
+        if name.lower() not in exclude and name.lower() not in dim_exclude:
+            new_dims = [d for d in variable.dimensions if d not in dim_exclude]
+            info = {'datatype': variable.datatype,
+                    'dimensions': new_dims,
+                    'options': profile_options(profile, variable.datatype,
+                                               new_dims, sizes),
+                    'attrs': variable.__dict__,
+                    'timeseries': len(new_dims) != len(variable.dimensions),
+                    'data': None}
+
+            # Static data is read only once
+            if not info['timeseries'] and 'projection' not in name.lower():
+                info['data'] = variable[:]
+
+            payload['variables'][name] = info
+
+    return payload
+
+
+def write_timestep(outfile, payload, frames):
+    """
+    Writes a single timestep netcdf using the static payload and the images
+    for that timestep.
+
+    Args:
+        outfile: output filename
+        payload: dictionary from gather_static
+        frames: dictionary of variable name to 2D array for this timestep
+    """
+    dst = Dataset(outfile, "w")
+    dst.setncatts(payload['attrs'])
+
+    for name, size in payload['dimensions'].items():
+        dst.createDimension(name, size)
+
+    for name, info in payload['variables'].items():
+        dst.createVariable(name, info['datatype'], info['dimensions'],
+                                                   **info['options'])
+        dst.variables[name].setncatts(info['attrs'])
+
+        if info['timeseries']:
+            dst.variables[name][:] = frames[name]
+
+        elif info['data'] is not None:
+            dst.variables[name][:] = info['data']
+
+    dst.close()
+
+
+# Static payload handed to each worker process once at start up
+_worker_payload = None
+
+
+def _init_worker(payload):
+    """
+    Stores the static payload in the worker process so it is not pickled
+    with every timestep.
+    """
+    global _worker_payload
+    _worker_payload = payload
+
+
+def _write_shared(outfile, shared, index):
+    """
+    Worker function for writing a single timestep from shared memory slabs.
+
+    Args:
+        outfile: output filename
+        shared: dictionary of variable name to (shared memory name, shape,
+                dtype) describing the slab of timesteps
+        index: index of the timestep in the slab
+
+    Returns:
+        str: the filename written
+    """
+    blocks = []
+    frames = {}
+
+    for name, (shm_name, shape, dtype) in shared.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        frames[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[index]
+
+    write_timestep(outfile, _worker_payload, frames)
+
+    # Release the views before closing the blocks
+    frames = None
+    for shm in blocks:
+        shm.close()
+
+    return outfile
+
+
+def share_slab(slab):
+    """
+    Copies a slab of timesteps into a shared memory block so that worker
+    processes can view it without another copy.
+
+    Args:
+        slab: numpy array (masked or not) of shape (time, y, x)
+
+    Returns:
+        tuple: shared memory object and the (name, shape, dtype) to pass on
+    """
+    data = np.ma.getdata(slab)
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    view = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+    view[:] = data
+    del view
+
+    return shm, (shm.name, data.shape, data.dtype.str)
+
+
+def split_netcdf(infile, prefix, exclude=None, chunk_size=None, workers=1,
+                                                   verbose=True, profile=None):
+    """
+    Splits a netcdf into a netcdf for each timestep in a single pass. The
+    source is opened once, static data is read once and the time series images
+    are read in slabs of timesteps so memory is bounded by the slab size and
+    not the number of timesteps.
+
+    Args:
+        infile: filename you want to split
+        prefix: prefix of the output filenames, dates are appended
+        exclude: variables to exclude
+        chunk_size: Number of timesteps to read at once, defaults to the on
+                    disk chunking of the file
+        workers: Number of processes writing files, slabs are handed to them
+                 through shared memory
+        verbose: Print each filename as it is written
+        profile: Name of an output profile in PROFILES
+
+    Returns:
+        list: filenames written
+    """
+    dim_exclude = ['time']
+    src = Dataset(infile, 'r')
+
+    time = src.variables['time']
+    dates = num2date(time[:], units=time.units, calendar=time.calendar)
+
+    payload = gather_static(src, dim_exclude=dim_exclude, exclude=exclude,
+                                 profile=profile)
+    ts_names = [name for name, info in payload['variables'].items()
+                                                         if info['timeseries']]
+
+    if chunk_size == None:
+        chunk_size = time_chunk_size(src, ts_names)
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_init_worker,
+                                   initargs=(payload,))
+
+    fnames = []
+    try:
+        for start in range(0, len(dates), chunk_size):
+            end = min(start + chunk_size, len(dates))
+
+            # Read a slab of every time series variable
+            slabs = {}
+            for name in ts_names:
+                slabs[name] = src.variables[name][start:end]
+
+            names = ['{0}_{1}.nc'.format(prefix,
+                                         dates[i].strftime('%Y%m%dT%H%M'))
+                                                     for i in range(start, end)]
+
+            if pool == None:
+                for i, fname in enumerate(names):
+                    if verbose:
+                        print(fname)
+                    frames = {name: slab[i] for name, slab in slabs.items()}
+                    write_timestep(fname, payload, frames)
+
+            else:
+                blocks = []
+                shared = {}
+                try:
+                    for name, slab in slabs.items():
+                        shm, shared[name] = share_slab(slab)
+                        blocks.append(shm)
+                    slabs = None
+
+                    futures = [pool.submit(_write_shared, fname, shared, i)
+                                               for i, fname in enumerate(names)]
+
+                    # Report in order so the output is the same as in serial
+                    for f in futures:
+                        fname = f.result()
+                        if verbose:
+                            print(fname)
+
+                finally:
+                    for shm in blocks:
+                        shm.close()
+                        shm.unlink()
+
+            fnames += names
+
+    finally:
+        if pool != None:
+            pool.shutdown()
+        src.close()
+
+    return fnames
+
+
 def main():
     p = argparse.ArgumentParser(description="Splits a netcdf by date then writes"
                                              " a netcdf for each timestep")
@@ -89,18 +385,34 @@ def main():
                         help="Path to output your split netcdf files"
                         "")
 
+    p.add_argument('-c','--chunk', dest='chunk',
+                        required=False,
+                        type=int,
+                        default=None,
+                        help="Number of timesteps to read at once, defaults to"
+                        " the on disk chunking of the netcdf")
+
+    p.add_argument('-w','--workers', dest='workers',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help="Number of processes to write the split files"
+                        " with")
+
+    p.add_argument('-p','--profile', dest='profile',
+                        required=False,
+                        default=None,
+                        choices=list(PROFILES.keys()),
+                        help="Output profile setting compression and chunking"
+                        " of the split files")
 
     args = p.parse_args()
 
-    src = Dataset(args.netcdf)
-    dates = num2date(src.variables['time'][:],
-                    units=src.variables['time'].units,
-                    calendar=src.variables['time'].calendar)
-    for i,v in enumerate(dates):
-        fname = '{0}_{1}.nc'.format((args.netcdf).split('.')[0], v.strftime('%Y%m%dT%H%M'))
-        print(fname)
-        dst = subset_netcdf(src, fname, src.variables['time'][i], dim_exclude=['time'])
-        dst.close()
+    split_netcdf(args.netcdf, (args.netcdf).split('.')[0],
+                              chunk_size=args.chunk,
+                              workers=args.workers,
+                              profile=args.profile)
+
 # from geoserver.catalog import Catalog
 # cat = Catalog("http://ubuntu@ec2-35-172-236-77.compute-1.amazonaws.com/8600/geoserver/rest", password='nwrc10')
 # all_stores = cat.get_workspace('topo')
@@ -0,0 +1,69 @@
+from netcdf_split import split_netcdf, PROFILES
+from netCDF4 import Dataset
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import time
+import argparse
+
+
+def read_all(fnames):
+    """
+    Reads every image in every file to time reading the split products back.
+    """
+    for fname in fnames:
+        with Dataset(fname) as ds:
+            for name, variable in ds.variables.items():
+                if len(variable.dimensions) >= 2:
+                    variable[:]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports size, write time and read"
+                                            " time of the split netcdfs for"
+                                            " each output profile")
+
+    p.add_argument('-f','--netcdf', dest='netcdf',
+                        required=True,
+                        help="Path to a sample netcdf e.g. snow.nc")
+
+    p.add_argument('-w','--workers', dest='workers',
+                        type=int,
+                        default=1,
+                        help="Number of processes to write the split files with")
+
+    args = p.parse_args()
+
+    hdr = "{0:<10}{1:<12}{2:<10}{3:<10}{4:<10}".format("Profile","Size (MB)",
+                                                       "Ratio", "Write (s)",
+                                                       "Read (s)")
+    print(hdr)
+    print("=" * len(hdr))
+    msg = "{0:<10}{1:<12.2f}{2:<10.2f}{3:<10.2f}{4:<10.2f}"
+
+    baseline = None
+    for profile in [None] + list(PROFILES.keys()):
+        tmp = mkdtemp()
+        prefix = os.path.join(tmp, os.path.basename(args.netcdf).split('.')[0])
+
+        start = time.time()
+        fnames = split_netcdf(args.netcdf, prefix, workers=args.workers,
+                                                   verbose=False,
+                                                   profile=profile)
+        write_time = time.time() - start
+
+        start = time.time()
+        read_all(fnames)
+        read_time = time.time() - start
+
+        size = sum([os.path.getsize(f) for f in fnames]) / 1024.0**2
+        if baseline == None:
+            baseline = size
+
+        rmtree(tmp)
+        print(msg.format(str(profile).lower(), size, size / baseline,
+                                               write_time, read_time))
+
+
+if __name__ == '__main__':
+    main()
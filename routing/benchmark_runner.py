@@ -0,0 +1,126 @@
+"""
+Measures how many simulated days the overland flow runner gets through per
+wall clock hour, with and without checkpoints. Runs a config given on the
+command line or a synthetic valley of SWI made for the benchmark.
+"""
+from overland import read_config, OverlandRunner
+from netCDF4 import Dataset
+from tempfile import mkdtemp
+from shutil import rmtree
+import numpy as np
+import argparse
+import os
+
+
+def make_basin(fname, ny, nx, days):
+    """
+    Writes a crop.py style netcdf of a valley draining to the middle of its
+    first row with random daily SWI. Returns the outlet node id.
+    """
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('y', ny)
+        ds.createDimension('x', nx)
+
+        ds.createVariable('time', 'f8', ('time',))[:] = np.arange(days) * 24
+        ds.createVariable('x', 'f8', ('x',))[:] = 50.0 * np.arange(nx)
+        ds.createVariable('y', 'f8', ('y',))[:] = 50.0 * np.arange(ny)
+
+        yy, xx = np.mgrid[0:ny, 0:nx]
+        rng = np.random.RandomState(0)
+        dem = 2000 + 3.0 * yy + 0.5 * np.abs(xx - nx // 2) + rng.rand(ny, nx)
+        ds.createVariable('dem', 'f8', ('y', 'x'))[:] = dem
+
+        swi = ds.createVariable('SWI', 'f8', ('time', 'y', 'x'))
+        for day in range(days):
+            swi[day] = rng.rand(ny, nx) * 20
+
+    return nx // 2
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports simulated days per wall"
+                                            " clock hour of the overland flow"
+                                            " runner at several checkpoint"
+                                            " intervals")
+
+    p.add_argument('-c','--config', dest='config',
+                        default=None,
+                        help="Runner config to benchmark, defaults to a"
+                             " synthetic basin")
+
+    p.add_argument('-n','--size', dest='size',
+                        nargs=2,
+                        type=int,
+                        default=[200, 300],
+                        help="Rows and columns of the synthetic basin")
+
+    p.add_argument('-d','--days', dest='days',
+                        type=int,
+                        default=2,
+                        help="Number of days to simulate")
+
+    p.add_argument('-i','--intervals', dest='intervals',
+                        nargs='+',
+                        type=float,
+                        default=[0, 86400, 3600],
+                        help="Checkpoint intervals in seconds of simulated"
+                             " time to benchmark, 0 for none")
+
+    args = p.parse_args()
+
+    tmp = mkdtemp()
+
+    try:
+        if args.config != None:
+            cfg = read_config(args.config)
+        else:
+            swi = os.path.join(tmp, 'swi.nc')
+            outlet_id = make_basin(swi, args.size[0], args.size[1], args.days)
+
+            cfg_file = os.path.join(tmp, 'benchmark.ini')
+            with open(cfg_file, 'w') as fp:
+                fp.write("[files]\nswi = {}\n\n[model]\noutlet_id = {}\n"
+                         "".format(swi, outlet_id))
+            cfg = read_config(cfg_file)
+
+        # Keep everything the benchmark writes out of the config's directories
+        cfg['model']['days'] = args.days
+        cfg['files']['output'] = os.path.join(tmp, 'surface_water.nc')
+        cfg['files']['topo'] = None
+
+        hdr = "{0:<16}{1:<12}{2:<12}{3:<16}{4:<12}".format("Checkpoint (s)",
+                                                          "Days",
+                                                          "Wall (s)",
+                                                          "Days/hour",
+                                                          "Checkpoint %")
+        rows = []
+
+        for interval in args.intervals:
+            cfg['checkpoint']['interval'] = interval
+            cfg['checkpoint']['directory'] = os.path.join(tmp,
+                                              'checkpoints_{:0.0f}'.format(interval))
+
+            runner = OverlandRunner(cfg)
+            try:
+                stats = runner.run(resume=False)
+            finally:
+                runner.close()
+
+            rows.append("{0:<16.0f}{1:<12.2f}{2:<12.1f}{3:<16.1f}{4:<12.1f}"
+                        "".format(interval, stats['days'], stats['seconds'],
+                                  stats['days'] / stats['seconds'] * 3600.0,
+                                  100.0 * stats['checkpoint_seconds'] /
+                                  stats['seconds']))
+
+        print('\n' + hdr)
+        print("=" * len(hdr))
+        for row in rows:
+            print(row)
+
+    finally:
+        rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
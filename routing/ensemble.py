@@ -0,0 +1,303 @@
+"""
+Runs an ensemble of overland flow simulations over a grid of parameters and
+basins on a pool of processes, then collects the outlet hydrograph of every
+member into one table.
+
+    python ensemble.py tollgate.ini -n 0.02 0.03 0.05 --steep_slopes true false
+
+Each basin's DEM and SWI are read from its netcdf once, converted to m/s and
+saved as .npy files that every member memory maps read only, so the forcing
+is on disk and in the page cache once no matter how many processes use it.
+Members record the outlet as a gauge and checkpoint like any other runner
+config, so rerunning an ensemble that died picks each member up where it was.
+"""
+from overland import read_config, OverlandRunner
+from ncio import NETCDF_LOCK
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from netCDF4 import Dataset
+from collections import OrderedDict
+from copy import deepcopy
+import pandas as pd
+import numpy as np
+import itertools
+import argparse
+import time
+import sys
+import os
+
+
+# Parameters the ensemble can vary, in the order members are numbered
+PARAMETERS = ['mannings_n', 'steep_slopes', 'fill_slope', 'outlet_id']
+
+
+def share_basin(cfg, directory):
+    """
+    Writes the DEM, coordinates and SWI of a basin to .npy files that can be
+    memory mapped. The SWI is converted to m/s the same way SWIForcing does
+    and only the days the config runs are kept.
+
+    Args:
+        cfg: Config from read_config
+        directory: Directory to write the arrays to
+
+    Returns:
+        dict: name to path of each array, for OverlandRunner's basin
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    paths = {n:os.path.join(directory, n + '.npy') for n in ['dem', 'x', 'y',
+                                                             'swi']}
+
+    with NETCDF_LOCK:
+        ds = Dataset(cfg['files']['swi'], mode='r')
+        var = ds.variables['SWI']
+        var.set_auto_mask(False)
+
+        days = var.shape[0]
+        if cfg['model']['days'] != None:
+            days = min(cfg['model']['days'], days)
+
+        np.save(paths['dem'], np.ma.filled(ds.variables['dem'][:], -9999))
+        np.save(paths['x'], np.ma.getdata(ds.variables['x'][:]))
+        np.save(paths['y'], np.ma.getdata(ds.variables['y'][:]))
+
+        swi = np.lib.format.open_memmap(paths['swi'], mode='w+',
+                                        dtype=np.float64,
+                                        shape=(days, int(np.prod(var.shape[1:]))))
+        for day in range(days):
+            buf = swi[day]
+            buf.reshape(var.shape[1:])[:] = var[day]
+
+            # mm/day to m/s, same operations as the original conversion
+            buf /= 86400.0
+            buf /= 1000.0
+
+        swi.flush()
+        del swi
+        ds.close()
+
+    return paths
+
+
+def make_members(basins, grid, directory):
+    """
+    Makes a runner config for every combination of the parameter grid for
+    each basin. Members only record their outlet and a fill slope of None
+    leaves the pits unfilled.
+
+    Args:
+        basins: Dictionary of basin name to config from read_config
+        grid: Dictionary of parameter to list of values, missing parameters
+              keep the basin's config value
+        directory: Work directory for the member outputs and checkpoints
+
+    Returns:
+        list: dictionaries of basin, member number, parameters and config
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    members = []
+
+    for basin, cfg in basins.items():
+        model = cfg['model']
+
+        base = {'mannings_n':[model['mannings_n']],
+                'steep_slopes':[model['steep_slopes']],
+                'fill_slope':[model['fill_slope'] if model['fill_pits']
+                                                  else None],
+                'outlet_id':[model['outlet_id']]}
+        base.update({k:v for k, v in grid.items() if v})
+
+        for i, values in enumerate(itertools.product(*[base[p] for p in
+                                                       PARAMETERS])):
+            params = OrderedDict(zip(PARAMETERS, values))
+            name = '{}_{:04d}'.format(basin, i)
+
+            member = deepcopy(cfg)
+            member['model'].update(params)
+            member['model']['fill_pits'] = params['fill_slope'] != None
+            if params['fill_slope'] == None:
+                member['model']['fill_slope'] = model['fill_slope']
+
+            member['files']['topo'] = None
+            member['output']['grid_interval'] = 0
+            member['gauges'].update({'nodes':[params['outlet_id']],
+                                     'shapefile':None,
+                                     'output':os.path.join(directory,
+                                                           name + '.csv')})
+            member['checkpoint']['directory'] = os.path.join(directory,
+                                                    name + '_checkpoints')
+
+            members.append({'basin':basin, 'member':i, 'name':name,
+                            'params':params, 'cfg':member})
+
+    return members
+
+
+def run_member(member, shared):
+    """
+    Runs one member on the memory mapped basin, in a worker process.
+
+    Returns:
+        dict: stats of the run from OverlandRunner.run and its cpu_seconds
+    """
+    start = time.process_time()
+    basin = {n:np.load(p, mmap_mode='r') for n, p in shared.items()}
+
+    runner = OverlandRunner(member['cfg'], basin=basin, verbose=False)
+    try:
+        stats = runner.run(resume=True)
+    finally:
+        runner.close()
+
+    stats['cpu_seconds'] = time.process_time() - start
+    return stats
+
+
+def collect(members):
+    """
+    Reads the outlet records of every member into one long table of the
+    basin, member, parameters, time, discharge and depth.
+    """
+    tables = []
+
+    for member in members:
+        df = pd.read_csv(member['cfg']['gauges']['output'])
+        outlet = str(member['params']['outlet_id'])
+
+        table = pd.DataFrame({'time':df['time'],
+                              'discharge':df[outlet + '_discharge'],
+                              'depth':df[outlet + '_depth']})
+        table.insert(0, 'basin', member['basin'])
+        table.insert(1, 'member', member['member'])
+        for i, (k, v) in enumerate(member['params'].items()):
+            table.insert(2 + i, k, v)
+
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run an ensemble of overland flow"
+                                            " simulations over a parameter"
+                                            " grid on a pool of processes")
+
+    p.add_argument(dest='configs', nargs='+',
+                        help="Runner config ini file of each basin, the basin"
+                             " is named after the file")
+
+    p.add_argument('-n','--mannings_n', dest='mannings_n',
+                        nargs='+', type=float, default=[],
+                        help="Manning's n values to run")
+
+    p.add_argument('-s','--steep_slopes', dest='steep_slopes',
+                        nargs='+', default=[],
+                        type=lambda v: v.lower() in ['true', 'yes', '1'],
+                        help="Steep slopes settings to run e.g. true false")
+
+    p.add_argument('-f','--fill_slope', dest='fill_slope',
+                        nargs='+', default=[],
+                        type=lambda v: None if v.lower() == 'none'
+                                            else float(v),
+                        help="Pit fill slopes to run, none for unfilled")
+
+    p.add_argument('-o','--outlets', dest='outlet_id',
+                        nargs='+', type=int, default=[],
+                        help="Outlet node ids to run")
+
+    p.add_argument('-d','--days', dest='days',
+                        type=int, default=None,
+                        help="Number of days to run, defaults to each config")
+
+    p.add_argument('-w','--work_dir', dest='work_dir',
+                        default='./ensemble',
+                        help="Directory for the shared basins, member outputs"
+                             " and checkpoints")
+
+    p.add_argument('-p','--processes', dest='processes',
+                        type=int, default=os.cpu_count(),
+                        help="Number of simulations to run at once, defaults"
+                             " to every core")
+
+    p.add_argument('--output', dest='output',
+                        default='hydrographs.csv',
+                        help="Table of every member's outlet hydrograph, .csv"
+                             " or .parquet")
+
+    args = p.parse_args()
+
+    basins = OrderedDict()
+    for fname in args.configs:
+        basin = os.path.splitext(os.path.basename(fname))[0]
+        if basin in basins:
+            p.error("Basin {} is given twice, configs need different file"
+                    " names".format(basin))
+
+        basins[basin] = read_config(fname)
+        if args.days != None:
+            basins[basin]['model']['days'] = args.days
+
+    grid = {k:getattr(args, k) for k in PARAMETERS}
+    members = make_members(basins, grid, os.path.join(args.work_dir,
+                                                      'members'))
+
+    print("Sharing {} basins...".format(len(basins)))
+    shared = {}
+    for basin, cfg in basins.items():
+        shared[basin] = share_basin(cfg, os.path.join(args.work_dir, 'shared',
+                                                      basin))
+
+    print("Running {} members on {} processes...".format(len(members),
+                                                         args.processes))
+    start = time.time()
+    seconds = 0.0
+    days = 0.0
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = {pool.submit(run_member, m, shared[m['basin']]):m
+                                                              for m in members}
+
+        for future in as_completed(futures):
+            member = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                print("\t{} failed: {}".format(member['name'], repr(e)))
+                failed.append(member)
+                continue
+
+            seconds += stats['cpu_seconds']
+            days += stats['days']
+            print("\t{} finished {:0.2f} days in {:0.1f}s {}".format(
+                                member['name'], stats['days'],
+                                stats['seconds'], dict(member['params'])))
+
+    elapsed = time.time() - start
+
+    done = [m for m in members if m not in failed]
+    if done:
+        table = collect(done)
+        if args.output.lower().endswith('.parquet'):
+            table.to_parquet(args.output, index=False)
+        else:
+            table.to_csv(args.output, index=False, float_format='%.9g')
+        print("Wrote {} records of {} members to {}".format(len(table),
+                                                            len(done),
+                                                            args.output))
+
+    # Cores kept busy, the speed up over running the members one at a time
+    print("\nSimulated {:0.1f} days in {:0.1f}s ({:0.1f} days per hour) keeping"
+          " {:0.1f} cores busy".format(days, elapsed, days / elapsed * 3600.0,
+                                      seconds / elapsed))
+
+    if failed:
+        print("{} of {} members failed".format(len(failed), len(members)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
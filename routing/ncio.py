@@ -0,0 +1,355 @@
+"""
+NetCDF input and output for the overland flow model that keeps disk access
+off the solver's thread.
+
+The netCDF and HDF5 libraries are not thread safe, so every netCDF call made
+while a reader or writer thread is running has to hold NETCDF_LOCK.
+"""
+from netCDF4 import Dataset, num2date
+import numpy as np
+import queue
+import threading
+
+
+# Serializes netCDF calls between the solver and the I/O threads
+NETCDF_LOCK = threading.RLock()
+
+
+class SWIForcing(object):
+    """
+    Streams daily SWI from a netcdf on a background thread. Days are read a
+    small window ahead into a preallocated ring of buffers and converted from
+    mm/day to m/s in place, so memory only depends on the grid size and the
+    window, not the number of days simulated.
+
+    Days have to be asked for in order (skipping ahead is fine). A day's
+    buffer is reused once a day window + 1 later has been asked for.
+
+    Args:
+        fname: Path to a netcdf containing the SWI
+        variable: Name of the SWI variable with dimensions (time, y, x)
+        window: Number of days to read ahead of the current day
+        start: First day that will be asked for
+    """
+
+    def __init__(self, fname, variable='SWI', window=2, start=0):
+        with NETCDF_LOCK:
+            self.ds = Dataset(fname, mode='r')
+            self.var = self.ds.variables[variable]
+
+            # Read the raw values, the units conversion happens in place
+            self.var.set_auto_mask(False)
+            self.days = self.var.shape[0]
+            self.shape = self.var.shape[1:]
+
+        self.window = window
+        self.buffers = np.empty((window + 1, int(np.prod(self.shape))),
+                                dtype=np.float64)
+
+        self.current = start
+        self.next = start
+        self.loaded = start - 1
+        self.error = None
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.thread = threading.Thread(target=self._prefetch, name='swi')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        return self.days
+
+    def _prefetch(self):
+        """
+        Reads days into the ring ahead of the current day until closed.
+        """
+        try:
+            while True:
+                with self.cond:
+                    # Skip days the model has already moved past
+                    self.next = max(self.next, self.current)
+
+                    while (not self.closed and
+                           (self.next > self.current + self.window or
+                            self.next >= self.days)):
+                        self.cond.wait()
+
+                        self.next = max(self.next, self.current)
+
+                    if self.closed:
+                        return
+
+                    day = self.next
+
+                buf = self.buffers[day % (self.window + 1)]
+
+                with NETCDF_LOCK:
+                    buf.reshape(self.shape)[:] = self.var[day]
+
+                # mm/day to m/s, same operations as the original conversion
+                buf /= 86400.0
+                buf /= 1000.0
+
+                with self.cond:
+                    self.loaded = day
+                    self.next = day + 1
+                    self.cond.notify_all()
+
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def __getitem__(self, day):
+        """
+        Returns the flattened SWI of a day in m/s. The array belongs to the
+        reader and must not be modified.
+        """
+        if day >= self.days or day < 0:
+            raise IndexError("Day {} is outside of the {} days of SWI"
+                             "".format(day, self.days))
+
+        with self.cond:
+            if day < self.current:
+                raise ValueError("SWI days have to be read in order, day {}"
+                                 " was asked for after day {}".format(day,
+                                                                 self.current))
+            self.current = day
+            self.cond.notify_all()
+
+            while self.loaded < day and self.error == None:
+                self.cond.wait()
+
+            if self.error != None:
+                raise self.error
+
+        return self.buffers[day % (self.window + 1)]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        self.thread.join()
+
+        with NETCDF_LOCK:
+            self.ds.close()
+
+
+def forcing_day(elapsed_time, days):
+    """
+    Day of SWI forcing applied at a time in the simulation, day n covers
+    n * 86400 up to (n + 1) * 86400 seconds. The last day of forcing is held
+    for any time past the end of it.
+
+    Args:
+        elapsed_time: Seconds since the start of the simulation
+        days: Number of days of forcing
+
+    Returns:
+        int: index of the forcing day
+    """
+    return min(int(elapsed_time // 86400.0), days - 1)
+
+
+def time_units(template):
+    """
+    Units of the output time, seconds since the first SWI time so the output
+    dates line up with the forcing. Without SWI time units the output time is
+    plain elapsed seconds.
+
+    Args:
+        template: Open netcdf with the SWI time
+
+    Returns:
+        tuple: units and calendar of the output time, the calendar is None
+               when the SWI has no dates
+    """
+    time = template.variables.get('time')
+    if time is None or 'since' not in getattr(time, 'units', ''):
+        return 'seconds', None
+
+    calendar = getattr(time, 'calendar', 'standard')
+    start = num2date(time[0], time.units, calendar=calendar)
+
+    return 'seconds since {}'.format(start.strftime('%Y-%m-%d %H:%M:%S')), \
+           calendar
+
+
+class OutputWriter(object):
+    """
+    Writes model output frames to a netcdf in batches from a background
+    thread. Frames are copied into a ring of preallocated batches of frames
+    and each full batch is written with a single write per variable, so the
+    solver only waits on the disk if every batch is still waiting to be
+    written.
+
+    Args:
+        fname: Path of the netcdf to create
+        template: Open netcdf with the x and y to write the output on
+        names: Names of the output variables with dimensions (time, y, x)
+        frames: Number of frames in a batch
+        dtype: Data type of the output variables e.g. f4 or f8
+        complevel: zlib compression level, 0 for none
+        batches: Number of batches in the ring
+        start: Frame to continue an existing output file from when resuming,
+               defaults to creating a new file
+    """
+
+    def __init__(self, fname, template, names, frames=24, dtype='f4',
+                                               complevel=4, batches=3,
+                                               start=None):
+        self.names = list(names)
+        self.frames = frames
+        self.written = 0 if start == None else start
+
+        with NETCDF_LOCK:
+            x = template.variables['x'][:]
+            y = template.variables['y'][:]
+            units, calendar = time_units(template)
+
+        if start == None:
+            self._create(fname, x, y, dtype, complevel, units, calendar)
+        else:
+            with NETCDF_LOCK:
+                self.ds = Dataset(fname, mode='a')
+
+        size = len(y) * len(x)
+        self.shape = (len(y), len(x))
+
+        # Ring of batches, each a time array and a frame array per variable
+        self.free = queue.Queue()
+        self.full = queue.Queue()
+        for i in range(batches):
+            self.free.put({'time':np.empty(frames, dtype=np.float64),
+                           'data':{n:np.empty((frames, size), dtype=dtype)
+                                   for n in self.names}})
+
+        self.batch = self.free.get()
+        self.count = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self._flush, name='output')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _create(self, fname, x, y, dtype, complevel, units, calendar):
+        """
+        Creates the output file, chunking a batch of frames together.
+        """
+        frames = self.frames
+
+        with NETCDF_LOCK:
+            self.ds = Dataset(fname, mode='w', format='NETCDF4')
+            self.ds.createDimension('time', None)
+            self.ds.createDimension('y', len(y))
+            self.ds.createDimension('x', len(x))
+
+            self.ds.createVariable('x', x.dtype, ('x',))[:] = x
+            self.ds.createVariable('y', y.dtype, ('y',))[:] = y
+
+            t = self.ds.createVariable('time', 'f8', ('time',),
+                                       chunksizes=(max(frames, 512),))
+            t.units = units
+            if calendar != None:
+                t.calendar = calendar
+
+            # Chunk a batch of frames together, up to about 4 MB a chunk
+            size = len(y) * len(x)
+            frame_bytes = size * np.dtype(dtype).itemsize
+            steps = min(frames, max(4 * 1024**2 // frame_bytes, 1))
+
+            for name in self.names:
+                self.ds.createVariable(name, dtype, ('time', 'y', 'x'),
+                                       zlib=complevel > 0,
+                                       complevel=max(complevel, 1),
+                                       shuffle=complevel > 0,
+                                       chunksizes=(steps, len(y), len(x)))
+
+    def _flush(self):
+        """
+        Writes full batches until a None is queued.
+        """
+        for start, count, batch in iter(self.full.get, None):
+            try:
+                with NETCDF_LOCK:
+                    self.ds.variables['time'][start:start + count] = \
+                                                        batch['time'][:count]
+
+                    for name, data in batch['data'].items():
+                        self.ds.variables[name][start:start + count] = \
+                                    data[:count].reshape((count,) + self.shape)
+
+            except Exception as e:
+                self.error = e
+
+            self.free.put(batch)
+            self.full.task_done()
+
+        self.full.task_done()
+
+    def write(self, time, fields):
+        """
+        Copies a frame into the current batch, queuing the batch to be written
+        once it is full.
+
+        Args:
+            time: Time of the frame
+            fields: Dictionary of variable name to node values
+        """
+        if self.error != None:
+            raise self.error
+
+        self.batch['time'][self.count] = time
+        for name in self.names:
+            self.batch['data'][name][self.count] = fields[name]
+
+        self.count += 1
+        if self.count == self.frames:
+            self._queue()
+            self.batch = self.free.get()
+
+    def _queue(self):
+        self.full.put((self.written, self.count, self.batch))
+        self.written += self.count
+        self.count = 0
+
+    def flush(self):
+        """
+        Writes any partial batch and waits until everything written so far is
+        on disk.
+
+        Returns:
+            int: number of frames in the file
+        """
+        if self.count:
+            self._queue()
+            self.batch = self.free.get()
+
+        self.full.join()
+
+        with NETCDF_LOCK:
+            self.ds.sync()
+
+        if self.error != None:
+            raise self.error
+
+        return self.written
+
+    def close(self):
+        """
+        Writes any partial batch and closes the netcdf once everything is on
+        disk.
+        """
+        if self.count:
+            self._queue()
+
+        self.full.put(None)
+        self.thread.join()
+
+        with NETCDF_LOCK:
+            self.ds.close()
+
+        if self.error != None:
+            raise self.error
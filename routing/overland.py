@@ -0,0 +1,494 @@
+"""
+Config driven overland flow runner with checkpoints. The model is the same
+RasterModelGrid and OverlandFlow setup as rout.py but the basin, parameters
+and output come from an ini file, and the grid state is saved periodically so
+a run that dies can pick up from its latest checkpoint instead of day 0.
+
+    python overland.py tollgate.ini
+
+A checkpoint holds the water depth at the nodes, the discharge at the links,
+the elapsed time, the SWI day and the number of output frames and gauge
+records written, which is everything OverlandFlow carries from one time step
+to the next.
+
+Runs that only need hydrographs can record gauges every interval and write
+the full grids rarely, or never with grid_interval = 0.
+"""
+from landlab import RasterModelGrid
+from landlab.components import SinkFiller
+from landlab.components.overland_flow import OverlandFlow
+from landlab.io.netcdf import write_netcdf
+
+from netCDF4 import Dataset
+from ncio import NETCDF_LOCK, SWIForcing, OutputWriter, forcing_day
+from gauges import GaugeWriter, node_gauges, read_gauges
+from collections import OrderedDict
+import numpy as np
+import progressbar as pb
+import configparser
+import argparse
+import glob
+import json
+import os
+import time
+
+
+# Every config item with its default, the type of the default is the type the
+# item is parsed as. None means the item is optional.
+DEFAULTS = OrderedDict([
+    ('files', OrderedDict([
+        ('swi', None),
+        ('output', 'surface_water.nc'),
+        ('topo', None),
+    ])),
+    ('model', OrderedDict([
+        ('outlet_id', 2615),
+        ('mannings_n', 0.03),
+        ('steep_slopes', True),
+        ('fill_pits', False),
+        ('fill_slope', 1e-5),
+        ('days', None),
+    ])),
+    ('output', OrderedDict([
+        ('interval', 3600.0),
+        ('grid_interval', None),
+        ('frames', 24),
+        ('dtype', 'f4'),
+        ('complevel', 4),
+        ('prefetch', 2),
+    ])),
+    ('gauges', OrderedDict([
+        ('nodes', []),
+        ('shapefile', None),
+        ('field', 'name'),
+        ('output', 'gauges.csv'),
+    ])),
+    ('checkpoint', OrderedDict([
+        ('directory', 'checkpoints'),
+        ('interval', 86400.0),
+        ('keep', 2),
+    ])),
+])
+
+# Config items that change the simulation, checked before resuming
+MODEL_ITEMS = ['outlet_id', 'mannings_n', 'steep_slopes', 'fill_pits',
+               'fill_slope']
+
+# Names of the output grids
+OUTPUTS = ['surface_water__discharge', 'surface_water__depth']
+
+
+def read_config(fname):
+    """
+    Reads a runner config, filling in defaults and resolving paths relative to
+    the config file, e.g.
+
+        [files]
+        swi = swi.nc
+
+        [model]
+        outlet_id = 2615
+        mannings_n = 0.03
+
+        [gauges]
+        nodes = 2615
+
+        [checkpoint]
+        interval = 86400
+
+    Args:
+        fname: Path to an ini file
+
+    Returns:
+        dict: section to dictionary of item to value
+    """
+    if not os.path.isfile(fname):
+        raise IOError("Config file {} does not exist".format(fname))
+
+    ini = configparser.ConfigParser()
+    ini.read(fname)
+
+    unknown = [s for s in ini.sections() if s not in DEFAULTS]
+    if unknown:
+        raise ValueError("Unknown config sections {}".format(unknown))
+
+    cfg = {}
+    for section, items in DEFAULTS.items():
+        cfg[section] = OrderedDict(items)
+
+        if not ini.has_section(section):
+            continue
+
+        for item, value in ini.items(section):
+            if item not in items:
+                raise ValueError("Unknown config item {} in [{}]".format(item,
+                                                                    section))
+            default = items[item]
+
+            if value.strip().lower() in ['', 'none']:
+                cfg[section][item] = None
+            elif isinstance(default, list):
+                cfg[section][item] = [int(v) for v in
+                                      value.replace(',', ' ').split()]
+            elif isinstance(default, bool):
+                cfg[section][item] = ini.getboolean(section, item)
+            elif isinstance(default, float) or item == 'grid_interval':
+                cfg[section][item] = float(value)
+            elif isinstance(default, int) or item == 'days':
+                cfg[section][item] = int(value)
+            else:
+                cfg[section][item] = value.strip()
+
+    if cfg['files']['swi'] == None:
+        raise ValueError("[files] swi is required")
+
+    if cfg['output']['grid_interval'] == None:
+        cfg['output']['grid_interval'] = cfg['output']['interval']
+
+    gauges = cfg['gauges']['nodes'] or cfg['gauges']['shapefile'] != None
+    if cfg['output']['grid_interval'] <= 0 and not gauges:
+        raise ValueError("Grid output is off and there are no [gauges],"
+                         " nothing would be written")
+
+    # Paths are relative to the config
+    base = os.path.dirname(os.path.abspath(fname))
+    for section, item in [('files', 'swi'), ('files', 'output'),
+                          ('files', 'topo'), ('gauges', 'shapefile'),
+                          ('gauges', 'output'), ('checkpoint', 'directory')]:
+        if cfg[section][item] != None:
+            cfg[section][item] = os.path.join(base, cfg[section][item])
+
+    return cfg
+
+
+class ArrayForcing(object):
+    """
+    SWI forcing from an array already in m/s with dimensions (time, node), the
+    in memory counterpart of ncio.SWIForcing.
+    """
+
+    def __init__(self, swi):
+        self.swi = swi
+
+    def __len__(self):
+        return self.swi.shape[0]
+
+    def __getitem__(self, day):
+        return self.swi[day]
+
+    def close(self):
+        pass
+
+
+def latest_checkpoint(directory):
+    """
+    Returns the path of the checkpoint furthest into the simulation or None.
+    """
+    found = sorted(glob.glob(os.path.join(directory, 'checkpoint_*.npz')))
+    return found[-1] if found else None
+
+
+class OverlandRunner(object):
+    """
+    Runs OverlandFlow on a basin cropped with crop.py, recording gauges every
+    output interval, grid frames every grid interval and a checkpoint every
+    checkpoint interval of simulated time.
+
+    Args:
+        cfg: Config from read_config
+        basin: Dictionary of the dem, x, y and swi arrays to use instead of
+               reading the [files] swi netcdf, e.g. memory mapped arrays
+               shared between runs. The swi is in m/s with dimensions (time,
+               node). There is no grid output without the netcdf.
+        verbose: Print the setup and a progress bar
+    """
+
+    def __init__(self, cfg, basin=None, verbose=True):
+        self.cfg = cfg
+        self.basin = basin
+        self.verbose = verbose
+        self.log = print if verbose else lambda *args: None
+        files = cfg['files']
+        model = cfg['model']
+
+        if basin == None:
+            with NETCDF_LOCK:
+                self.ds = Dataset(files['swi'], mode='r')
+                dem = self.ds.variables['dem'][:]
+                x = self.ds.variables['x'][:]
+                y = self.ds.variables['y'][:]
+
+        else:
+            if cfg['output']['grid_interval'] > 0:
+                raise ValueError("Grid output needs the swi netcdf, set"
+                                 " [output] grid_interval = 0")
+            self.ds = None
+            dem, x, y = basin['dem'], basin['x'], basin['y']
+
+        dx = abs(x[0] - x[1])
+
+        # Landlab has issues with C types this ensures we have the right type
+        z = np.ma.filled(dem, -9999).astype(np.float64)
+
+        self.log("\tMaking a new grid of {} at {}m spacing...".format(z.shape,
+                                                                     dx))
+        self.rmg = RasterModelGrid(z.shape, (dx, dx))
+
+        # DEM, depth, and discharge assignment
+        self.rmg.add_field('node', 'topographic__elevation', z.flatten())
+        self.rmg.add_zeros('node', 'surface_water__depth')
+        self.rmg.add_zeros('node', 'surface_water__discharge')
+
+        self.log("\tSetting Boundary Conditions...")
+        self.rmg.set_watershed_boundary_condition_outlet_id(model['outlet_id'],
+                                                            z.flatten())
+
+        self.of = OverlandFlow(self.rmg, mannings_n=model['mannings_n'],
+                                         steep_slopes=model['steep_slopes'])
+
+        if model['fill_pits']:
+            self.log("\tFilling pits...")
+            sf = SinkFiller(self.rmg, routing='D4', apply_slope=False,
+                                      fill_slope=model['fill_slope'])
+            sf.fill_pits()
+
+        if files['topo'] != None:
+            self.log("\tOutputting topo from Landlab...")
+            write_netcdf(files['topo'], self.rmg,
+                         names=['topographic__elevation'])
+
+        self.gauges = OrderedDict()
+        if cfg['gauges']['shapefile'] != None:
+            self.gauges.update(read_gauges(cfg['gauges']['shapefile'], x, y,
+                                           field=cfg['gauges']['field']))
+        self.gauges.update(node_gauges(cfg['gauges']['nodes'] or []))
+
+        self.elapsed_time = 0.0
+        self.pp_t = 0
+        self.iteration = 0
+        self.records = 0
+
+    def checkpoint(self):
+        """
+        Saves the grid state to a new checkpoint and removes the oldest ones
+        past the number to keep. The file only appears once it is complete.
+        """
+        directory = self.cfg['checkpoint']['directory']
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fname = os.path.join(directory, 'checkpoint_{:012.0f}.npz'.format(
+                                                            self.elapsed_time))
+        model = {k:self.cfg['model'][k] for k in MODEL_ITEMS}
+
+        tmp = fname + '.part'
+        with open(tmp, 'wb') as fp:
+            np.savez(fp, depth=self.rmg.at_node['surface_water__depth'],
+                         discharge=self.of.q,
+                         elapsed_time=self.elapsed_time,
+                         pp_t=self.pp_t,
+                         iteration=self.iteration,
+                         records=self.records,
+                         model=json.dumps(model, sort_keys=True))
+        os.replace(tmp, fname)
+
+        keep = self.cfg['checkpoint']['keep']
+        found = sorted(glob.glob(os.path.join(directory, 'checkpoint_*.npz')))
+        for old in found[:-keep] if keep else []:
+            os.remove(old)
+
+        return fname
+
+    def restore(self, fname):
+        """
+        Loads the grid state from a checkpoint.
+        """
+        model = {k:self.cfg['model'][k] for k in MODEL_ITEMS}
+
+        with np.load(fname) as data:
+            if json.loads(str(data['model'])) != json.loads(json.dumps(model)):
+                raise ValueError("Checkpoint {} was made with different model"
+                                 " settings {}".format(fname,
+                                                       str(data['model'])))
+
+            depth = self.rmg.at_node['surface_water__depth']
+            if data['depth'].shape != depth.shape:
+                raise ValueError("Checkpoint {} is for a grid of {} nodes, not"
+                                 " {}".format(fname, data['depth'].shape[0],
+                                              depth.shape[0]))
+
+            # In place, OverlandFlow holds on to these arrays
+            depth[:] = data['depth']
+            self.of.q[:] = data['discharge']
+            self.elapsed_time = float(data['elapsed_time'])
+            self.pp_t = int(data['pp_t'])
+            self.iteration = int(data['iteration'])
+            self.records = int(data['records']) if 'records' in data else 0
+
+    def run(self, resume=True):
+        """
+        Runs the simulation, continuing from the latest checkpoint if there is
+        one and resume is set.
+
+        Returns:
+            dict: simulated days, wall clock seconds and seconds spent writing
+                  checkpoints of this run
+        """
+        files = self.cfg['files']
+        output = self.cfg['output']
+        interval = self.cfg['checkpoint']['interval']
+
+        directory = self.cfg['checkpoint']['directory']
+        latest = latest_checkpoint(directory)
+        resumed = resume and latest != None
+
+        if resumed:
+            self.log("\tResuming from {}...".format(latest))
+            self.restore(latest)
+
+        # Starting over, checkpoints of an earlier run no longer apply
+        elif latest != None:
+            for old in glob.glob(os.path.join(directory, 'checkpoint_*.npz')):
+                os.remove(old)
+
+        if self.basin == None:
+            pp = SWIForcing(files['swi'], window=output['prefetch'],
+                                          start=self.pp_t)
+        else:
+            pp = ArrayForcing(self.basin['swi'])
+        days = self.cfg['model']['days']
+        if days == None:
+            days = len(pp)
+        model_run_time = 86400.0 * days
+
+        # A resumed run continues the output from the checkpoint's frame
+        out = None
+        if output['grid_interval'] > 0:
+            out = OutputWriter(files['output'], self.ds, OUTPUTS,
+                               frames=output['frames'],
+                               dtype=output['dtype'],
+                               complevel=output['complevel'],
+                               start=self.iteration if resumed else None)
+
+        gauges = None
+        if self.gauges:
+            gauges = GaugeWriter(self.cfg['gauges']['output'], self.gauges,
+                                 start=self.records if resumed else None)
+
+        self.log("Running Simulation of overland flow...")
+        self.log('\n======== SIM Details ==========\n')
+        self.log("run_time = {} days ({} hrs)\n".format(days, days * 24.0))
+        if resumed:
+            self.log("starting at {:0.2f} days\n".format(self.elapsed_time /
+                                                      86400.0))
+
+        if self.verbose:
+            bar = pb.ProgressBar(max_value=model_run_time / 3600.0)
+        else:
+            bar = pb.NullBar(max_value=model_run_time / 3600.0)
+        rmg = self.rmg
+        of = self.of
+
+        start = time.time()
+        start_time = self.elapsed_time
+        checkpointing = 0.0
+        next_checkpoint = (np.floor(self.elapsed_time / interval) + 1) * \
+                                                     interval if interval else None
+
+        try:
+            precip = pp[self.pp_t]
+
+            while self.elapsed_time < model_run_time:
+
+                # Adaptive time step
+                of.dt = of.calc_time_step()
+
+                # Already converted to m/sec of precip
+                if forcing_day(self.elapsed_time, len(pp)) != self.pp_t:
+                    self.pp_t = forcing_day(self.elapsed_time, len(pp))
+                    precip = pp[self.pp_t]
+
+                    # Keep the gauge records on disk a day at a time
+                    if gauges != None:
+                        gauges.flush()
+
+                # Add in any SWI
+                rmg.at_node['surface_water__depth'] += precip * of.dt
+
+                # Calculate overland
+                of.overland_flow()
+
+                self.elapsed_time += of.dt
+
+                if (gauges != None and
+                    self.elapsed_time >= self.records * output['interval']):
+                    gauges.write(self.elapsed_time, rmg, of.q)
+                    self.records += 1
+
+                if (out != None and self.elapsed_time >=
+                                    self.iteration * output['grid_interval']):
+                    rmg.at_node['surface_water__discharge'] = \
+                            of.discharge_mapper(of.q, convert_to_volume=True)
+                    out.write(self.elapsed_time, rmg.at_node)
+                    self.iteration += 1
+
+                # Output before the checkpoint has to be on disk first
+                if (next_checkpoint != None and
+                    self.elapsed_time >= next_checkpoint):
+                    t = time.time()
+                    if out != None:
+                        out.flush()
+                    if gauges != None:
+                        gauges.flush()
+                    self.checkpoint()
+                    checkpointing += time.time() - t
+
+                    next_checkpoint += interval
+
+                bar.update(min(self.elapsed_time, model_run_time) / 3600.0)
+
+        finally:
+            pp.close()
+            if out != None:
+                out.close()
+            if gauges != None:
+                gauges.close()
+
+        return {'days':(self.elapsed_time - start_time) / 86400.0,
+                'seconds':time.time() - start,
+                'checkpoint_seconds':checkpointing}
+
+    def close(self):
+        if self.ds != None:
+            with NETCDF_LOCK:
+                self.ds.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run Land labs overland flow model"
+                                            " from a config file, resuming"
+                                            " from the latest checkpoint")
+
+    p.add_argument(dest='config', help="Path to a runner config ini file")
+
+    p.add_argument('--restart', dest='restart', action='store_true',
+                        help="Start from day 0 even if there are checkpoints")
+
+    args = p.parse_args()
+
+    cfg = read_config(args.config)
+    runner = OverlandRunner(cfg)
+
+    try:
+        stats = runner.run(resume=not args.restart)
+    finally:
+        runner.close()
+
+    print("\nSimulated {:0.2f} days in {:0.1f}s ({:0.1f} days per hour), {:0.1f}s"
+          " of it checkpointing".format(stats['days'], stats['seconds'],
+                                 stats['days'] / stats['seconds'] * 3600.0,
+                                 stats['checkpoint_seconds']))
+
+
+if __name__ == '__main__':
+    main()
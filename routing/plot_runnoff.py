@@ -6,7 +6,8 @@ import argparse
 
 parser = argparse.ArgumentParser(description="Plot up the runoff")
 parser.add_argument(dest='surface_water',
-                    help='Path to a netcdf file that has surface_water discharge')
+                    help='Path to a netcdf file that has surface_water discharge'
+                         ' or a gauge file from rout.py -g 2615')
 parser.add_argument(dest='runoff', help='Path to measured runoff')
 
 parser.add_argument(dest='swi',
@@ -17,15 +18,24 @@ args = parser.parse_args()
 # Read actual runnoff
 df = pd.read_csv(args.runoff,parse_dates=True, index_col=0, header=17)
 
-# Open our modeled
-ds  = Dataset(args.surface_water)
-array_shape = ds.variables['surface_water__discharge'][0,:].shape
+# Open our modeled, either the outlet gauge or the full grids
+gauged = args.surface_water.lower().endswith(('.csv', '.parquet'))
+if gauged:
+    if args.surface_water.lower().endswith('.parquet'):
+        gauge = pd.read_parquet(args.surface_water)
+    else:
+        gauge = pd.read_csv(args.surface_water)
+    hours = len(gauge)
+else:
+    ds  = Dataset(args.surface_water)
+    array_shape = ds.variables['surface_water__discharge'][0,:].shape
+    hours = len(ds.variables['surface_water__discharge'])
 
 # Look with our modeled swi
 swi_ds  = Dataset(args.swi)
 
 swi = []
-for t in range(int(len(ds.variables['surface_water__discharge'])/24)):
+for t in range(int(hours/24)):
     ind = swi_ds.variables['SWI'][t,:] > 0
     swi.append(np.sum(swi_ds.variables['SWI'][t][ind])/1000000)
 
@@ -33,15 +43,19 @@ for t in range(int(len(ds.variables['surface_water__discharge'])/24)):
 dt = pd.DatetimeIndex(freq='D',start = '10-01-1983 00:00:00', periods = len(swi))
 s = pd.Series(swi, index = dt)
 
-# Figure out the outlet
-indices = np.unravel_index(2615,array_shape)
-# plt.imshow(ds.variables['surface_water__discharge'][-1,:])
-# plt.plot(indices[1],indices[0],'r.')
-# plt.show()
-
 # Make our datetime index
-dt = pd.DatetimeIndex(freq='H',start = '10-01-1983 00:00:00', periods = len(ds.variables['surface_water__discharge']))
-q = pd.Series(ds.variables['surface_water__discharge'][:,indices[0],indices[1]], index = dt)
+dt = pd.DatetimeIndex(freq='H',start = '10-01-1983 00:00:00', periods = hours)
+
+if gauged:
+    q = pd.Series(gauge['2615_discharge'].values, index = dt)
+else:
+    # Figure out the outlet
+    indices = np.unravel_index(2615,array_shape)
+    # plt.imshow(ds.variables['surface_water__discharge'][-1,:])
+    # plt.plot(indices[1],indices[0],'r.')
+    # plt.show()
+
+    q = pd.Series(ds.variables['surface_water__discharge'][:,indices[0],indices[1]], index = dt)
 df['modeled'] = q
 ind = df.index >= dt[0]
 
@@ -6,6 +6,8 @@ from landlab import FIXED_LINK, FIXED_GRADIENT_BOUNDARY
 from landlab.plot.imshow import imshow_grid
 
 from netCDF4 import Dataset
+from ncio import NETCDF_LOCK, SWIForcing, OutputWriter, forcing_day
+from gauges import GaugeWriter, node_gauges, read_gauges
 import numpy as np
 import progressbar as pb
 import matplotlib.pyplot as plt
@@ -20,10 +22,33 @@ parser.add_argument('--output','-o', default= './surface_water.nc',
                                     help='output filename')
 parser.add_argument('--days','-d', default='max days',
                                    help='number of days to run')
+parser.add_argument('--prefetch','-p', type=int, default=2,
+                                   help='number of days of SWI to read ahead')
+parser.add_argument('--frames','-f', type=int, default=24,
+                                   help='number of hourly outputs to write at once')
+parser.add_argument('--dtype', default='f4', choices=['f4','f8'],
+                                   help='data type of the output grids')
+parser.add_argument('--complevel','-c', type=int, default=4,
+                                   help='zlib compression level of the output,'
+                                        ' 0 for none')
+parser.add_argument('--gauges','-g', type=int, nargs='+', default=[],
+                                   help='node ids to record discharge and depth'
+                                        ' at every hour')
+parser.add_argument('--gauge_file', default=None,
+                                   help='point shapefile of gauges to record')
+parser.add_argument('--gauge_output', default='./gauges.csv',
+                                   help='gauge records filename, .csv or'
+                                        ' .parquet')
+parser.add_argument('--grid_hours', type=float, default=1,
+                                   help='hours between full grid outputs, 0 for'
+                                        ' gauges only')
 
 
 args = parser.parse_args()
 
+if args.grid_hours <= 0 and not (args.gauges or args.gauge_file):
+    parser.error("--grid_hours 0 needs --gauges or --gauge_file")
+
 ################################# INPUTS #######################################
 days = args.days
 swi_f = args.swi
@@ -33,28 +58,28 @@ swi_f = args.swi
 # Create the grid from the netcdf
 swi_ds = Dataset(swi_f, mode ='r')
 
-# Make output netcdfs
-out = Dataset(args.output, mode = 'w',format='NETCDF4')
-
-# Add NC dimensions
-for d,dimension in swi_ds.dimensions.items():
-    out.createDimension(d,(len(dimension) if not dimension.isunlimited() else None ))
-    out.dimensions[d] = dimension
-
-# Add NC variables for outputting
-for name,var in swi_ds.variables.items():
-    if name.lower() in ['time','x','y']:
-        out.createVariable(name, var.datatype, var.dimensions)
-    if name.lower() in ['x','y']:
-        out.variables[name] = var[:]
-
-out.createVariable('surface_water__depth','f8',("time","y","x"))
-out.createVariable('surface_water__discharge','f8',("time","y","x"))
+# Make output netcdfs, written in batches off of the solver's thread
+out = None
+if args.grid_hours > 0:
+    out = OutputWriter(args.output, swi_ds, ['surface_water__discharge',
+                                             'surface_water__depth'],
+                                            frames=args.frames,
+                                            dtype=args.dtype,
+                                            complevel=args.complevel)
+
+# Discharge and depth time series at a few nodes
+gauge_nodes = node_gauges(args.gauges)
+if args.gauge_file != None:
+    gauge_nodes.update(read_gauges(args.gauge_file, swi_ds.variables['x'][:],
+                                                    swi_ds.variables['y'][:]))
+gauges = GaugeWriter(args.gauge_output, gauge_nodes) if gauge_nodes else None
 
 # Calculate the grid size
 dx = abs(swi_ds.variables['x'][0] - swi_ds.variables['x'][1])
 dem = swi_ds.variables['dem'][:]
-pp = swi_ds.variables['SWI'][:]
+
+# SWI is streamed a day at a time instead of loaded whole
+pp = SWIForcing(swi_f, window=args.prefetch)
 
 # Landlab has issues with C types this ensures we have the right type
 z = dem
@@ -62,7 +87,7 @@ z = dem
 # Calculate run time
 elapsed_time = 0.0
 if days == 'max days':
-    days = len(pp[:,0,0])
+    days = len(pp)
 else:
     days = int(days)
 
@@ -100,7 +125,10 @@ print("\tFilling pits...")
 #sf.fill_pits()
 
 print("\tOutputting topo from Landlab...")
-write_netcdf('ll_topo.nc', rmg, names=['topographic__elevation'])
+
+# The SWI reader thread is already running
+with NETCDF_LOCK:
+    write_netcdf('ll_topo.nc', rmg, names=['topographic__elevation'])
 
 
 ################################# FLOW SIM #####################################
@@ -111,58 +139,69 @@ bar = pb.ProgressBar(max_value= (model_run_time/3600)+1)
 
 pp_t = 0
 iteration = 0
-precip = ((pp[pp_t,:]/86400.0)/1000.0).flatten()
+frames = 0
+precip = pp[pp_t]
 
-# Initial output
-out.variables['time'][iteration] = elapsed_time
+# The first output is written after the first time step
 
-out.variables['surface_water__discharge'][iteration] = \
-                                         rmg.at_node['surface_water__discharge']
+# Everything recorded so far is written even if the run fails
+try:
+    # TIME LOOP
+    while elapsed_time < model_run_time:
 
-out.variables['surface_water__depth'][iteration] = \
-                                             rmg.at_node['surface_water__depth']
+        # Adaptive time step
+        of.dt = of.calc_time_step()
 
-# TIME LOOP
-while elapsed_time < model_run_time:
+        # Already converted to m/sec of precip
+        if forcing_day(elapsed_time, len(pp)) != pp_t:
+            pp_t = forcing_day(elapsed_time, len(pp))
+            precip = pp[pp_t]
 
-    # Adaptive time step
-    of.dt = of.calc_time_step()
+            # Keep the gauge records on disk a day at a time
+            if gauges != None:
+                gauges.flush()
 
-    if elapsed_time > pp_t * 86400.0:
-        pp_t += 1
+            # print("New Precip event: {}mm".format(np.mean(precip)*of.dt*1000))
 
-        # Convert to m/sec of precip
-        precip = ((pp[pp_t,:] / 86400.0) / 1000.0).flatten()
-        # print("New Precip event: {}mm".format(np.mean(precip)*of.dt*1000))
+        # Add in any SWI
+        rmg.at_node['surface_water__depth'] += precip * of.dt
 
-    # Add in any SWI
-    rmg.at_node['surface_water__depth'] += precip * of.dt
+        # Calculate overland
+        of.overland_flow()
 
-    # Calculate overland
-    of.overland_flow()
+        elapsed_time += of.dt
 
-    elapsed_time += of.dt
+        if of.dt > 3600.0:
+            print(of.dt)
+        # output nearly hourly
+        if elapsed_time >= iteration*3600.0:
 
-    if of.dt > 3600.0:
-        print(of.dt)
-    # output nearly hourly
-    if elapsed_time >= iteration*3600.0:
+            if gauges != None:
+                gauges.write(elapsed_time, rmg, of.q)
 
-        # Output Netcdf stuff
-        rmg.at_node['surface_water__discharge'] = of.discharge_mapper(of.q,
-                                                         convert_to_volume=True)
-        out.variables['time'][iteration] = elapsed_time
+            iteration+=1
 
-        out.variables['surface_water__discharge'][iteration] = \
-                                         rmg.at_node['surface_water__discharge']
+        # Full grids every grid_hours
+        if out != None and elapsed_time >= frames*args.grid_hours*3600.0:
 
-        out.variables['surface_water__depth'][iteration] = \
-                                             rmg.at_node['surface_water__depth']
-        iteration+=1
+            # Output Netcdf stuff
+            rmg.at_node['surface_water__discharge'] = of.discharge_mapper(of.q,
+                                                             convert_to_volume=True)
+            out.write(elapsed_time, rmg.at_node)
+            frames+=1
 
 
-    bar.update(iteration)
+        bar.update(iteration)
 
 # Clean up
-swi_ds.close()
-out.close()
+finally:
+    # Join the output thread before closing anything else it could race with
+    try:
+        if out != None:
+            out.close()
+    finally:
+        pp.close()
+        with NETCDF_LOCK:
+            swi_ds.close()
+        if gauges != None:
+            gauges.close()
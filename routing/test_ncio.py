@@ -0,0 +1,51 @@
+from netCDF4 import Dataset
+from ncio import SWIForcing, forcing_day
+import numpy as np
+
+
+def test_forcing_day_follows_elapsed_time(tmp_path):
+    """
+    Steps through four days of adaptive time steps on three days of forcing
+    the same way the runners do, checking the day used at every step.
+    """
+    fname = str(tmp_path / 'swi.nc')
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('y', 2)
+        ds.createDimension('x', 2)
+        swi = ds.createVariable('SWI', 'f8', ('time', 'y', 'x'))
+        swi[:] = np.arange(3)[:, None, None] * np.ones((3, 2, 2)) * 86400000.0
+
+    pp = SWIForcing(fname, window=1)
+    try:
+        rng = np.random.RandomState(0)
+        elapsed_time = 0.0
+        pp_t = 0
+        precip = pp[pp_t]
+        days = set()
+
+        while elapsed_time < 4 * 86400.0:
+            if forcing_day(elapsed_time, len(pp)) != pp_t:
+                pp_t = forcing_day(elapsed_time, len(pp))
+                precip = pp[pp_t]
+
+            expected = min(int(elapsed_time / 86400.0), 2)
+            assert pp_t == expected
+            assert np.all(precip == expected)
+            days.add(pp_t)
+
+            elapsed_time += rng.uniform(60.0, 7200.0)
+
+    finally:
+        pp.close()
+
+    assert days == {0, 1, 2}
+
+
+def test_forcing_day_boundaries():
+    assert forcing_day(0.0, 3) == 0
+    assert forcing_day(1.0, 3) == 0
+    assert forcing_day(86399.9, 3) == 0
+    assert forcing_day(86400.0, 3) == 1
+    assert forcing_day(3 * 86400.0, 3) == 2
+    assert forcing_day(10 * 86400.0, 3) == 2